@@ -1,112 +1,32 @@
 import streamlit as st
-import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from io import BytesIO
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from datetime import datetime
-import requests
+import uuid
+import os
+import time
+import json
 
+from avacare.confirmation import confirmation_filename
+from avacare.engine import (
+    ASK_IDENTITY, ASK_SYMPTOMS, CHOOSE_LANGUAGE, CHOOSE_MODE, CONFIRMED, GET_NEW_INFO, GET_RETURNING_INFO,
+    GREETING, GREETINGS, MAIN_MENU, PAYMENT, ROUGH, SELECT_DOCTOR, SNOW, VOICE_CONVERSATION, WEATHER_CHECK,
+    BookingEngine, Services, advance, missed_count, new_patient_row, new_session, new_session_token,
+)
+from avacare.metrics import REGISTRY, span
+from avacare.voice import DONE, PENDING, audio_to_wav_bytes
 
-# -------------------- GOOGLE SHEETS SETUP --------------------
 
-@st.cache_resource
-def connect_to_patient_sheet():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(st.secrets["gcp_service_account"], scope)
-    client = gspread.authorize(creds)
-    return client.open_by_key("1aFhExzz3_BTNDzJ2h37YqxK6ij8diJCTbAwsPcdJQtM")  # Patient Sheet
+# -------------------- ENGINE SETUP --------------------
 
 @st.cache_resource
-def connect_to_doctor_sheet():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(st.secrets["gcp_service_account"], scope)
-    client = gspread.authorize(creds)
-    return client.open_by_key("1VVMGuKFvLokIEvFC6DIfnDqAvWCJ-A_fUaiIc_yUf8w")  # Doctor Sheet
-
-def get_weather_forecast(city_raw):
-    api_key = st.secrets["weather_api"]["api_key"]
-    city_parts = city_raw.split(',')
-    city = city_parts[1].strip() if len(city_parts) > 1 else city_raw.strip()
-    url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        weather_desc = data["weather"][0]["description"].title()
-        temperature = data["main"]["temp"]
-        return f"The current weather in {city} is {weather_desc} with a temperature of {temperature}°C."
-    except Exception as e:
-        return f"⚠️ Could not fetch weather data: {str(e)}"
-
-def predict_no_show_risk(patient_record, weather_message, selected_slot):
-    risk_score = 0
-    missed = int(str(patient_record.get("Missed_Appointments", "0")).strip())
-    if missed >= 2:
-        risk_score += 2
-    elif missed == 1:
-        risk_score += 1
-    category = patient_record.get("Risk_Category", "").lower()
-    if "high" in category:
-        risk_score += 2
-    elif "moderate" in category:
-        risk_score += 1
-    if "rain" in weather_message.lower() or "storm" in weather_message.lower():
-        risk_score += 2
-    elif "snow" in weather_message.lower():
-        risk_score += 1
-    try:
-        hour = int(selected_slot.split()[1].split(":")[0])
-        if hour < 10:
-            risk_score += 1
-    except:
-        pass
-    if risk_score >= 5:
-        return "⚠️ High Risk of No-Show"
-    elif risk_score >= 3:
-        return "🟠 Moderate Risk of No-Show"
-    else:
-        return "✅ Low Risk of No-Show"
-
-# -------------------- FUNCTIONS --------------------
-
-def get_next_patient_id(sheet):
-    records = sheet.worksheet("Sheet1").get_all_records()
-    if not records:
-        return "AVP-4000"
-    last_id = sorted(records, key=lambda r: int(r["Patient_ID"].split("-")[1]))[-1]["Patient_ID"]
-    new_number = int(last_id.split("-")[1]) + 1
-    return f"AVP-{new_number}"
-
-def load_patient_dataframe(sheet):
-    records = sheet.worksheet("Sheet1").get_all_records()
-    return pd.DataFrame(records)
-
-def register_new_patient(sheet, row_data):
-    sheet.worksheet("Sheet1").append_row(row_data)
-
-def load_doctor_data():
-    sheet = connect_to_doctor_sheet()
-    info = sheet.worksheet("Doctor_Info").get_all_records()
-    avail = sheet.worksheet("Doctor_Availability").get_all_records()
-    return pd.DataFrame(info), pd.DataFrame(avail)
-
-def mark_slot_as_filled(doctor_name, slot_datetime):
-    sheet = connect_to_doctor_sheet()
-    ws = sheet.worksheet("Doctor_Availability")
-    data = ws.get_all_values()
-    headers, rows = data[0], data[1:]
-    doc_idx = headers.index("Doctor_Name")
-    date_idx = headers.index("Date")
-    time_idx = headers.index("Start_Time")
-    status_idx = headers.index("Slot_Status")
-
-    slot_date, slot_time = slot_datetime.split(" ")
-    for i, row in enumerate(rows):
-        if row[doc_idx] == doctor_name and row[date_idx] == slot_date and row[time_idx] == slot_time:
-            ws.update_cell(i + 2, status_idx + 1, "Filled")
-            return
+def get_engine():
+    # One engine per process; every session and rerun shares its caches
+    services = Services.from_env(
+        lambda: st.secrets["gcp_service_account"],
+        lambda: st.secrets["weather_api"]["api_key"],
+        lambda: st.secrets["openai_api_key"],
+    )
+    return BookingEngine(services)
+
+engine = get_engine()
 
 # -------------------- UI SETUP --------------------
 
@@ -114,463 +34,503 @@ st.set_page_config(page_title="AVACARE Assistant", page_icon="💼")
 st.markdown("<h1 style='color:#002B5B;'>AVACARE Virtual Assistant</h1>", unsafe_allow_html=True)
 
 if "chat_state" not in st.session_state:
-    st.session_state.chat_state = "choose_mode"
-    st.session_state.mode = None
-    st.session_state.language = None
-    st.session_state.name = ""
-    st.session_state.patient_id = ""
-    st.session_state.is_returning = None
-    st.session_state.recommended_specialty = ""
-
-def go_back_to(state, key=None):
+    for key, value in new_session().items():
+        st.session_state[key] = value
+
+def get_session_id():
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+
+# With several replicas a session token travels in the URL (?sid=) and the progress in the shared store,
+# so a reconnect that lands on another replica picks up where the patient left off. The token is
+# random and single-use; the session ID that holds slots and patient IDs never leaves the server
+if engine.shares_state and "session_token" not in st.session_state:
+    token = st.query_params.get("sid")
+    if not (token and engine.restore_session(token, st.session_state)):
+        st.session_state.session_token = new_session_token()
+    st.query_params["sid"] = st.session_state.session_token
+
+def render_admin_page():
+    import pandas as pd
+
+    st.subheader("Latency")
+    rows = REGISTRY.snapshot()
+    if rows:
+        table = pd.DataFrame([
+            {"span": r["name"], "labels": ", ".join(f"{k}={v}" for k, v in r["labels"].items()),
+             "count": r["count"], "errors": r["errors"],
+             **{q: round(r[f"{q}_s"] * 1000, 1) for q in ("p50", "p95", "p99")}}
+            for r in rows
+        ])
+        st.caption("Latencies in milliseconds since the process started.")
+        st.dataframe(table, hide_index=True)
+    else:
+        st.info("No spans recorded yet.")
+    st.download_button("Prometheus text", REGISTRY.to_prometheus(), "avacare_metrics.prom", "text/plain")
+    st.download_button("JSONL", REGISTRY.to_jsonl(), "avacare_metrics.jsonl", "application/jsonl")
+
+    # Read from counters the engine keeps current on every booking and registration, not from the sheets
+    st.subheader("Clinic")
+    analytics = engine.analytics()
+    totals = analytics.totals()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Slots filled", f"{totals['filled']} / {totals['slots']}", f"{totals['fill_rate']:.0%}", "off")
+    col2.metric("Patients", totals["patients"])
+    col3.metric("Missed an appointment", f"{totals['no_show_rate']:.0%}")
+
+    def percent_table(rows, rate):
+        table = pd.DataFrame(rows)
+        if not table.empty:
+            table[rate] = (table[rate] * 100).round(1)
+        return table.rename(columns={rate: f"{rate} %"})
+
+    st.markdown("**Utilisation per doctor**")
+    st.dataframe(percent_table(analytics.doctor_utilisation(), "utilisation"), hide_index=True)
+    st.markdown("**Fill rate per specialty**")
+    st.dataframe(percent_table(analytics.specialty_fill_rate(), "fill_rate"), hide_index=True)
+    for column in analytics.groups:
+        st.markdown(f"**No-show rate by {column}**")
+        st.dataframe(percent_table(analytics.no_show_rate(column, top=20), "no_show_rate"), hide_index=True)
+    st.caption("No-show: at least one missed appointment. Largest 20 groups per column.")
+    st.download_button("Analytics JSON", json.dumps(analytics.snapshot()), "avacare_analytics.json",
+                       "application/json")
+
+    st.subheader("Write queue")
+    problems = engine.write_queue_problems()
+    if problems is None:
+        st.info("Writes go straight to storage; nothing is queued.")
+        return
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Queued", problems["depth"])
+    col2.metric("Failed", len(problems["failed"]))
+    col3.metric("Slot conflicts", len(problems["conflicts"]))
+
+    def when(timestamp):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+    if problems["failed"]:
+        st.markdown("**Failed writes**")
+        st.dataframe(pd.DataFrame([
+            {"id": m["id"], "kind": m["kind"],
+             "write": m["payload"]["row"][0] if "row" in m["payload"]
+             else f"row {m['payload']['row_number']} → {m['payload']['status']}",
+             "attempts": m["attempts"], "last error": m["last_error"], "queued": when(m["created_at"])}
+            for m in problems["failed"]
+        ]), hide_index=True)
+        st.caption("Retried every few minutes until they reach the sheet; queued patients can still log in.")
+    if problems["conflicts"]:
+        st.markdown("**Slot conflicts**")
+        st.dataframe(pd.DataFrame([
+            {"slot": " ".join(c["payload"].get("key") or [f"row {c['payload']['row_number']}"]),
+             "wanted": c["payload"]["status"], "seen": when(c["seen_at"]),
+             "bookings to follow up": ", ".join(f"{b.name} ({b.patient_id})" for b in c["bookings"])}
+            for c in problems["conflicts"]
+        ]), hide_index=True)
+        st.caption("The sheet already held another status when these writes were flushed.")
+
+def go_back_to(state, key=None, on_leave=None):
     if st.button("⬅️ Go Back", key=key or f"go_back_{state}"):
-        st.session_state.chat_state = state
+        if on_leave:
+            on_leave()
+        advance(st.session_state, state)
         st.rerun()
 
 # -------------------- Step-by-step Flow --------------------
 
-if st.session_state.chat_state == "choose_mode":
-    st.subheader("Step 1: Choose your communication mode")
-    col1, col2, col3 = st.columns(3)
-    if col1.button("Chat"):
-        st.session_state.mode = "chat"
-        st.session_state.chat_state = "choose_language"
-        st.rerun()
-    if col2.button("Voice"):
-        st.session_state.mode = "voice"
-        st.session_state.chat_state = "choose_language"
-        st.rerun()
-    if col3.button("Call"):
-        st.session_state.mode = "call"
-        st.session_state.chat_state = "choose_language"
-        st.rerun()
-
-elif st.session_state.chat_state == "choose_language":
-    st.subheader("Step 2: Choose your language")
-    st.session_state.language = st.radio("Preferred Language:", ["English", "Hindi", "Spanish"])
-
-    col1, col2 = st.columns(2)
-    if col1.button("Continue"):
-        if st.session_state.mode == "voice":
-            st.session_state.chat_state = "voice_conversation"
-        else:
-            st.session_state.chat_state = "greeting"
-        st.rerun()
-
-    if col2.button("⬅️ Go Back to Mode"):
-        st.session_state.chat_state = "choose_mode"
-        st.rerun()
-
-
-elif st.session_state.chat_state == "greeting":
-    greetings = {
-        "English": "Hi, how are you doing today?",
-        "Hindi": "नमस्ते, आज आप कैसे हैं?",
-        "Spanish": "Hola, ¿cómo estás hoy?"
-    }
-    st.subheader("Conversation")
-    st.markdown(f"**AVA:** {greetings[st.session_state.language]}")
-    user_reply = st.text_input("Your Response:")
-    if user_reply:
-        st.session_state.chat_state = "ask_identity"
-        st.rerun()
-
-elif st.session_state.chat_state == "voice_conversation":
-    from streamlit_audiorecorder import audiorecorder
-    import openai
-    import tempfile
-    import os
-    from pydub import AudioSegment
-
-    openai.api_key = st.secrets["openai_api_key"]
-
-    st.subheader("🎙️ AVA Voice Assistant (Mic + Whisper)")
-    st.write("Click below to record your voice:")
-
-    # Record voice
-    audio_bytes = audiorecorder("Click to record", "🎤", key="audio_key")
-
-    if audio_bytes:
-        st.audio(audio_bytes, format="audio/wav")
-
-        # Save to WAV
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio_file:
-            temp_audio_file.write(audio_bytes)
-            temp_audio_path = temp_audio_file.name
-
-        # Convert to MP3
-        audio = AudioSegment.from_wav(temp_audio_path)
-        mp3_path = temp_audio_path.replace(".wav", ".mp3")
-        audio.export(mp3_path, format="mp3")
-
-        # Transcribe
-        with open(mp3_path, "rb") as f:
-            st.write("Transcribing...")
-            transcript = openai.Audio.transcribe("whisper-1", f)
-            spoken_text = transcript['text']
-            st.success("✅ Transcription Complete")
-            st.markdown(f"**You said:** {spoken_text}")
-
-        os.remove(temp_audio_path)
-        os.remove(mp3_path)
-
-        st.session_state.chat_state = "ask_identity"
-        st.rerun()
-
-
-
-
-elif st.session_state.chat_state == "ask_identity":
-    st.subheader("Are you a returning patient?")
-    col1, col2 = st.columns(2)
-    if col1.button("Yes"):
-        st.session_state.is_returning = True
-        st.session_state.chat_state = "get_returning_info"
-        st.rerun()
-    if col2.button("No"):
-        st.session_state.is_returning = False
-        st.session_state.chat_state = "get_new_info"
-        st.rerun()
-
-elif st.session_state.chat_state == "get_returning_info":
-    sheet = connect_to_patient_sheet()
-    df = load_patient_dataframe(sheet)
-
-    st.subheader("🔁 Welcome Back! Please enter your details")
-    name = st.text_input("Full Name")
-    pid = st.text_input("Patient ID (e.g., AVP-4001)")
-
-    if name and pid:
-        match = df[df["Patient_ID"] == pid]
-
-        if not match.empty:
-            st.session_state.name = name
-            st.session_state.patient_id = pid
-
-            # ✅ Adjusted field names to your sheet
-            last_date = match.iloc[0].get("Last_Appointment_Date", "")
-            missed_count = match.iloc[0].get("Missed_Appointments", 0)
-            missed_reason = match.iloc[0].get("Missed_Appointment_Reason", "")
-
-            st.success("✅ Patient verified.")
+# Hidden admin page: ?admin=<AVACARE_ADMIN_TOKEN>; off when the token is not set
+admin_token = os.environ.get("AVACARE_ADMIN_TOKEN")
+if admin_token and st.query_params.get("admin") == admin_token:
+    render_admin_page()
+    st.stop()
+
+with span("state", state=st.session_state.chat_state), engine.saving_session(st.session_state):
+    if st.session_state.chat_state == CHOOSE_MODE:
+        st.subheader("Step 1: Choose your communication mode")
+        col1, col2, col3 = st.columns(3)
+        if col1.button("Chat"):
+            st.session_state.mode = "chat"
+            advance(st.session_state, CHOOSE_LANGUAGE)
+            st.rerun()
+        if col2.button("Voice"):
+            st.session_state.mode = "voice"
+            advance(st.session_state, CHOOSE_LANGUAGE)
+            st.rerun()
+        if col3.button("Call"):
+            st.session_state.mode = "call"
+            advance(st.session_state, CHOOSE_LANGUAGE)
+            st.rerun()
 
-            try:
-                if int(missed_count) > 0:
-                    st.warning(
-                        f"Hi {name}, I see that your last appointment was on **{last_date}**, "
-                        f"but it was marked as **missed**. You had mentioned: _'{missed_reason}'_.\n\n"
-                        "Hope everything’s okay — let’s make sure we don’t miss the next one! 😊"
-                    )
-            except:
-                pass
+    elif st.session_state.chat_state == CHOOSE_LANGUAGE:
+        st.subheader("Step 2: Choose your language")
+        st.session_state.language = st.radio("Preferred Language:", ["English", "Hindi", "Spanish"])
 
-            st.session_state.chat_state = "main_menu"
+        col1, col2 = st.columns(2)
+        if col1.button("Continue"):
+            if st.session_state.mode == "voice":
+                advance(st.session_state, VOICE_CONVERSATION)
+            else:
+                advance(st.session_state, GREETING)
             st.rerun()
-        else:
-            st.error("❌ Patient ID not found. Please check and try again.")
-
-    go_back_to("ask_identity")
-
-elif st.session_state.chat_state == "get_new_info":
-    st.subheader("📝 Register as a New Patient")
-
-    sheet = connect_to_patient_sheet()
-    ws = sheet.worksheet("Sheet1")
-    new_id = get_next_patient_id(sheet)
-    st.write(f"Your Patient ID will be: **{new_id}**")
-
-    fname = st.text_input("First Name")
-    lname = st.text_input("Last Name")
-    gender = st.selectbox("Gender", ["Male", "Female", "Other"])
-    age = st.number_input("Age", min_value=0, max_value=120)
-    symptom = st.text_input("Symptoms")
-    contact = st.text_input("Contact Number")
-    email = st.text_input("Email Address")
-    insurance = st.selectbox("Insurance Type", ["Private", "Public", "Self-Pay"])
-    preferred_lang = st.selectbox("Preferred Communication Language", ["English", "Hindi", "Spanish"])
-    caregiver = st.radio("Do you need caregiver assistance?", ["Yes", "No"])
-    emergency_contact_name = st.text_input("Emergency Contact Name")
-    emergency_contact_phone = st.text_input("Emergency Contact Phone")
-
-    if st.button("Register"):
-        row = [
-            new_id, fname, lname, gender, age, symptom, contact, email, insurance,
-            preferred_lang, caregiver, emergency_contact_name, emergency_contact_phone
-        ]
-        ws.append_row(row)
-        st.session_state.name = fname
-        st.session_state.patient_id = new_id
-        st.success(f"🎉 Welcome {fname}! Your Patient ID is {new_id}")
-        st.session_state.chat_state = "main_menu"
-        st.rerun()
 
-    go_back_to("ask_identity")
+        if col2.button("⬅️ Go Back to Mode"):
+            advance(st.session_state, CHOOSE_MODE)
+            st.rerun()
 
 
+    elif st.session_state.chat_state == GREETING:
+        st.subheader("Conversation")
+        st.markdown(f"**AVA:** {GREETINGS[st.session_state.language]}")
+        user_reply = st.text_input("Your Response:")
+        if user_reply:
+            advance(st.session_state, ASK_IDENTITY)
+            st.rerun()
 
-# --- Step 6: Main Menu ---
-elif st.session_state.chat_state == "main_menu":
-    st.subheader(f"Welcome, {st.session_state.name} 👋")
-    st.markdown("What would you like to do?")
+    elif st.session_state.chat_state == VOICE_CONVERSATION:
+        from streamlit_audiorecorder import audiorecorder
+
+        st.subheader("🎙️ AVA Voice Assistant (Mic + Whisper)")
+        job_id = st.session_state.get("transcription_job")
+
+        if job_id is None:
+            st.write("Click below to record your voice:")
+
+            # Record voice
+            audio = audiorecorder("Click to record", "🎤", key="audio_key")
+
+            if len(audio) > 0:
+                wav_bytes = audio_to_wav_bytes(audio)
+                st.audio(wav_bytes, format="audio/wav")
+                audio_hash = hash(wav_bytes)
+                failed_hash, error = st.session_state.get("transcription_error", (None, None))
+                if failed_hash == audio_hash:
+                    # Stays up until the patient retries or records something else
+                    st.error(f"⚠️ Could not transcribe your recording: {error}")
+                    send = st.button("Try again")
+                else:
+                    # The widget keeps returning the last recording; only send new ones
+                    send = st.session_state.get("transcribed_audio") != audio_hash
+                if send:
+                    st.session_state.pop("transcription_error", None)
+                    st.session_state.transcribed_audio = audio_hash
+                    st.session_state.transcription_job = engine.submit_recording(wav_bytes)
+                    st.rerun()
+        else:
+            job = engine.poll_transcription(job_id)
+            if job.state == PENDING:
+                st.write("Transcribing...")
+                time.sleep(0.5)
+                st.rerun()
+
+            del st.session_state.transcription_job
+            if job.state == DONE:
+                st.success("✅ Transcription Complete")
+                st.markdown(f"**You said:** {job.text}")
+                st.session_state.spoken_text = job.text
+                advance(st.session_state, ASK_IDENTITY)
+            else:
+                # Shown on the next run, next to the recording, which can then be sent again
+                st.session_state.transcription_error = (st.session_state.pop("transcribed_audio", None), str(job.error))
+            st.rerun()
 
-    option = st.selectbox("Choose an action", [
-        "📅 Book an Appointment",
-        "🧾 View Last Prescription (Coming Soon)",
-        "🔁 Reschedule an Appointment (Coming Soon)",
-        "📝 Update Contact Info (Coming Soon)",
-        "🚪 Exit"
-    ])
 
-    if st.button("Proceed"):
-        if option == "📅 Book an Appointment":
-            st.session_state.chat_state = "ask_symptoms"
-        elif option == "🚪 Exit":
-            st.success("Thank you for using AVACARE. Take care!")
-        else:
-            st.info("This feature is coming soon!")
-        st.rerun()
-        
-# --- STEP 1: Ask for Symptom ---
-
-elif st.session_state.chat_state == "ask_symptoms":
-    st.subheader("What symptoms are you experiencing?")
-    symptom = st.text_input("Enter your primary symptom (e.g., fever, back pain, toothache):")
-
-    if symptom:
-        symptom_map = {
-            "fever": "General Physician",
-            "cold": "General Physician",
-            "cough": "General Physician",
-            "headache": "General Physician",
-            "tooth": "Dentist",
-            "teeth": "Dentist",
-            "cavity": "Dentist",
-            "skin rash": "Dermatologist",
-            "acne": "Dermatologist",
-            "pimples": "Dermatologist",
-            "hairfall": "Dermatologist",
-            "ear pain": "ENT Specialist",
-            "nose": "ENT Specialist",
-            "throat": "ENT Specialist",
-            "child fever": "Pediatrics",
-            "child": "Pediatrics",
-            "anxiety": "Psychologist",
-            "pain during periods": "Gynecologist",
-            "pregnancy": "Gynecologist",
-            "back pain": "Orthopedic",
-            "muscle strain": "Physiotherapist"
-        }
-        specialty = symptom_map.get(symptom.lower())
-        if specialty:
-            st.session_state.recommended_specialty = specialty
-            st.success(f"You should consult a **{specialty}**.")
-            st.session_state.chat_state = "select_doctor"
+    elif st.session_state.chat_state == ASK_IDENTITY:
+        st.subheader("Are you a returning patient?")
+        col1, col2 = st.columns(2)
+        if col1.button("Yes"):
+            st.session_state.is_returning = True
+            advance(st.session_state, GET_RETURNING_INFO)
+            st.rerun()
+        if col2.button("No"):
+            st.session_state.is_returning = False
+            advance(st.session_state, GET_NEW_INFO)
             st.rerun()
-        else:
-            st.warning("Sorry, couldn't map the symptom. Try again.")
 
-# --- STEP 2: Doctor Selection ---
-elif st.session_state.chat_state == "select_doctor":
-    st.subheader("Select a Doctor and Slot")
+    elif st.session_state.chat_state == GET_RETURNING_INFO:
+        st.subheader("🔁 Welcome Back! Please enter your details")
+        name = st.text_input("Full Name")
+        pid = st.text_input("Patient ID (e.g., AVP-4001)")
+
+        if name and pid:
+            match = engine.find_patient(pid)
+
+            if match:
+                st.session_state.name = name
+                st.session_state.patient_id = pid
+
+                # ✅ Adjusted field names to your sheet
+                last_date = match.get("Last_Appointment_Date", "")
+                missed = match.get("Missed_Appointments", 0)
+                missed_reason = match.get("Missed_Appointment_Reason", "")
+
+                st.success("✅ Patient verified.")
+
+                try:
+                    if int(missed) > 0:
+                        st.warning(
+                            f"Hi {name}, I see that your last appointment was on **{last_date}**, "
+                            f"but it was marked as **missed**. You had mentioned: _'{missed_reason}'_.\n\n"
+                            "Hope everything’s okay — let’s make sure we don’t miss the next one! 😊"
+                        )
+                except:
+                    pass
+
+                advance(st.session_state, MAIN_MENU)
+                st.rerun()
+            else:
+                st.error("❌ Patient ID not found. Please check and try again.")
+
+        go_back_to(ASK_IDENTITY)
+
+    elif st.session_state.chat_state == GET_NEW_INFO:
+        st.subheader("📝 Register as a New Patient")
+
+        new_id = engine.reserve_patient_id(get_session_id())
+        st.write(f"Your Patient ID will be: **{new_id}**")
+
+        fname = st.text_input("First Name")
+        lname = st.text_input("Last Name")
+        gender = st.selectbox("Gender", ["Male", "Female", "Other"])
+        age = st.number_input("Age", min_value=0, max_value=120)
+        symptom = st.text_input("Symptoms")
+        contact = st.text_input("Contact Number")
+        email = st.text_input("Email Address")
+        insurance = st.selectbox("Insurance Type", ["Private", "Public", "Self-Pay"])
+        preferred_lang = st.selectbox("Preferred Communication Language", ["English", "Hindi", "Spanish"])
+        caregiver = st.radio("Do you need caregiver assistance?", ["Yes", "No"])
+        emergency_contact_name = st.text_input("Emergency Contact Name")
+        emergency_contact_phone = st.text_input("Emergency Contact Phone")
+
+        if st.button("Register"):
+            registered = engine.register_patient(new_patient_row(
+                new_id, fname, lname, gender, age, symptom, contact, email, insurance,
+                preferred_lang, caregiver, emergency_contact_name, emergency_contact_phone
+            ), holder=get_session_id())
+            if registered:
+                st.session_state.name = fname
+                st.session_state.patient_id = new_id
+                st.success(f"🎉 Welcome {fname}! Your Patient ID is {new_id}")
+                advance(st.session_state, MAIN_MENU)
+                st.rerun()
+            else:
+                # Another session registered this ID first; the next run reserves a fresh one
+                engine.release_patient_id(get_session_id())
+                st.error(f"⚠️ Patient ID {new_id} was just given to someone else. "
+                         "Please press Register again to get a new ID.")
+
+        # Leaving the form frees the ID for the next patient
+        go_back_to(ASK_IDENTITY, on_leave=lambda: engine.release_patient_id(get_session_id()))
+
+
+
+    # --- Step 6: Main Menu ---
+    elif st.session_state.chat_state == MAIN_MENU:
+        st.subheader(f"Welcome, {st.session_state.name} 👋")
+        st.markdown("What would you like to do?")
+
+        option = st.selectbox("Choose an action", [
+            "📅 Book an Appointment",
+            "🧾 View Last Prescription (Coming Soon)",
+            "🔁 Reschedule an Appointment (Coming Soon)",
+            "📝 Update Contact Info (Coming Soon)",
+            "🚪 Exit"
+        ])
+
+        if st.button("Proceed"):
+            if option == "📅 Book an Appointment":
+                advance(st.session_state, ASK_SYMPTOMS)
+            elif option == "🚪 Exit":
+                st.success("Thank you for using AVACARE. Take care!")
+            else:
+                st.info("This feature is coming soon!")
+            st.rerun()
+        
+    # --- STEP 1: Ask for Symptom ---
+
+    elif st.session_state.chat_state == ASK_SYMPTOMS:
+        st.subheader("What symptoms are you experiencing?")
+        symptom = st.text_input("Enter your symptoms (e.g., fever, back pain, toothache):")
+
+        if symptom:
+            specialty = engine.specialty_for(symptom)
+            if specialty:
+                st.session_state.recommended_specialty = specialty
+                st.success(f"You should consult a **{specialty}**.")
+                advance(st.session_state, SELECT_DOCTOR)
+                st.rerun()
+            else:
+                st.warning("Sorry, couldn't map the symptom. Try again.")
 
-    doctor_df, availability_df = load_doctor_data()
-    filtered_doctors = doctor_df[doctor_df["Specialty"] == st.session_state.recommended_specialty]
+    # --- STEP 2: Doctor Selection ---
+    elif st.session_state.chat_state == SELECT_DOCTOR:
+        st.subheader("Select a Doctor and Slot")
 
-    if filtered_doctors.empty:
-        st.error("No doctors available.")
-        go_back_to("main_menu")
-    else:
-        selected_doctor = st.selectbox("Choose Doctor", filtered_doctors["Doctor_Name"])
-        doctor_id = filtered_doctors[filtered_doctors["Doctor_Name"] == selected_doctor]["Doctor_ID"].values[0]
-        slots = availability_df[
-            (availability_df["Doctor_ID"] == doctor_id) & 
-            (availability_df["Slot_Status"] == "Open")
-        ]
+        filtered_doctors = engine.doctors(st.session_state.recommended_specialty)
 
-        if not slots.empty:
-            slot_options = slots["Date"] + " " + slots["Start_Time"]
-            selected_slot = st.selectbox("Choose Slot", slot_options)
+        if not filtered_doctors:
+            st.error("No doctors available.")
+            go_back_to(MAIN_MENU)
+        else:
+            doctor_ids = {d["Doctor_Name"]: d["Doctor_ID"] for d in filtered_doctors}
+            selected_doctor = st.selectbox("Choose Doctor", list(doctor_ids))
+            slots = engine.open_slots(doctor_ids[selected_doctor])
 
-            if st.button("Confirm Appointment"):
-               st.session_state.selected_doctor = selected_doctor
-               st.session_state.selected_slot = selected_slot
-               st.session_state.chat_state = "weather_check"
-               st.rerun()
+            if slots:
+                slot_options = [slot["label"] for slot in slots]
+                selected_slot = st.selectbox("Choose Slot", slot_options)
 
+                if st.button("Confirm Appointment"):
+                   st.session_state.selected_doctor = selected_doctor
+                   st.session_state.selected_slot = selected_slot
+                   advance(st.session_state, WEATHER_CHECK)
+                   st.rerun()
 
-# --- STEP 2.5: Weather Check (after slot confirmation) ---
-elif st.session_state.chat_state == "weather_check":
-    st.subheader("🌦️ Weather Check")
 
-    sheet = connect_to_patient_sheet()
-    patients_df = load_patient_dataframe(sheet)
+    # --- STEP 2.5: Weather Check (after slot confirmation) ---
+    elif st.session_state.chat_state == WEATHER_CHECK:
+        st.subheader("🌦️ Weather Check")
 
-    try:
-        patient_record = patients_df[patients_df["Patient_ID"] == st.session_state.patient_id]
-        travel_city = patient_record.iloc[0].get("Traveling_From", "Dallas")
-        weather_message = get_weather_forecast(travel_city)
-        # ✅ AI No-Show Risk Prediction
-        risk_msg = predict_no_show_risk(patient_record.iloc[0], weather_message, st.session_state.selected_slot)
-        st.info(f"🧠 No-Show Risk Prediction: {risk_msg}")
+        try:
+            patient_record = engine.find_patient(st.session_state.patient_id)
+            visit = engine.assess_visit(patient_record, st.session_state.selected_slot)
+            # ✅ AI No-Show Risk Prediction
+            st.info(f"🧠 No-Show Risk Prediction: {visit.risk_message}")
+            if visit.no_show_probability is not None:
+                st.caption(f"Model estimate: {visit.no_show_probability:.0%} chance of a missed appointment")
 
 
-        st.info(f"📍 Travel City: {travel_city}")
-        st.info(f"🌤️ Weather Forecast: {weather_message}")
+            st.info(f"📍 Travel City: {visit.city}")
+            st.info(f"🌤️ Weather Forecast: {visit.weather_message}")
 
-        if "rain" in weather_message.lower() or "storm" in weather_message.lower():
-            st.warning("🌧️ It looks like the weather may be rough. You may consider booking a **telehealth** consultation or **rescheduling** your appointment.")
-        elif "snow" in weather_message.lower():
-            st.warning("❄️ Snowy conditions detected. A remote consultation might be safer.")
-        else:
-            st.success("🌤️ Weather looks good for travel. You're all set!")
+            if visit.advisory == ROUGH:
+                st.warning("🌧️ It looks like the weather may be rough. You may consider booking a **telehealth** consultation or **rescheduling** your appointment.")
+            elif visit.advisory == SNOW:
+                st.warning("❄️ Snowy conditions detected. A remote consultation might be safer.")
+            else:
+                st.success("🌤️ Weather looks good for travel. You're all set!")
 
-    except Exception as e:
-        st.warning(f"⚠️ Unable to fetch weather info: {e}")
+        except Exception as e:
+            st.warning(f"⚠️ Unable to fetch weather info: {e}")
 
-    if st.button("Continue to Payment", key="weather_to_payment"):
-       st.session_state.chat_state = "payment"
-       st.rerun()
+        if st.button("Continue to Payment", key="weather_to_payment"):
+           advance(st.session_state, PAYMENT)
+           st.rerun()
 
 
-    go_back_to("select_doctor", key="go_back_from_weather")  # optional, gives back navigation
+        go_back_to(SELECT_DOCTOR, key="go_back_from_weather")  # optional, gives back navigation
     
 
-# --- STEP 3: Payment ---
-elif st.session_state.chat_state == "payment":
-    st.subheader("💳 Token Payment")
-    st.write("To confirm your appointment, please pay a **25% token**.")
+    # --- STEP 3: Payment ---
+    elif st.session_state.chat_state == PAYMENT:
+        st.subheader("💳 Token Payment")
+        st.write("To confirm your appointment, please pay a **25% token**.")
 
-    st.session_state.selected_payment_mode = st.radio(
-        "Choose a Payment Mode", 
-        ["UPI", "Net Banking", "Credit Card", "Debit Card", "PayPal", "Insurance"]
-    )
-    paid = st.checkbox("✅ I have paid.")
-
-    if paid:
-        mark_slot_as_filled(
-            st.session_state.selected_doctor,
-            st.session_state.selected_slot
+        st.session_state.selected_payment_mode = st.radio(
+            "Choose a Payment Mode", 
+            ["UPI", "Net Banking", "Credit Card", "Debit Card", "PayPal", "Insurance"]
         )
-        st.session_state.chat_state = "confirmed"
-        st.rerun()
-
-    go_back_to("main_menu", key="go_back_from_payment")
-
-# --- STEP 4: Confirmation ---
-elif st.session_state.chat_state == "confirmed":
-    from io import BytesIO
-    from datetime import datetime
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import A4
+        # Held for this session while it pays, so a patient on another replica cannot pay for it too
+        held = engine.hold_slot(st.session_state.selected_doctor, st.session_state.selected_slot, get_session_id())
+        paid = st.checkbox("✅ I have paid.", disabled=not held)
+
+        if not held:
+            st.error("⏳ Another patient is paying for this slot right now. Please choose another slot.")
+            go_back_to(SELECT_DOCTOR, key="go_back_slot_held")
+        elif paid:
+            booked = engine.book(
+                st.session_state.selected_doctor,
+                st.session_state.selected_slot,
+                holder=get_session_id(),
+            )
+            if booked:
+                advance(st.session_state, CONFIRMED)
+                st.rerun()
+            else:
+                st.error("❌ Sorry, this slot was just booked by someone else. Please choose another slot.")
+                go_back_to(SELECT_DOCTOR, key="go_back_slot_taken")
 
-    st.balloons()
-    st.subheader("✅ Appointment Confirmed!")
-    st.success("Thank you for using AVACARE!")
+        go_back_to(MAIN_MENU, key="go_back_from_payment")
 
-    # --- Patient History ---
-    sheet = connect_to_patient_sheet()
-    df = load_patient_dataframe(sheet)
-    patient = df[df["Patient_ID"] == st.session_state.patient_id]
+    # --- STEP 4: Confirmation ---
+    elif st.session_state.chat_state == CONFIRMED:
+        st.balloons()
+        st.subheader("✅ Appointment Confirmed!")
+        st.success("Thank you for using AVACARE!")
 
-    if not patient.empty:
-        last_date = patient.iloc[0].get("Last_Appointment_Date", "N/A")
-        missed = patient.iloc[0].get("Missed_Appointments", "0")
-        reason = patient.iloc[0].get("Missed_Appointment_Reason", "")
+        # --- Patient History ---
+        patient = engine.find_patient(st.session_state.patient_id)
+        reason = ""
 
-        missed_count = int(str(missed).strip()) if str(missed).strip().isdigit() else 0
+        if patient:
+            last_date = patient.get("Last_Appointment_Date", "N/A")
+            reason = patient.get("Missed_Appointment_Reason", "")
 
-        if missed_count > 0:
-            st.warning(f"⚠️ I see you had an appointment on **{last_date}** but missed it.\n\n_Reason given:_ **{reason}**\n\nLet’s make sure we meet this time. We're here to help! 😊")
+            if missed_count(patient) > 0:
+                st.warning(f"⚠️ I see you had an appointment on **{last_date}** but missed it.\n\n_Reason given:_ **{reason}**\n\nLet’s make sure we meet this time. We're here to help! 😊")
 
-            if "transportation" in reason.lower():
-                slot_date = st.session_state.selected_slot.split()[0]
-                st.info(f"🚗 As a token of support, we’re providing you with a **40% Uber voucher** valid until your new appointment on **{slot_date}**. Safe travels! 🎟️")
+                if "transportation" in reason.lower():
+                    slot_date = st.session_state.selected_slot.split()[0]
+                    st.info(f"🚗 As a token of support, we’re providing you with a **40% Uber voucher** valid until your new appointment on **{slot_date}**. Safe travels! 🎟️")
 
-            # --- Smart Rescheduler Suggestion ---
-            st.info("🔁 Since you missed a previous appointment, here are the next best available slots:")
+                # --- Smart Rescheduler Suggestion ---
+                st.info("🔁 Since you missed a previous appointment, here are the next best available slots:")
             
-            # ✅ FIX: Load doctor data
-            doctor_df, availability_df = load_doctor_data()
-            doc_id = doctor_df[doctor_df["Doctor_Name"] == st.session_state.selected_doctor]["Doctor_ID"].values[0]
-            open_slots = availability_df[
-                (availability_df["Doctor_ID"] == doc_id) &
-                (availability_df["Slot_Status"] == "Open")
-            ].sort_values(by=["Date", "Start_Time"]).head(3)
-
-            if not open_slots.empty:
-                slot_labels = open_slots["Date"] + " " + open_slots["Start_Time"]
-                new_slot = st.radio("📅 Choose a new slot to reschedule:", slot_labels.tolist(), key="resched_radio")
-
-                if st.button("Reschedule to This Slot", key="resched_button"):
-                    mark_slot_as_filled(st.session_state.selected_doctor, new_slot)
-                    st.session_state.selected_slot = new_slot
-                    st.success(f"✅ Appointment rescheduled to {new_slot}")
-                    st.rerun()
-            else:
-                st.warning("No alternative slots available right now. Please try again later.")
-
-        else:
-            st.info(f"🎉 Great record! No missed appointments so far. Keep it up, {st.session_state.name}!")
-
-    # --- Appointment Summary ---
-    st.write(f"Doctor: {st.session_state.selected_doctor}")
-    st.write(f"Slot: {st.session_state.selected_slot}")
-    st.write(f"Payment Mode: {st.session_state.selected_payment_mode}")
-
-    # --- PDF Confirmation ---
-    required_keys = [
-        "name", "patient_id", "selected_doctor",
-        "recommended_specialty", "selected_slot", "selected_payment_mode"
-    ]
-
-    if all(key in st.session_state for key in required_keys):
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=A4)
-        w, h = A4
-        c.setFont("Helvetica-Bold", 18)
-        c.drawCentredString(w / 2, h - 80, "Appointment Confirmation")
-
-        c.setFont("Helvetica", 12)
-        y = h - 130
-        lines = [
-            f"Patient Name     : {st.session_state.name}",
-            f"Patient ID       : {st.session_state.patient_id}",
-            f"Doctor Name      : Dr. {st.session_state.selected_doctor}",
-            f"Specialty        : {st.session_state.recommended_specialty}",
-            f"Appointment Slot : {st.session_state.selected_slot}",
-            f"Payment Mode     : {st.session_state.selected_payment_mode}",
-            f"Confirmed At     : {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        ]
-        for line in lines:
-            c.drawString(60, y, line)
-            y -= 20
-
-        if "transportation" in reason.lower():
-            promo_code = f"UBER-{st.session_state.patient_id[:4]}-{st.session_state.selected_slot.split()[0].replace('-', '')}"
-            c.drawString(60, y - 20, "-" * 50)
-            c.setFont("Helvetica-Bold", 12)
-            c.drawString(60, y - 40, "🚗 Uber Travel Voucher")
-            c.setFont("Helvetica", 11)
-            c.drawString(60, y - 60, f"Voucher Code : {promo_code}")
-            c.drawString(60, y - 80, "Discount     : 40% off on your next Uber ride")
-            c.drawString(60, y - 100, f"Valid Until  : {st.session_state.selected_slot.split()[0]}")
-            c.drawString(60, y - 120, "Use this code in the Uber app during checkout.")
-            y -= 120
-
-        c.drawString(60, y - 40, "-" * 50)
-        c.drawString(60, y - 60, "Thank you for choosing AVACARE!")
-        c.save()
-        buffer.seek(0)
-
-        st.download_button(
-            label="📥 Download Confirmation PDF",
-            data=buffer,
-            file_name=f"AVACARE_Confirmation_{st.session_state.patient_id}.pdf",
-            mime="application/pdf"
-        )
-    else:
-        st.error("⚠️ Some appointment details are missing. Please complete booking before downloading the confirmation.")
+                # Ranked across every doctor of the specialty by wait, no-show risk and doctor load
+                recommendations = engine.recommend_slots(
+                    patient, st.session_state.recommended_specialty, 3, exclude={st.session_state.selected_slot}
+                )
+
+                if recommendations:
+                    options = {
+                        f"{rec.slot['label']} with {rec.slot['Doctor_Name']} ({rec.risk})": rec.slot
+                        for rec in recommendations
+                    }
+                    choice = st.radio("📅 Choose a new slot to reschedule:", list(options), key="resched_radio")
+
+                    if st.button("Reschedule to This Slot", key="resched_button"):
+                        new_slot = options[choice]
+                        if engine.reschedule(st.session_state.selected_doctor, st.session_state.selected_slot,
+                                             new_slot["Doctor_Name"], new_slot["label"], get_session_id()):
+                            st.session_state.selected_doctor = new_slot["Doctor_Name"]
+                            st.session_state.selected_slot = new_slot["label"]
+                            st.success(f"✅ Appointment rescheduled to {new_slot['label']}")
+                            st.rerun()
+                        else:
+                            st.error("❌ That slot was just taken. Please pick another one.")
+                else:
+                    st.warning("No alternative slots available right now. Please try again later.")
 
+            else:
+                st.info(f"🎉 Great record! No missed appointments so far. Keep it up, {st.session_state.name}!")
 
+        # --- Appointment Summary ---
+        st.write(f"Doctor: {st.session_state.selected_doctor}")
+        st.write(f"Slot: {st.session_state.selected_slot}")
+        st.write(f"Payment Mode: {st.session_state.selected_payment_mode}")
 
+        # --- PDF Confirmation ---
+        required_keys = [
+            "name", "patient_id", "selected_doctor",
+            "recommended_specialty", "selected_slot", "selected_payment_mode"
+        ]
 
+        if all(key in st.session_state for key in required_keys):
+            st.session_state.booking = booking = engine.confirm(
+                st.session_state.get("booking"),
+                st.session_state.name,
+                st.session_state.patient_id,
+                st.session_state.selected_doctor,
+                st.session_state.recommended_specialty,
+                st.session_state.selected_slot,
+                st.session_state.selected_payment_mode,
+                reason,
+            )
+
+            st.download_button(
+                label="📥 Download Confirmation PDF",
+                data=engine.confirmation_pdf(booking),
+                file_name=confirmation_filename(booking),
+                mime="application/pdf"
+            )
+        else:
+            st.error("⚠️ Some appointment details are missing. Please complete booking before downloading the confirmation.")
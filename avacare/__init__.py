@@ -0,0 +1 @@
+"""Core services behind the AVACARE scheduling assistant."""
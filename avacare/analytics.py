@@ -0,0 +1,188 @@
+"""Clinic analytics kept current as bookings and registrations happen.
+
+:class:`ClinicAnalytics` maintains group-by counters over the patient and
+availability tables instead of recomputing them from raw rows:
+
+* utilisation per doctor: filled slots / all slots of the doctor
+* fill rate per specialty: the same over every doctor of the specialty
+* no-show rate per ``Weather_Condition``, ``Traveling_From`` and
+  ``Insurance_Type``: the share of patients with at least one missed
+  appointment (the table does not record attended ones). ``Traveling_From``
+  holds a neighbourhood, city and state and is grouped by city, the way the
+  weather check reads it; the neighbourhoods are close to unique per patient
+
+It listens to the :class:`~avacare.slots.SlotIndex` (a booking or release
+moves one slot between the filled and open counters) and to the
+:class:`~avacare.patient_cache.PatientCache` (a registration adds one patient
+to three groups). Each update is ``O(1)``; the counters are only rebuilt when
+either table is reloaded in full. Each slot and patient remembers what it
+contributed, so a record reported twice, or changed, is counted once.
+
+Queries read the counters: a report is ``O(groups)``, not ``O(rows)``.
+:attr:`ClinicAnalytics.version` changes with every update, so a view can
+cache what it rendered until something changed.
+"""
+
+import threading
+
+from .slots import OPEN
+from .weather import normalize_city
+
+NO_SHOW_GROUPS = ("Weather_Condition", "Traveling_From", "Insurance_Type")
+
+# How a column's values are grouped; columns not listed group on the stripped value
+GROUP_VALUE = {"Traveling_From": normalize_city}
+
+
+def _missed(record):
+    try:
+        return float(record.get("Missed_Appointments") or 0) > 0
+    except ValueError:
+        return False
+
+
+def _group_value(record, column):
+    value = str(record.get(column, ""))
+    return GROUP_VALUE[column](value) if column in GROUP_VALUE else value.strip()
+
+
+def _rate(part, whole):
+    return part / whole if whole else 0.0
+
+
+class ClinicAnalytics:
+    def __init__(self, slots=(), patients=(), groups=NO_SHOW_GROUPS):
+        self.groups = tuple(groups)
+        self._lock = threading.RLock()
+        self.version = 0
+        self.slots_reloaded(slots)
+        self.patients_reloaded(patients)
+
+    @classmethod
+    def attach(cls, slot_index, patient_cache, groups=NO_SHOW_GROUPS):
+        """Build from the current tables and follow every later change."""
+        analytics = cls(slot_index.slots(), patient_cache.records(), groups)
+        slot_index.add_listener(analytics)
+        patient_cache.add_listener(analytics)
+        return analytics
+
+    # -------------------- SlotIndex hooks --------------------
+
+    def slots_reloaded(self, slots):
+        with self._lock:
+            self._slot_keys = {}
+            self._doctors = {}                  # Doctor_ID -> [name, specialty, slots, filled]
+            self._specialties = {}              # Specialty -> [slots, filled]
+            for slot in slots:
+                self._add_slot(slot)
+            self.version += 1
+
+    def slot_changed(self, slot):
+        with self._lock:
+            self._add_slot(slot)
+            self.version += 1
+
+    def _add_slot(self, slot):
+        key = (slot["Doctor_ID"], slot["Doctor_Name"], slot["Specialty"], slot["Slot_Status"] != OPEN)
+        previous = self._slot_keys.get(slot["row"])
+        if previous == key:
+            return
+        if previous is not None:
+            self._count_slot(previous, -1)
+        self._slot_keys[slot["row"]] = key
+        self._count_slot(key, 1)
+
+    def _count_slot(self, key, sign):
+        doctor_id, name, specialty, filled = key
+        doctor = self._doctors.setdefault(doctor_id, [name, specialty, 0, 0])
+        doctor[2] += sign
+        doctor[3] += sign * filled
+        counts = self._specialties.setdefault(specialty, [0, 0])
+        counts[0] += sign
+        counts[1] += sign * filled
+
+    # -------------------- PatientCache hooks --------------------
+
+    def patients_reloaded(self, records):
+        with self._lock:
+            self._patient_keys = {}
+            self._no_show = {column: {} for column in self.groups}   # column -> value -> [patients, no_shows]
+            self._no_shows = 0
+            for record in records:
+                self._add_patient(record)
+            self.version += 1
+
+    def patient_changed(self, record):
+        with self._lock:
+            self._add_patient(record)
+            self.version += 1
+
+    def _add_patient(self, record):
+        key = (_missed(record), *(_group_value(record, column) for column in self.groups))
+        patient_id = record.get("Patient_ID")
+        previous = self._patient_keys.get(patient_id)
+        if previous == key:
+            return
+        if previous is not None:
+            self._count_patient(previous, -1)
+        self._patient_keys[patient_id] = key
+        self._count_patient(key, 1)
+
+    def _count_patient(self, key, sign):
+        missed, *values = key
+        self._no_shows += sign * missed
+        for column, value in zip(self.groups, values):
+            counts = self._no_show[column].setdefault(value, [0, 0])
+            counts[0] += sign
+            counts[1] += sign * missed
+
+    # -------------------- reports --------------------
+
+    def doctor_utilisation(self):
+        """One row per doctor, busiest first."""
+        with self._lock:
+            rows = [
+                {"Doctor_ID": doctor_id, "Doctor_Name": name, "Specialty": specialty, "slots": total,
+                 "filled": filled, "utilisation": _rate(filled, total)}
+                for doctor_id, (name, specialty, total, filled) in self._doctors.items() if total
+            ]
+        return sorted(rows, key=lambda row: (-row["utilisation"], row["Doctor_ID"]))
+
+    def specialty_fill_rate(self):
+        """One row per specialty, fullest first."""
+        with self._lock:
+            rows = [
+                {"Specialty": specialty, "slots": total, "filled": filled, "fill_rate": _rate(filled, total)}
+                for specialty, (total, filled) in self._specialties.items() if total
+            ]
+        return sorted(rows, key=lambda row: (-row["fill_rate"], row["Specialty"]))
+
+    def no_show_rate(self, column, top=None, min_patients=1):
+        """One row per value of ``column``, most patients first; ``top`` keeps the largest groups."""
+        with self._lock:
+            rows = [
+                {column: value, "patients": patients, "no_shows": no_shows,
+                 "no_show_rate": _rate(no_shows, patients)}
+                for value, (patients, no_shows) in self._no_show[column].items() if patients >= min_patients
+            ]
+        rows.sort(key=lambda row: (-row["patients"], row[column]))
+        return rows[:top]
+
+    def totals(self):
+        with self._lock:
+            slots = sum(total for total, _ in self._specialties.values())
+            filled = sum(filled for _, filled in self._specialties.values())
+            patients, no_shows = len(self._patient_keys), self._no_shows
+        return {"slots": slots, "filled": filled, "fill_rate": _rate(filled, slots), "patients": patients,
+                "no_shows": no_shows, "no_show_rate": _rate(no_shows, patients)}
+
+    def snapshot(self, top=None):
+        """Every report in one JSON-serialisable dict."""
+        with self._lock:
+            return {
+                "version": self.version,
+                "totals": self.totals(),
+                "doctor_utilisation": self.doctor_utilisation(),
+                "specialty_fill_rate": self.specialty_fill_rate(),
+                "no_show_rate": {column: self.no_show_rate(column, top) for column in self.groups},
+            }
@@ -0,0 +1,402 @@
+"""Bulk patient import and export.
+
+``python -m avacare.bulk import partner.csv`` onboards a file with the
+columns of ``AVACARE_Patient_Dataset_Aligned.csv`` without going through the
+registration form one patient at a time. The file is streamed in chunks of
+``--chunk-size`` rows, so memory stays flat however large it is. For each
+chunk:
+
+* every field is validated and normalised (:func:`normalize_record`): phones
+  to ``+<digits>``, dates to the sheet's ``DD-MM-YYYY``, enum columns to their
+  canonical spelling (``self pay`` -> ``Self-pay``, ``f`` -> ``Female``)
+* valid rows get a block of consecutive ``AVP-`` IDs, from the shared counter
+  (:meth:`~avacare.shared_state.SharedState.reserve_block`) when
+  ``AVACARE_STATE_URL`` is set, so IDs never collide with registrations on a
+  live app; otherwise from the highest ID in the sheet
+* the block is written with one ``append_rows`` call, retried with backoff on
+  quota errors
+* rejected rows go to ``<file>.rejects.csv`` with the reason, and the new IDs
+  to ``<file>.ids.csv`` next to each source row and source ``Patient_ID``
+
+Progress is saved to ``<file>.checkpoint.json`` after every chunk. Running
+the same command again after an interruption resumes at the first unfinished
+chunk; a chunk that was being written is checked against the sheet and
+written again only if it never arrived, with the same IDs.
+
+``python -m avacare.bulk export --out patients.csv`` streams the patient
+table back out in the same layout, one chunk of records at a time.
+
+Both commands use the storage selected by ``AVACARE_STORAGE``.
+"""
+
+import csv
+import json
+import os
+import random
+import re
+import time
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+
+from .metrics import span
+from .patient_cache import FIRST_PATIENT_NUMBER, ID_PREFIX, PatientCache
+from .write_queue import is_quota_error
+
+PATIENT_COLUMNS = (
+    "Patient_ID", "First_Name", "Last_Name", "Gender", "Age", "Symptoms", "Suggested_Specialty",
+    "Traveling_From", "Appointment_Date", "Weather_Condition", "Insurance_Type", "Phone", "Email",
+    "Emergency_Contact_Name", "Emergency_Contact_Number", "Preferred_Communication_Type",
+    "Preferred_Communication_Language", "Missed_Appointments", "Risk_Category", "Token_Payment_Status",
+    "Missed_Appointment_Reason", "Caregiver_Assistance_Needed", "Uber_Voucher_Needed",
+    "Next_Appointment_Date", "Returning_or_Fresh",
+)
+REQUIRED_COLUMNS = ("First_Name", "Last_Name")
+
+DATE_FORMAT = "%d-%m-%Y"
+# Day-first like the sheets, or ISO; month-first dates are ambiguous and rejected
+DATE_INPUT_FORMATS = ("%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%Y-%m-%d", "%Y/%m/%d")
+
+YES_NO = {"Yes": ("y", "true", "1"), "No": ("n", "false", "0")}
+# Canonical spelling of each enum column, with the aliases accepted besides it
+ENUMS = {
+    "Gender": {"Male": ("m",), "Female": ("f",), "Other": ("o", "x", "nonbinary")},
+    "Suggested_Specialty": {
+        "General Physician": ("gp", "general practice"), "Dermatology": ("dermatologist",),
+        "ENT Specialist": ("ent",), "Psychologist": ("psychology",), "Pediatrics": ("pediatrician",),
+        "Orthopedic": ("orthopedics",), "Dentist": ("dental",), "Physiotherapist": ("physiotherapy",),
+        "Gynecologist": ("gynecology",), "Nutritionist": ("nutrition",),
+    },
+    "Weather_Condition": {"Sunny": (), "Cloudy": (), "Rainy": (), "Snowy": (), "Stormy": ()},
+    "Insurance_Type": {"Private": (), "Public": (), "Self-pay": ()},
+    "Preferred_Communication_Type": {"Text Chat": ("text", "sms"), "IVR": (), "Voice Chat": ("voice",)},
+    "Preferred_Communication_Language": {"English": ("en",), "Hindi": ("hi",), "Spanish": ("es",)},
+    "Risk_Category": {"Low": (), "Mid": ("medium", "moderate"), "High": ()},
+    "Token_Payment_Status": YES_NO,
+    "Caregiver_Assistance_Needed": YES_NO,
+    "Uber_Voucher_Needed": YES_NO,
+    "Returning_or_Fresh": {"Returning": (), "Fresh": ("new",)},
+}
+PHONE_COLUMNS = ("Phone", "Emergency_Contact_Number")
+DATE_COLUMNS = ("Appointment_Date", "Next_Appointment_Date")
+COUNT_COLUMNS = {"Age": 120, "Missed_Appointments": None}
+
+_EMAIL = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+
+
+# -------------------- validation --------------------
+
+def _enum_key(value):
+    return re.sub(r"[\s_-]+", "", value.casefold())
+
+
+_ENUM_LOOKUP = {
+    column: {_enum_key(alias): canonical
+             for canonical, aliases in values.items() for alias in (canonical, *aliases)}
+    for column, values in ENUMS.items()
+}
+
+
+def normalize_phone(value):
+    """``+<country><number>``; ten digits are taken as a US number."""
+    compact = re.sub(r"[\s().-]", "", value)
+    if not re.fullmatch(r"\+?\d+", compact):
+        raise ValueError(f"not a phone number: {value!r}")
+    digits = compact.lstrip("+")
+    if compact.startswith("+") and 8 <= len(digits) <= 15:
+        return "+" + digits
+    if len(digits) == 10:
+        return "+1" + digits
+    if len(digits) == 11 and digits.startswith("1"):
+        return "+" + digits
+    raise ValueError(f"not a phone number: {value!r}")
+
+
+def normalize_date(value):
+    for fmt in DATE_INPUT_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime(DATE_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(f"not a date: {value!r}")
+
+
+def normalize_count(value, maximum=None):
+    match = re.fullmatch(r"(\d+)(\.0*)?", value)
+    if match is None:
+        raise ValueError(f"not a whole number: {value!r}")
+    number = int(match.group(1))
+    if maximum is not None and number > maximum:
+        raise ValueError(f"out of range: {value!r}")
+    return str(number)
+
+
+def normalize_record(record):
+    """Return ``(row, errors)``: the record as a positional row in sheet column order.
+
+    Blank optional fields stay blank; ``Patient_ID`` is left empty for the
+    importer to fill. ``errors`` lists every problem found, ``row`` is
+    ``None`` if there are any.
+    """
+    row, errors = [], []
+    for column in PATIENT_COLUMNS:
+        value = " ".join(str(record.get(column) or "").split())
+        try:
+            if column == "Patient_ID":
+                value = ""
+            elif not value:
+                if column in REQUIRED_COLUMNS:
+                    raise ValueError("required")
+            elif column in _ENUM_LOOKUP:
+                if _enum_key(value) not in _ENUM_LOOKUP[column]:
+                    raise ValueError(f"unknown value {value!r}")
+                value = _ENUM_LOOKUP[column][_enum_key(value)]
+            elif column in PHONE_COLUMNS:
+                value = normalize_phone(value)
+            elif column in DATE_COLUMNS:
+                value = normalize_date(value)
+            elif column in COUNT_COLUMNS:
+                value = normalize_count(value, COUNT_COLUMNS[column])
+            elif column == "Email":
+                if not _EMAIL.fullmatch(value):
+                    raise ValueError(f"not an email address: {value!r}")
+                value = value.lower()
+        except ValueError as e:
+            errors.append(f"{column}: {e}")
+        row.append(value)
+    return (None if errors else row), errors
+
+
+def check_header(columns):
+    """Raise ``ValueError`` for a file whose header does not fit the patient sheet."""
+    unknown = [c for c in columns if c not in PATIENT_COLUMNS]
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if unknown or missing:
+        raise ValueError(f"header does not match the patient sheet (unknown: {unknown}, missing: {missing})")
+
+
+# -------------------- ID blocks --------------------
+
+class IdBlocks:
+    """Hands out consecutive patient numbers, a block per chunk."""
+
+    def __init__(self, repository, shared_state=None):
+        self.shared_state = shared_state
+        self.floor = PatientCache(repository).max_patient_number or FIRST_PATIENT_NUMBER - 1
+        self._next = self.floor + 1
+
+    def reserve(self, count):
+        """The first of ``count`` numbers nobody else will be given."""
+        if self.shared_state is not None:
+            return self.shared_state.reserve_block(count, self.floor)
+        first, self._next = self._next, self._next + count
+        return first
+
+
+# -------------------- import --------------------
+
+class _Sidecar:
+    """A CSV written next to the source, truncated back to the checkpoint on resume."""
+
+    def __init__(self, path, header, offset):
+        self.path = Path(path)
+        fresh = offset == 0 or not self.path.exists()
+        self.file = open(self.path, "a+" if not fresh else "w", newline="", encoding="utf-8")
+        if not fresh:
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        self.writer = csv.writer(self.file)
+        if fresh:
+            self.writer.writerow(header)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return {"source": str(Path(path).resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _save_checkpoint(path, state):
+    tmp = Path(f"{path}.tmp")
+    tmp.write_text(json.dumps(state, indent=1))
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, source):
+    """The saved progress of importing ``source``, or ``None`` if there is none for this file."""
+    try:
+        state = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return None
+    fingerprint = _fingerprint(source)
+    return state if all(state.get(k) == v for k, v in fingerprint.items()) else None
+
+
+def _append(repository, rows, max_attempts, base_delay):
+    for attempt in range(1, max_attempts + 1):
+        try:
+            with span("patients_write", kind="bulk"):
+                repository.append_rows(rows)
+            return
+        except Exception as e:
+            if not is_quota_error(e) or attempt == max_attempts:
+                raise
+            time.sleep(min(60.0, base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+
+
+def import_patients(source, repository, shared_state=None, chunk_size=500, checkpoint=None, restart=False,
+                    dry_run=False, max_attempts=8, base_delay=1.0, progress=None):
+    """Import the patient CSV ``source`` into ``repository``; return the final checkpoint state.
+
+    ``progress(state)`` is called after every chunk. With ``dry_run`` the file
+    is only validated: rejects are written, nothing else is.
+    """
+    source = Path(source)
+    checkpoint = Path(checkpoint or f"{source}.checkpoint.json")
+    state = None if restart or dry_run else load_checkpoint(checkpoint, source)
+    if state is None:
+        state = dict(_fingerprint(source), rows_read=0, imported=0, rejected=0, elapsed_s=0.0,
+                     rejects_offset=0, ids_offset=0, in_flight=None)
+    started = time.perf_counter() - state["elapsed_s"]
+    blocks = None if dry_run else IdBlocks(repository, shared_state)
+
+    with open(source, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        check_header(reader.fieldnames or [])
+        rejects = _Sidecar(f"{source}.rejects.csv", [*reader.fieldnames, "Error"], state["rejects_offset"])
+        ids = None if dry_run else _Sidecar(f"{source}.ids.csv", ["Source_Row", "Source_Patient_ID", "Patient_ID"],
+                                            state["ids_offset"])
+        try:
+            # Source rows are numbered like sheet rows: the header is row 1
+            line = state["rows_read"] + 1
+            records = islice(reader, state["rows_read"], None)
+            while chunk := list(islice(records, chunk_size)):
+                valid, rejected = [], []
+                for record in chunk:
+                    line += 1
+                    row, errors = normalize_record(record)
+                    if errors:
+                        rejected.append([record.get(c, "") for c in reader.fieldnames] + ["; ".join(errors)])
+                    else:
+                        valid.append((line, record.get("Patient_ID", ""), row))
+
+                in_flight = state["in_flight"]
+                if in_flight is not None and in_flight["count"] != len(valid):
+                    raise RuntimeError(f"{source} changed since the checkpoint; rerun with --restart")
+                if valid and not dry_run:
+                    first = in_flight["first_number"] if in_flight else blocks.reserve(len(valid))
+                    if in_flight is None:
+                        state["in_flight"] = {"first_number": first, "count": len(valid)}
+                        _save_checkpoint(checkpoint, state)
+                    rows = [[f"{ID_PREFIX}{first + i}", *row[1:]] for i, (_, _, row) in enumerate(valid)]
+                    # An interrupted chunk may have reached the sheet before the checkpoint did
+                    if in_flight is None or repository.get(rows[0][0]) is None:
+                        _append(repository, rows, max_attempts, base_delay)
+                    state["ids_offset"] = ids.write(
+                        [(line_no, source_id, new[0]) for (line_no, source_id, _), new in zip(valid, rows)]
+                    )
+                    state["imported"] += len(valid)
+
+                state["rejects_offset"] = rejects.write(rejected)
+                state["rejected"] += len(rejected)
+                state["rows_read"] += len(chunk)
+                state["in_flight"] = None
+                state["elapsed_s"] = time.perf_counter() - started
+                if not dry_run:
+                    _save_checkpoint(checkpoint, state)
+                if progress:
+                    progress(state)
+        finally:
+            rejects.close()
+            if ids is not None:
+                ids.close()
+    if dry_run:
+        state["imported"] = 0
+    return state
+
+
+# -------------------- export --------------------
+
+def export_patients(repository, out, chunk_size=1000):
+    """Stream every patient record into the CSV ``out`` (a path or file object); return the count."""
+    own = not hasattr(out, "write")
+    f = open(out, "w", newline="", encoding="utf-8") if own else out
+    try:
+        writer = None
+        count = 0
+        for records in repository.iter_records(chunk_size):
+            if writer is None:
+                writer = csv.DictWriter(f, fieldnames=list(records[0]), extrasaction="ignore")
+                writer.writeheader()
+            writer.writerows(records)
+            count += len(records)
+        if writer is None:
+            csv.writer(f).writerow(PATIENT_COLUMNS)
+        return count
+    finally:
+        if own:
+            f.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from .shared_state import shared_state_from_env
+    from .storage import open_storage
+
+    def gcp_credentials():
+        import streamlit as st
+
+        return st.secrets["gcp_service_account"]
+
+    parser = argparse.ArgumentParser(description="Bulk patient import and export")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="import a patient CSV in chunks")
+    import_parser.add_argument("source")
+    import_parser.add_argument("--chunk-size", type=int, default=500)
+    import_parser.add_argument("--checkpoint", help="progress file (default: <source>.checkpoint.json)")
+    import_parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    import_parser.add_argument("--dry-run", action="store_true", help="validate only")
+    export_parser = commands.add_parser("export", help="stream the patient table to a CSV")
+    export_parser.add_argument("--out", default="-", help="CSV path, or - for stdout")
+    export_parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    storage = open_storage(gcp_credentials)
+    if args.command == "export":
+        started = time.perf_counter()
+        count = export_patients(storage.patients, sys.stdout if args.out == "-" else args.out, args.chunk_size)
+        elapsed = time.perf_counter() - started
+        print(f"exported {count} patients in {elapsed:.2f}s ({count / elapsed:.0f} rows/s)", file=sys.stderr)
+        sys.exit(0)
+
+    def report(state):
+        rate = state["rows_read"] / state["elapsed_s"] if state["elapsed_s"] else 0.0
+        print(f"{state['rows_read']:8d} rows read  {state['imported']:8d} imported  "
+              f"{state['rejected']:6d} rejected  {rate:8.0f} rows/s")
+
+    resumed = None if args.restart or args.dry_run else load_checkpoint(
+        args.checkpoint or f"{args.source}.checkpoint.json", args.source)
+    if resumed:
+        print(f"resuming after row {resumed['rows_read']} of {args.source}")
+    try:
+        final = import_patients(args.source, storage.patients, shared_state_from_env(), args.chunk_size,
+                                args.checkpoint, args.restart, args.dry_run, progress=report)
+    except KeyboardInterrupt:
+        print("interrupted; run the same command again to resume")
+        sys.exit(130)
+    if args.dry_run:
+        print(f"checked {final['rows_read']} rows: {final['rows_read'] - final['rejected']} valid, "
+              f"{final['rejected']} rejected")
+    else:
+        print(f"done in {final['elapsed_s']:.1f}s: {final['imported']} imported, {final['rejected']} rejected")
+    if final["rejected"]:
+        print(f"rejected rows and reasons: {args.source}.rejects.csv")
@@ -0,0 +1,185 @@
+"""Appointment confirmation PDFs.
+
+A :class:`Booking` carries everything printed on a confirmation, including
+the time it was confirmed, so the same booking always renders to the same
+bytes and :func:`render_confirmation` can cache them. Reruns of the
+confirmation page reuse the cached PDF instead of redrawing it.
+
+Confirmed bookings are also appended to a JSONL log. The front desk can turn
+a day of it into one zip of PDFs (rendered in a process pool and streamed
+into the archive as they finish) or one multi-page PDF::
+
+    python -m avacare.confirmation export --date 2025-05-05 --out day.zip
+"""
+
+import json
+import os
+import threading
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+from .metrics import span
+from .storage import CACHE_DIR
+
+BOOKINGS_LOG = Path(os.environ.get("AVACARE_BOOKINGS_LOG", CACHE_DIR / "bookings.jsonl"))
+
+Booking = namedtuple(
+    "Booking",
+    ["booking_id", "name", "patient_id", "doctor", "specialty", "slot", "payment_mode", "confirmed_at",
+     "uber_voucher"],
+)
+
+
+def new_booking(booking_id, name, patient_id, doctor, specialty, slot, payment_mode, missed_reason=""):
+    """Stamp a booking with the current time; reuse ``booking_id`` when rescheduling."""
+    return Booking(
+        booking_id, name, patient_id, doctor, specialty, slot, payment_mode,
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "transportation" in str(missed_reason).lower(),
+    )
+
+
+# -------------------- RENDERING --------------------
+
+def draw_confirmation(c, booking):
+    """Draw one confirmation page on a reportlab canvas."""
+    from reportlab.lib.pagesizes import A4
+
+    w, h = A4
+    c.setFont("Helvetica-Bold", 18)
+    c.drawCentredString(w / 2, h - 80, "Appointment Confirmation")
+
+    c.setFont("Helvetica", 12)
+    y = h - 130
+    lines = [
+        f"Patient Name     : {booking.name}",
+        f"Patient ID       : {booking.patient_id}",
+        f"Doctor Name      : Dr. {booking.doctor}",
+        f"Specialty        : {booking.specialty}",
+        f"Appointment Slot : {booking.slot}",
+        f"Payment Mode     : {booking.payment_mode}",
+        f"Confirmed At     : {booking.confirmed_at}"
+    ]
+    for line in lines:
+        c.drawString(60, y, line)
+        y -= 20
+
+    if booking.uber_voucher:
+        slot_date = booking.slot.split()[0]
+        promo_code = f"UBER-{booking.patient_id[:4]}-{slot_date.replace('-', '')}"
+        c.drawString(60, y - 20, "-" * 50)
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(60, y - 40, "🚗 Uber Travel Voucher")
+        c.setFont("Helvetica", 11)
+        c.drawString(60, y - 60, f"Voucher Code : {promo_code}")
+        c.drawString(60, y - 80, "Discount     : 40% off on your next Uber ride")
+        c.drawString(60, y - 100, f"Valid Until  : {slot_date}")
+        c.drawString(60, y - 120, "Use this code in the Uber app during checkout.")
+        y -= 120
+
+    c.drawString(60, y - 40, "-" * 50)
+    c.drawString(60, y - 60, "Thank you for choosing AVACARE!")
+
+
+def _render(booking):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    # invariant=1 drops the creation timestamp, so equal bookings give equal bytes
+    c = canvas.Canvas(buffer, pagesize=A4, invariant=1)
+    draw_confirmation(c, booking)
+    c.save()
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=256)
+def render_confirmation(booking):
+    """Return the confirmation PDF for ``booking``, cached per booking."""
+    with span("pdf_render"):
+        return _render(booking)
+
+
+def confirmation_filename(booking):
+    return f"AVACARE_Confirmation_{booking.patient_id}.pdf"
+
+
+# -------------------- BOOKINGS LOG --------------------
+
+_log_lock = threading.Lock()
+
+
+def record_booking(booking, path=BOOKINGS_LOG):
+    with _log_lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(booking._asdict()) + "\n")
+
+
+def read_bookings(path=BOOKINGS_LOG, date=None):
+    """Return the latest version of each logged booking, optionally only those on ``date``."""
+    if not path.exists():
+        return []
+    latest = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                booking = Booking(**json.loads(line))
+                # A reschedule logs the booking again under the same ID
+                latest.pop(booking.booking_id, None)
+                latest[booking.booking_id] = booking
+    return [b for b in latest.values() if date is None or b.slot.split()[0] == date]
+
+
+# -------------------- BATCH EXPORT --------------------
+
+def export_zip(bookings, out, workers=None, chunksize=8):
+    """Render ``bookings`` in a process pool, writing each PDF into the zip as it arrives."""
+    bookings = list(bookings)
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for booking, pdf in zip(bookings, pool.map(_render, bookings, chunksize=chunksize)):
+            zf.writestr(f"{booking.slot.replace(':', '')}_{confirmation_filename(booking)}", pdf)
+            count += 1
+    return count
+
+
+def export_multipage(bookings, out):
+    """Write all ``bookings`` as pages of a single PDF."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(out, pagesize=A4, invariant=1)
+    count = 0
+    for booking in bookings:
+        draw_confirmation(c, booking)
+        c.showPage()
+        count += 1
+    c.save()
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Export a day of confirmation PDFs")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--date", help="slot date to export, as in the slot label (YYYY-MM-DD)")
+    parser.add_argument("--log", default=str(BOOKINGS_LOG))
+    parser.add_argument("--out", required=True, help="a .zip of PDFs or a multi-page .pdf")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    bookings = read_bookings(Path(args.log), args.date)
+    if args.out.endswith(".pdf"):
+        count = export_multipage(bookings, args.out)
+    else:
+        count = export_zip(bookings, args.out, args.workers)
+    print(f"wrote {count} confirmations to {args.out} in {time.perf_counter() - start:.2f}s")
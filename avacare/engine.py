@@ -0,0 +1,561 @@
+"""The booking flow without the UI.
+
+:class:`BookingEngine` holds the patient, doctor, slot, risk and weather
+operations behind the chat, and :data:`TRANSITIONS` is the state machine the
+chat walks through. Nothing here imports Streamlit: ``app.py`` is a view that
+renders the current state and calls the engine, and a worker, an API or a
+benchmark can drive the same engine directly.
+
+Dependencies are explicit. :class:`Services` bundles the process-wide
+objects (storage, caches, slot index, weather, transcription) and builds
+each on first use, so a page that never reaches the doctor list never loads
+the availability table. :meth:`Services.from_env` wires them the way the app
+is configured through ``AVACARE_*`` variables.
+
+Session state is any mutable mapping, ``st.session_state`` included, and the
+engine only touches the ``chat_state`` key through :func:`advance`. With
+``AVACARE_STATE_URL`` set, replicas share sessions, slot holds and write
+claims through :mod:`avacare.shared_state`; methods taking a ``holder`` (the
+session ID) then stay correct when a session moves between replicas. The
+progress is saved under a separate session token, the only part that goes
+into the page URL. It is unguessable and single-use: restoring it moves the
+progress to a new token, so a copied or leaked link cannot be used to load
+the patient's name and ID again.
+"""
+
+import os
+import re
+import secrets
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+
+from .analytics import ClinicAnalytics
+from .confirmation import Booking, new_booking, read_bookings, record_booking, render_confirmation
+from .model import get_no_show_model
+from .open_slots import OpenSlots
+from .patient_cache import FIRST_PATIENT_NUMBER, ID_PREFIX, PatientCache
+from .rescheduler import Appointment, Rescheduler
+from .risk import predict_no_show_risk
+from .schedule import Calendar
+from .shared_state import shared_state_from_env
+from .slots import OPEN, SlotIndex, slot_key
+from .storage import CACHE_DIR, GoogleSheetsStorage, open_storage
+from .symptoms import get_symptom_matcher
+from .voice import TranscriptionPool, transcriber_from_env
+from .weather import WeatherService, format_weather, weather_provider_from_env
+from .write_queue import write_queue_from_env
+
+# -------------------- STATE MACHINE --------------------
+
+CHOOSE_MODE = "choose_mode"
+CHOOSE_LANGUAGE = "choose_language"
+GREETING = "greeting"
+VOICE_CONVERSATION = "voice_conversation"
+ASK_IDENTITY = "ask_identity"
+GET_RETURNING_INFO = "get_returning_info"
+GET_NEW_INFO = "get_new_info"
+MAIN_MENU = "main_menu"
+ASK_SYMPTOMS = "ask_symptoms"
+SELECT_DOCTOR = "select_doctor"
+WEATHER_CHECK = "weather_check"
+PAYMENT = "payment"
+CONFIRMED = "confirmed"
+
+TRANSITIONS = {
+    CHOOSE_MODE: {CHOOSE_LANGUAGE},
+    CHOOSE_LANGUAGE: {GREETING, VOICE_CONVERSATION, CHOOSE_MODE},
+    GREETING: {ASK_IDENTITY},
+    VOICE_CONVERSATION: {ASK_IDENTITY},
+    ASK_IDENTITY: {GET_RETURNING_INFO, GET_NEW_INFO},
+    GET_RETURNING_INFO: {MAIN_MENU, ASK_IDENTITY},
+    GET_NEW_INFO: {MAIN_MENU, ASK_IDENTITY},
+    MAIN_MENU: {ASK_SYMPTOMS},
+    ASK_SYMPTOMS: {SELECT_DOCTOR},
+    SELECT_DOCTOR: {WEATHER_CHECK, MAIN_MENU},
+    WEATHER_CHECK: {PAYMENT, SELECT_DOCTOR},
+    PAYMENT: {CONFIRMED, SELECT_DOCTOR, MAIN_MENU},
+    CONFIRMED: set(),
+}
+
+GREETINGS = {
+    "English": "Hi, how are you doing today?",
+    "Hindi": "नमस्ते, आज आप कैसे हैं?",
+    "Spanish": "Hola, ¿cómo estás hoy?",
+}
+
+
+def new_session():
+    """Initial values of a chat session."""
+    return {
+        "chat_state": CHOOSE_MODE,
+        "mode": None,
+        "language": None,
+        "name": "",
+        "patient_id": "",
+        "is_returning": None,
+        "recommended_specialty": "",
+    }
+
+
+# 32 random bytes, URL-safe base64
+SESSION_TOKEN = re.compile(r"[A-Za-z0-9_-]{43}")
+
+
+def new_session_token():
+    return secrets.token_urlsafe(32)
+
+
+# Booking progress that follows a session to another replica
+SHARED_SESSION_KEYS = (*new_session(), "session_id", "selected_doctor", "selected_slot", "selected_payment_mode",
+                       "booking")
+
+# A slot claim this old whose slot the sheet shows open again is stale (the
+# booking was reopened outside the app); younger ones may still be writing
+STALE_CLAIM_AFTER = 60
+
+
+def advance(session, state):
+    """Move ``session`` to ``state``, refusing moves the flow does not allow."""
+    current = session["chat_state"]
+    if state not in TRANSITIONS[current]:
+        raise ValueError(f"Cannot go from {current} to {state}")
+    session["chat_state"] = state
+
+
+# -------------------- PURE HELPERS --------------------
+
+VisitAssessment = namedtuple(
+    "VisitAssessment", ["city", "weather_message", "risk_message", "no_show_probability", "advisory"]
+)
+
+CLEAR, ROUGH, SNOW = "clear", "rough", "snow"
+
+
+def missed_count(patient):
+    missed = str(patient.get("Missed_Appointments", "0")).strip()
+    return int(missed) if missed.isdigit() else 0
+
+
+def split_slot_label(label):
+    """``"2025-05-05 09:00"`` -> ``("2025-05-05", "09:00")``."""
+    slot_date, slot_time = label.split(" ")
+    return slot_date, slot_time
+
+
+def weather_advisory(weather_message):
+    text = weather_message.lower()
+    if "rain" in text or "storm" in text:
+        return ROUGH
+    if "snow" in text:
+        return SNOW
+    return CLEAR
+
+
+def new_patient_row(patient_id, first_name, last_name, gender, age, symptoms, contact, email, insurance,
+                    language, caregiver, emergency_contact_name, emergency_contact_phone):
+    """Registration fields in the patient sheet's column order."""
+    return [
+        patient_id, first_name, last_name, gender, age, symptoms, contact, email, insurance,
+        language, caregiver, emergency_contact_name, emergency_contact_phone,
+    ]
+
+
+# -------------------- DEPENDENCIES --------------------
+
+class Services:
+    """Process-wide dependencies of the engine, each built on first use."""
+
+    def __init__(self, storage, weather_provider, transcriber_loader=None, write_queue=None,
+                 slot_index_path=None, symptoms=None, model=None, shared_state=None):
+        self.storage = storage
+        self.write_queue = write_queue
+        self.shared_state = shared_state
+        self._weather_provider = weather_provider
+        self._transcriber_loader = transcriber_loader
+        self._slot_index_path = slot_index_path
+        self._built = {"symptoms": symptoms, "model": model}
+        self._lock = threading.RLock()
+
+    def _get(self, name, build):
+        with self._lock:
+            if self._built.get(name) is None:
+                self._built[name] = build()
+            return self._built[name]
+
+    @property
+    def patients(self):
+        # Shared by every session: one sheet read per TTL window instead of one per rerun
+        return self._get("patients", lambda: PatientCache(self.storage.patients, queue=self.write_queue))
+
+    @property
+    def slots(self):
+        return self._get(
+            "slots", lambda: SlotIndex(self.storage.availability, self._slot_index_path, queue=self.write_queue)
+        )
+
+    @property
+    def open_slots(self):
+        return self._get("open_slots", lambda: OpenSlots(self.slots))
+
+    @property
+    def calendar(self):
+        return self._get("calendar", lambda: Calendar.from_slot_index(self.slots))
+
+    @property
+    def rescheduler(self):
+        return self._get("rescheduler", lambda: Rescheduler(self.calendar))
+
+    @property
+    def analytics(self):
+        return self._get("analytics", lambda: ClinicAnalytics.attach(self.slots, self.patients))
+
+    @property
+    def weather(self):
+        return self._get("weather", lambda: WeatherService(self._weather_provider))
+
+    @property
+    def transcription(self):
+        return self._get("transcription", lambda: TranscriptionPool(self._transcriber_loader()))
+
+    @property
+    def symptoms(self):
+        return self._get("symptoms", get_symptom_matcher)
+
+    @property
+    def model(self):
+        # May stay None when no trained model is shipped; it is then looked up again
+        return self._get("model", get_no_show_model)
+
+    @classmethod
+    def from_env(cls, credentials_loader, weather_key_loader, openai_key_loader):
+        """Wire the services selected by the ``AVACARE_*`` variables.
+
+        Each loader returns a secret; the OpenAI key is only read once a recording is transcribed.
+        """
+        # AVACARE_STORAGE=sqlite runs against a local copy seeded from the bundled files
+        storage = open_storage(credentials_loader)
+        slot_index_path = os.environ.get("AVACARE_SLOT_INDEX_PATH")
+        if slot_index_path is None and isinstance(storage, GoogleSheetsStorage):
+            # The SQLite backend is already local; only the sheet index is worth keeping on disk
+            CACHE_DIR.mkdir(exist_ok=True)
+            slot_index_path = CACHE_DIR / "slot_index.db"
+        return cls(
+            storage,
+            weather_provider_from_env(weather_key_loader),
+            lambda: transcriber_from_env(openai_key_loader),
+            write_queue=write_queue_from_env(storage),
+            slot_index_path=slot_index_path,
+            shared_state=shared_state_from_env(),
+        )
+
+
+# -------------------- ENGINE --------------------
+
+class BookingEngine:
+    def __init__(self, services, doctor_ttl=600, clock=time.monotonic):
+        self.services = services
+        self.doctor_ttl = doctor_ttl
+        self.clock = clock
+        self._doctors = None
+        self._doctors_at = None
+        self._lock = threading.Lock()
+
+    # -------------------- sessions --------------------
+
+    @property
+    def shares_state(self):
+        return self.services.shared_state is not None
+
+    def save_session(self, session):
+        """Store the booking progress of ``session`` for the other replicas."""
+        shared = self.services.shared_state
+        if shared is None or "session_token" not in session:
+            return
+        values = {key: session[key] for key in SHARED_SESSION_KEYS if key in session}
+        if values.get("booking") is not None:
+            values["booking"] = values["booking"]._asdict()
+        shared.save_session(session["session_token"], values)
+
+    def restore_session(self, token, session):
+        """Load the progress saved under ``token`` into ``session``; ``False`` if there is none.
+
+        The progress moves to a new ``session["session_token"]`` and the old
+        token stops working.
+        """
+        shared = self.services.shared_state
+        if shared is None or not SESSION_TOKEN.fullmatch(token):
+            return False
+        values = shared.load_session(token)
+        if values is None:
+            return False
+        shared.drop_session(token)
+        if values.get("booking") is not None:
+            values["booking"] = Booking(**values["booking"])
+        for key, value in values.items():
+            session[key] = value
+        session["session_token"] = new_session_token()
+        self.save_session(session)
+        return True
+
+    @contextmanager
+    def saving_session(self, session):
+        """Save ``session`` when the block exits, however it exits (reruns and stops included)."""
+        try:
+            yield
+        finally:
+            self.save_session(session)
+
+    # -------------------- patients --------------------
+
+    def find_patient(self, patient_id):
+        return self.services.patients.get(patient_id)
+
+    def reserve_patient_id(self, holder):
+        # Reserved per session, so reruns of the form keep showing the same ID
+        shared = self.services.shared_state
+        if shared is None:
+            return self.services.patients.reserve_patient_id(holder)
+        floor = self.services.patients.max_patient_number or FIRST_PATIENT_NUMBER - 1
+        return f"{ID_PREFIX}{shared.reserve_number(holder, floor)}"
+
+    def release_patient_id(self, holder):
+        """Give up ``holder``'s reserved ID, e.g. when the patient leaves the registration form."""
+        shared = self.services.shared_state
+        if shared is None:
+            self.services.patients.release_patient_id(holder)
+        else:
+            shared.release_number(holder)
+
+    def register_patient(self, row, holder=None):
+        """Append the patient row; a repeat of an earlier registration by ``holder`` is not appended again.
+
+        Returns ``False`` if another session already registered this patient ID.
+        """
+        shared = self.services.shared_state
+        key = f"patient:{row[0]}"
+        if shared is not None:
+            if not shared.claim(key, holder or uuid.uuid4().hex):
+                return shared.owner(key) == holder
+        try:
+            self.services.patients.append(row)
+        except Exception:
+            if shared is not None:
+                shared.unclaim(key)
+            raise
+        return True
+
+    # -------------------- doctors and slots --------------------
+
+    def doctors(self, specialty=None):
+        with self._lock:
+            now = self.clock()
+            if self._doctors is None or now - self._doctors_at >= self.doctor_ttl:
+                self._doctors = self.services.storage.doctors.all()
+                self._doctors_at = now
+            doctors = self._doctors
+        return [d for d in doctors if specialty is None or d["Specialty"] == specialty]
+
+    def specialty_for(self, symptoms):
+        """The specialty to consult for free-text ``symptoms``, or ``None``."""
+        return self.services.symptoms.match(symptoms)
+
+    def open_slots(self, doctor, n=None):
+        """The next ``n`` open slots of ``doctor`` (ID or name), earliest first."""
+        self.services.slots.ensure_fresh()
+        if n is None:
+            return self.services.open_slots.next_open(doctor)
+        return self.services.open_slots.next_open(doctor, n)
+
+    def _slot_key(self, doctor, slot_label):
+        # By doctor ID, date and start time, so the key follows the slot when rows move
+        slot = self.services.slots.slot(doctor, *split_slot_label(slot_label))
+        return None if slot is None else "slot:" + "|".join(slot_key(slot))
+
+    def _drop_stale_claim(self, key, doctor, slot_label):
+        """Drop the claim on ``key`` if the slot was reopened outside the app; ``True`` if it was."""
+        shared = self.services.shared_state
+        age = shared.claim_age(key)
+        if age is None or age < STALE_CLAIM_AFTER:
+            return False
+        self.services.slots.ensure_fresh()
+        slot = self.services.slots.slot(doctor, *split_slot_label(slot_label))
+        if slot is None or slot["Slot_Status"] != OPEN:
+            return False
+        shared.unclaim(key, shared.owner(key))
+        return True
+
+    def book(self, doctor, slot_label, holder=None):
+        """Fill the slot; ``False`` when it was taken by someone else in the meantime.
+
+        With shared state the slot is first claimed across replicas, so only
+        one of them can fill it; booking again as the same ``holder`` returns
+        ``True`` without a second write. A claim left behind by a booking that
+        was since reopened in the sheet is dropped and the slot booked again.
+        """
+        slot_date, slot_time = split_slot_label(slot_label)
+        shared = self.services.shared_state
+        if shared is None:
+            return self.services.slots.book(doctor, slot_date, slot_time)
+        key = self._slot_key(doctor, slot_label)
+        if key is None:
+            return False
+        holder = holder or uuid.uuid4().hex
+        if shared.held_by_other(key, holder):
+            return False
+        if not shared.claim(key, holder, expires=True):
+            if shared.owner(key) == holder:
+                return True
+            if not (self._drop_stale_claim(key, doctor, slot_label) and shared.claim(key, holder, expires=True)):
+                return False
+        try:
+            booked = self.services.slots.book(doctor, slot_date, slot_time)
+        except Exception:
+            shared.unclaim(key, holder)
+            raise
+        if not booked:
+            # Filled outside the shared store, e.g. directly in the sheet
+            shared.unclaim(key, holder)
+        shared.release_hold(key, holder)
+        return booked
+
+    def release(self, doctor, slot_label):
+        """Reopen a slot the patient is moving away from."""
+        slot_date, slot_time = split_slot_label(slot_label)
+        released = self.services.slots.release(doctor, slot_date, slot_time)
+        shared = self.services.shared_state
+        if released and shared is not None:
+            shared.unclaim(self._slot_key(doctor, slot_label))
+        return released
+
+    def hold_slot(self, doctor, slot_label, holder):
+        """Hold the slot for ``holder`` while they pay; ``False`` if another session holds it.
+
+        Without shared state there is nothing to coordinate and every hold succeeds.
+        """
+        shared = self.services.shared_state
+        if shared is None:
+            return True
+        key = self._slot_key(doctor, slot_label)
+        return key is not None and shared.hold(key, holder)
+
+    # -------------------- rescheduling --------------------
+
+    def recommend_slots(self, patient, specialty, k=3, exclude=()):
+        """The ``k`` best open slots of any doctor of ``specialty`` for ``patient``, as Recommendations."""
+        weather_message = self.weather_message(patient.get("Traveling_From", "Dallas"))
+        self.services.slots.ensure_fresh()
+        return self.services.rescheduler.recommend(patient, specialty, weather_message, k=k, exclude=exclude)
+
+    def reschedule(self, doctor, old_slot, new_doctor, new_slot, holder=None):
+        """Book ``new_slot`` and free ``old_slot``; ``False`` if the new slot was taken meanwhile."""
+        if not self.book(new_doctor, new_slot, holder):
+            return False
+        self.release(doctor, old_slot)
+        return True
+
+    def rebook_high_risk(self, bookings=None):
+        """Move every high-risk booking (all logged bookings by default) to a lower-risk slot in one pass.
+
+        Moved bookings are logged again under their ID. Returns the
+        :class:`~avacare.rescheduler.Rebooking` of each high-risk booking.
+        """
+        bookings = {b.booking_id: b for b in (read_bookings() if bookings is None else bookings)}
+        appointments, patients = [], {}
+        for booking in bookings.values():
+            patient = patients[booking.booking_id] = self.find_patient(booking.patient_id)
+            if patient is None:
+                continue
+            weather_message = self.weather_message(patient.get("Traveling_From", "Dallas"))
+            appointments.append(
+                Appointment(booking.booking_id, patient, booking.specialty, booking.doctor, booking.slot, weather_message)
+            )
+        self.services.slots.ensure_fresh()
+        results = self.services.rescheduler.rebook_high_risk(appointments, self.book, self.release)
+        for result in results:
+            if result.new is not None:
+                booking = bookings[result.key]
+                self.confirm(booking, booking.name, booking.patient_id, result.new.slot["Doctor_Name"],
+                             booking.specialty, result.new.slot["label"], booking.payment_mode,
+                             patients[result.key].get("Missed_Appointment_Reason", ""))
+        return results
+
+    # -------------------- weather and risk --------------------
+
+    def weather_message(self, city_raw):
+        try:
+            return format_weather(self.services.weather.forecast(city_raw))
+        except Exception as e:
+            return f"⚠️ Could not fetch weather data: {str(e)}"
+
+    def assess_visit(self, patient, slot_label):
+        """Weather at the patient's city and the no-show risk of the visit."""
+        city = patient.get("Traveling_From", "Dallas")
+        weather_message = self.weather_message(city)
+        model = self.services.model
+        return VisitAssessment(
+            city,
+            weather_message,
+            predict_no_show_risk(patient, weather_message, slot_label),
+            model.predict_proba(patient, weather_message) if model is not None and model.is_reliable() else None,
+            weather_advisory(weather_message),
+        )
+
+    # -------------------- confirmation --------------------
+
+    def confirm(self, booking, name, patient_id, doctor, specialty, slot, payment_mode, missed_reason=""):
+        """Return the booking for ``slot``, stamping and logging a new version only when the doctor or slot changed."""
+        if booking is not None and (booking.doctor, booking.slot) == (doctor, slot):
+            return booking
+        # Stamped once per confirmed slot, so reruns hit the PDF cache
+        booking = new_booking(
+            booking.booking_id if booking else uuid.uuid4().hex,
+            name, patient_id, doctor, specialty, slot, payment_mode, missed_reason,
+        )
+        record_booking(booking)
+        return booking
+
+    def confirmation_pdf(self, booking):
+        return render_confirmation(booking)
+
+    # -------------------- analytics --------------------
+
+    def analytics(self):
+        """The clinic analytics, after picking up slots and patients changed by other processes."""
+        self.services.slots.ensure_fresh()
+        self.services.patients.ensure_fresh()
+        return self.services.analytics
+
+    def write_queue_problems(self):
+        """Queue depth, parked mutations and refused slot writes; ``None`` when writes are not queued.
+
+        Each conflict carries the logged bookings of its slot: those patients
+        were confirmed a slot the sheet gave to someone else and need to be
+        contacted or rebooked.
+        """
+        queue = self.services.write_queue
+        if queue is None:
+            return None
+        conflicts = queue.conflicts()
+        bookings = read_bookings() if conflicts else []
+        for conflict in conflicts:
+            key = conflict["payload"].get("key")
+            if not key:
+                conflict["bookings"] = []
+                continue
+            doctor_id, slot_date, slot_time = key
+            slot = self.services.slots.slot(doctor_id, slot_date, slot_time)
+            doctors = {doctor_id, slot["Doctor_Name"] if slot else doctor_id}
+            label = f"{slot_date} {slot_time}"
+            conflict["bookings"] = [b for b in bookings if b.slot == label and b.doctor in doctors]
+        return {"depth": queue.depth(), "failed": queue.failed(), "conflicts": conflicts}
+
+    # -------------------- voice --------------------
+
+    def submit_recording(self, wav_bytes):
+        return self.services.transcription.submit(wav_bytes)
+
+    def poll_transcription(self, job_id):
+        return self.services.transcription.poll(job_id)
@@ -0,0 +1,191 @@
+"""In-process latency histograms for the hot path.
+
+Code wraps a unit of work in :func:`span`::
+
+    with span("weather_fetch"):
+        weather = provider.fetch(city)
+
+and every span is recorded in a process-wide :class:`Registry`, one
+:class:`Histogram` per name and label set. Histograms use fixed log-spaced
+buckets (1 ms to about a minute), so recording is O(1) with no per-sample
+storage, and p50/p95/p99 are estimated by interpolating within a bucket.
+
+A span that exits with an exception counts as an error. Streamlit's rerun and
+stop signals are ``BaseException`` subclasses, not ``Exception``, so
+``st.rerun()`` inside a span is not an error.
+
+The registry is shown on the app's hidden admin page and can be exported as
+Prometheus text (:meth:`Registry.to_prometheus`) or JSONL
+(:meth:`Registry.to_jsonl`).
+"""
+
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds: 1 ms doubling every two buckets up to ~65 s
+BUCKETS = tuple(0.001 * 2 ** (i / 2) for i in range(33))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "errors", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds, ok=True):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.errors += not ok
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Estimate the ``q`` quantile in seconds, interpolating linearly inside the bucket."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= target:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (target - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def summary(self):
+        summary = {"count": self.count, "errors": self.errors, "sum_s": self.sum, "max_s": self.max}
+        for q in QUANTILES:
+            summary[f"p{round(q * 100)}_s"] = self.quantile(q)
+        return summary
+
+
+class Registry:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._series = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name, seconds, ok=True, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._series.get(key)
+            if histogram is None:
+                histogram = self._series[key] = Histogram()
+            histogram.observe(seconds, ok)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the ``with`` block under ``name`` and ``labels``."""
+        started = self.clock()
+        ok = True
+        try:
+            yield
+        except Exception:
+            ok = False
+            raise
+        finally:
+            self.observe(name, self.clock() - started, ok, **labels)
+
+    def timed(self, name, **labels):
+        """Decorator form of :meth:`span`."""
+        def decorate(fn):
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return fn(*args, **kwargs)
+            wrapper.__name__ = fn.__name__
+            wrapper.__doc__ = fn.__doc__
+            wrapper.__wrapped__ = fn
+            return wrapper
+        return decorate
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def dump(self):
+        """Return the raw series as plain data, e.g. to ship from a worker process."""
+        with self._lock:
+            return [
+                (name, dict(labels), list(h.counts), h.count, h.errors, h.sum, h.max)
+                for (name, labels), h in self._series.items()
+            ]
+
+    def merge(self, dump):
+        """Add series produced by :meth:`dump` (of any registry) into this one."""
+        with self._lock:
+            for name, labels, counts, count, errors, total, peak in dump:
+                key = self._key(name, labels)
+                histogram = self._series.get(key)
+                if histogram is None:
+                    histogram = self._series[key] = Histogram()
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.count += count
+                histogram.errors += errors
+                histogram.sum += total
+                histogram.max = max(histogram.max, peak)
+
+    # -------------------- export --------------------
+
+    def snapshot(self, name=None):
+        """Return one summary dict per series (``name``, ``labels`` and the histogram summary)."""
+        with self._lock:
+            series = [(key, h.summary()) for key, h in sorted(self._series.items()) if name in (None, key[0])]
+        return [{"name": n, "labels": dict(labels), **summary} for (n, labels), summary in series]
+
+    def to_jsonl(self):
+        now = time.time()
+        return "".join(json.dumps({"ts": now, **row}) + "\n" for row in self.snapshot())
+
+    def to_prometheus(self, prefix="avacare"):
+        """Render every series in the Prometheus text exposition format."""
+        with self._lock:
+            series = sorted((key, list(h.counts), h.count, h.errors, h.sum) for key, h in self._series.items())
+        lines = []
+        names = sorted({name for (name, _), *_ in series})
+        for name in names:
+            # Each metric family has to be contiguous: all histogram series, then the error counters
+            family = [row for row in series if row[0][0] == name]
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for (_, labels), counts, count, _, total in family:
+                cumulative = 0
+                for bound, n in zip(BUCKETS + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else f"{bound:.6g}"
+                    lines.append(f"{metric}_bucket{_labels(labels, le=le)} {cumulative}")
+                lines.append(f"{metric}_sum{_labels(labels)} {total:.6f}")
+                lines.append(f"{metric}_count{_labels(labels)} {count}")
+            lines.append(f"# TYPE {prefix}_{name}_errors_total counter")
+            for (_, labels), _, _, errors, _ in family:
+                lines.append(f"{prefix}_{name}_errors_total{_labels(labels)} {errors}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+REGISTRY = Registry()
+span = REGISTRY.span
+timed = REGISTRY.timed
+observe = REGISTRY.observe
@@ -0,0 +1,206 @@
+"""Trained no-show model.
+
+A logistic regression over one-hot encoded patient attributes, trained on
+``AVACARE_Patient_Dataset_Aligned.csv`` and saved as a small JSON artifact of
+per-value weights. Scoring a patient is a handful of dict lookups and one
+``exp``, so it runs in microseconds inside the weather check.
+
+The label is "has missed an appointment" (``Missed_Appointments > 0``).
+``Risk_Category`` is derived from the same count in the dataset, so both
+columns are left out of the default features; passing them back in with
+``--features`` only teaches the model to copy the label.
+
+Training records held-out metrics in the artifact. A model whose
+``test_auc`` is below ``MIN_TEST_AUC`` ranks patients little better than a
+coin flip, so :meth:`NoShowModel.is_reliable` is false and the app shows only
+the rule-based label.
+
+    python -m avacare.model train
+"""
+
+import json
+import math
+import threading
+from pathlib import Path
+
+MODEL_PATH = Path(__file__).resolve().parent / "models" / "no_show_model.json"
+
+# Below this held-out AUC the probability is not shown to patients
+MIN_TEST_AUC = 0.6
+
+FEATURES = ["Weather_Condition", "Age", "Insurance_Type", "Preferred_Communication_Type"]
+AGE_BINS = [18, 35, 50, 65]
+
+# Keywords of a live forecast message mapped to the dataset's Weather_Condition values
+WEATHER_KEYWORDS = [("storm", "Stormy"), ("thunder", "Stormy"), ("rain", "Rainy"), ("drizzle", "Rainy"),
+                    ("snow", "Snowy"), ("cloud", "Cloudy"), ("clear", "Sunny"), ("sun", "Sunny")]
+
+
+def weather_condition(weather_message):
+    message = str(weather_message).lower()
+    return next((condition for keyword, condition in WEATHER_KEYWORDS if keyword in message), "")
+
+
+def _age_bucket(age):
+    try:
+        age = float(age)
+    except (TypeError, ValueError):
+        return ""
+    lower = 0
+    for upper in AGE_BINS:
+        if age < upper:
+            return f"{lower}-{upper - 1}"
+        lower = upper
+    return f"{lower}+"
+
+
+def feature_value(feature, record):
+    value = record.get(feature, "")
+    if feature == "Age":
+        return _age_bucket(value)
+    return str(value).strip()
+
+
+class NoShowModel:
+    def __init__(self, features, bias, weights, metrics=None):
+        self.features = features
+        self.bias = bias
+        self.weights = weights
+        self.metrics = metrics or {}
+
+    def predict_proba(self, record, weather_message=None):
+        """Return the probability that the patient misses the appointment.
+
+        ``weather_message`` is the live forecast; when given it replaces the
+        record's stored ``Weather_Condition``.
+        """
+        z = self.bias
+        for feature in self.features:
+            if feature == "Weather_Condition" and weather_message is not None:
+                value = weather_condition(weather_message)
+            else:
+                value = feature_value(feature, record)
+            z += self.weights[feature].get(value, 0.0)
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def is_reliable(self, min_auc=MIN_TEST_AUC):
+        """Whether the held-out AUC recorded at training time reaches ``min_auc``."""
+        return self.metrics.get("test_auc", 0.0) >= min_auc
+
+    def to_dict(self):
+        return {"features": self.features, "bias": self.bias, "weights": self.weights, "metrics": self.metrics}
+
+    def save(self, path=MODEL_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), indent=1, sort_keys=True), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return cls(data["features"], data["bias"], data["weights"], data.get("metrics"))
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_no_show_model():
+    """Load the bundled artifact once per process; ``None`` if it has not been trained."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None and MODEL_PATH.exists():
+                _model = NoShowModel.load(MODEL_PATH)
+    return _model
+
+
+# -------------------- TRAINING --------------------
+
+def labels(df):
+    import pandas as pd
+
+    return (pd.to_numeric(df["Missed_Appointments"], errors="coerce").fillna(0) > 0).to_numpy(dtype=float)
+
+
+def _design_matrix(df, features, vocab=None):
+    import numpy as np
+
+    columns = {f: df.apply(lambda r, f=f: feature_value(f, r), axis=1) for f in features}
+    if vocab is None:
+        vocab = [(f, v) for f in features for v in sorted(columns[f].unique())]
+    X = np.zeros((len(df), len(vocab)))
+    for j, (feature, value) in enumerate(vocab):
+        X[:, j] = (columns[feature] == value).to_numpy()
+    return X, vocab
+
+
+def _auc(y, p):
+    import numpy as np
+
+    order = np.argsort(p)
+    ranks = np.empty(len(p))
+    ranks[order] = np.arange(1, len(p) + 1)
+    positives = y.sum()
+    negatives = len(y) - positives
+    if not positives or not negatives:
+        return float("nan")
+    return float((ranks[y == 1].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+
+def split(df, test_fraction=0.2, seed=42):
+    shuffled = df.sample(frac=1.0, random_state=seed)
+    n_test = int(len(df) * test_fraction)
+    return shuffled.iloc[n_test:], shuffled.iloc[:n_test]
+
+
+def train(df, features=FEATURES, l2=1e-2, lr=0.5, epochs=500, seed=42):
+    """Fit by full-batch gradient descent and return a model with held-out metrics."""
+    import numpy as np
+
+    train_df, test_df = split(df, seed=seed)
+    X, vocab = _design_matrix(train_df, features)
+    y = labels(train_df)
+    w = np.zeros(X.shape[1])
+    b = 0.0
+    for _ in range(epochs):
+        p = 1.0 / (1.0 + np.exp(-(X @ w + b)))
+        w -= lr * (X.T @ (p - y) / len(y) + l2 * w)
+        b -= lr * float(np.mean(p - y))
+
+    weights = {f: {} for f in features}
+    for (feature, value), weight in zip(vocab, w):
+        weights[feature][value] = round(float(weight), 6)
+    model = NoShowModel(list(features), round(b, 6), weights)
+
+    X_test, _ = _design_matrix(test_df, features, vocab)
+    y_test = labels(test_df)
+    p_test = 1.0 / (1.0 + np.exp(-(X_test @ w + b)))
+    model.metrics = {
+        "train_rows": len(train_df),
+        "test_rows": len(test_df),
+        "test_accuracy": round(float(np.mean((p_test >= 0.5) == y_test)), 4),
+        "test_auc": round(_auc(y_test, p_test), 4),
+        "base_rate": round(float(y.mean()), 4),
+    }
+    return model
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import pandas as pd
+
+    from .storage import PATIENT_CSV
+
+    parser = argparse.ArgumentParser(description="Train the no-show model")
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--patients", default=str(PATIENT_CSV))
+    parser.add_argument("--out", default=str(MODEL_PATH))
+    parser.add_argument("--features", nargs="+", default=FEATURES)
+    args = parser.parse_args()
+
+    model = train(pd.read_csv(args.patients, dtype=str), args.features)
+    model.save(args.out)
+    print(f"saved {args.out}")
+    print(json.dumps(model.metrics, indent=1))
@@ -0,0 +1,80 @@
+"""Materialised open-slot view grouped by specialty and doctor.
+
+:class:`OpenSlots` listens to a :class:`~avacare.slots.SlotIndex` and keeps,
+for every doctor, the open slots sorted by start time. Filling a slot removes
+it with a bisect instead of re-filtering the availability table, so "the next
+N open slots of doctor X" is a slice of an already sorted list.
+"""
+
+import bisect
+import threading
+
+from .slots import OPEN, slot_label, slot_start
+
+
+class OpenSlots:
+    def __init__(self, slot_index):
+        self._lock = threading.RLock()
+        self._by_doctor = {}
+        self._by_specialty = {}
+        self._doctor_ids = {}
+        self.slots_reloaded(slot_index.slots())
+        slot_index.add_listener(self)
+
+    # -------------------- SlotIndex hooks --------------------
+
+    def slots_reloaded(self, slots):
+        by_doctor = {}
+        by_specialty = {}
+        doctor_ids = {}
+        for slot in slots:
+            doctor_id = slot["Doctor_ID"]
+            doctor_ids[doctor_id] = doctor_id
+            doctor_ids[slot["Doctor_Name"]] = doctor_id
+            entries = by_doctor.setdefault(doctor_id, [])
+            by_specialty.setdefault(slot["Specialty"], {})[doctor_id] = entries
+            if slot["Slot_Status"] == OPEN:
+                entries.append(self._entry(slot))
+        for entries in by_doctor.values():
+            entries.sort(key=lambda entry: entry[:2])
+        with self._lock:
+            self._by_doctor = by_doctor
+            self._by_specialty = by_specialty
+            self._doctor_ids = doctor_ids
+
+    def slot_changed(self, slot):
+        with self._lock:
+            entries = self._by_doctor.get(slot["Doctor_ID"])
+            if entries is None:
+                return
+            entry = self._entry(slot)
+            i = bisect.bisect_left(entries, entry[:2])
+            present = i < len(entries) and entries[i][:2] == entry[:2]
+            if slot["Slot_Status"] == OPEN and not present:
+                entries.insert(i, entry)
+            elif slot["Slot_Status"] != OPEN and present:
+                del entries[i]
+
+    @staticmethod
+    def _entry(slot):
+        # (start, row) orders slots chronologically and is unique per slot
+        public = {k: v for k, v in slot.items() if k != "Slot_Status"}
+        return (slot_start(slot), slot["row"], dict(public, label=slot_label(slot)))
+
+    # -------------------- queries --------------------
+
+    def next_open(self, doctor, n=None):
+        """Return up to ``n`` open slots of ``doctor`` (ID or name), earliest first."""
+        with self._lock:
+            entries = self._by_doctor.get(self._doctor_ids.get(doctor), [])
+            return [entry[2] for entry in entries[:n]]
+
+    def by_specialty(self, specialty):
+        """Return ``{Doctor_ID: [open slots, earliest first]}`` for one specialty."""
+        with self._lock:
+            doctors = self._by_specialty.get(specialty, {})
+            return {doctor_id: [entry[2] for entry in entries] for doctor_id, entries in doctors.items()}
+
+    def specialties(self):
+        with self._lock:
+            return sorted(self._by_specialty)
@@ -0,0 +1,238 @@
+"""Process-wide cache of the patient table.
+
+Every Streamlit session shares one :class:`PatientCache`. Reads inside the TTL
+window are served from memory; once the TTL expires the cache only fetches
+the rows appended since the last known row count. A full reload still happens
+every ``full_ttl`` seconds so in-place edits made directly in the sheet are
+picked up eventually.
+
+The cache also keeps an index keyed by ``Patient_ID`` together with the
+highest numeric ID seen, so lookups and ID allocation are O(1). IDs are handed
+out as per-holder reservations under the cache lock: a registration form that
+reruns keeps the ID it was shown, and two sessions never get the same one. A
+reservation ends when its row is appended, when the holder releases it (the
+patient leaves the form) or after ``reservation_ttl`` seconds without use, so
+an abandoned form does not keep its number forever; the lowest free number
+above the sheet's highest ID is handed out next.
+
+With a :class:`~avacare.write_queue.WriteQueue`, :meth:`PatientCache.append`
+only queues the row. Queued rows are served from memory until a refresh finds
+them in the repository, so a new patient can log in before the sheet append
+has happened.
+
+Listeners (see :meth:`PatientCache.add_listener`) are told about every full
+reload and every new record, so views derived from the patient table, such
+as :class:`~avacare.analytics.ClinicAnalytics`, stay current without
+rescanning it. A record may be reported more than once (when queued, then
+when it reaches the sheet), so listeners key their updates by ``Patient_ID``.
+"""
+
+import threading
+import time
+
+from .metrics import span
+
+ID_PREFIX = "AVP-"
+FIRST_PATIENT_NUMBER = 4000
+
+
+def patient_number(patient_id):
+    """Return the numeric suffix of an ``AVP-`` ID, or ``None`` if it has none."""
+    try:
+        return int(str(patient_id).split("-")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+class PatientCache:
+    def __init__(self, repository, ttl=60, full_ttl=900, clock=time.monotonic, queue=None, reservation_ttl=1800):
+        self.repository = repository
+        self.queue = queue
+        self.ttl = ttl
+        self.reservation_ttl = reservation_ttl
+        self.full_ttl = full_ttl
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._records = []
+        self._by_id = {}
+        self._max_number = None
+        self._reservations = {}                 # holder -> (patient ID, number, expires at)
+        self._pending = {}
+        self._frame = None
+        self._checked_at = None
+        self._loaded_at = None
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Register an object with ``patient_changed(record)`` and ``patients_reloaded(records)`` hooks."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    # -------------------- refresh --------------------
+
+    def _is_fresh(self, now):
+        return self._checked_at is not None and now - self._checked_at < self.ttl
+
+    def _needs_full_reload(self, now):
+        return self._loaded_at is None or now - self._loaded_at >= self.full_ttl
+
+    def refresh(self, full=False):
+        """Bring the cache up to date, incrementally unless ``full`` is set."""
+        with self._lock:
+            now = self.clock()
+            reload = full or self._needs_full_reload(now)
+            if reload:
+                with span("patients_read", kind="full"):
+                    records = self.repository.all()
+                self._replace(records)
+                self._loaded_at = now
+            else:
+                with span("patients_read", kind="incremental"):
+                    new_records = self.repository.records_since(len(self._records))
+                if new_records:
+                    self._extend(new_records)
+            pending_before = self._pending
+            self._merge_pending()
+            self._checked_at = now
+            if reload:
+                for listener in self._listeners:
+                    listener.patients_reloaded(self._records + list(self._pending.values()))
+            else:
+                changed = new_records + [r for i, r in self._pending.items() if i not in pending_before]
+                for listener in self._listeners:
+                    for record in changed:
+                        listener.patient_changed(record)
+
+    def _ensure_fresh(self):
+        if not self._is_fresh(self.clock()):
+            self.refresh()
+
+    def _replace(self, records):
+        self._records = []
+        self._by_id = {}
+        self._max_number = None
+        self._extend(records)
+
+    def _extend(self, records):
+        for record in records:
+            self._records.append(record)
+            self._index(record)
+        self._frame = None
+
+    def _index(self, record):
+        patient_id = record.get("Patient_ID")
+        self._by_id[patient_id] = record
+        self._note_number(patient_number(patient_id))
+
+    def _note_number(self, number):
+        if number is not None and (self._max_number is None or number > self._max_number):
+            self._max_number = number
+
+    def _merge_pending(self):
+        """Keep queued rows visible until the repository returns them."""
+        if self.queue is None:
+            return
+        headers = self._headers()
+        pending = {}
+        for row in self.queue.pending_rows():
+            record = dict(zip(headers, row)) if headers else {"Patient_ID": row[0]}
+            patient_id = record.get("Patient_ID")
+            if patient_id not in self._by_id:
+                pending[patient_id] = record
+                self._note_number(patient_number(patient_id))
+        if pending.keys() != self._pending.keys():
+            self._frame = None
+        self._pending = pending
+
+    def _headers(self):
+        return list(self._records[0]) if self._records else None
+
+    def invalidate(self):
+        """Force the next read to look for new rows, e.g. after an append."""
+        with self._lock:
+            self._checked_at = None
+
+    def ensure_fresh(self):
+        """Refresh if the TTL has passed, so listeners see rows added by other processes."""
+        with self._lock:
+            self._ensure_fresh()
+
+    # -------------------- reads --------------------
+
+    def records(self):
+        with self._lock:
+            self._ensure_fresh()
+            return self._records + list(self._pending.values())
+
+    def dataframe(self):
+        with self._lock:
+            self._ensure_fresh()
+            if self._frame is None:
+                import pandas as pd
+
+                self._frame = pd.DataFrame(self._records + list(self._pending.values()))
+            return self._frame
+
+    def get(self, patient_id):
+        with self._lock:
+            self._ensure_fresh()
+            record = self._by_id.get(patient_id)
+            return record if record is not None else self._pending.get(patient_id)
+
+    @property
+    def max_patient_number(self):
+        with self._lock:
+            self._ensure_fresh()
+            return self._max_number
+
+    # -------------------- ID allocation --------------------
+
+    def reserve_patient_id(self, holder):
+        """Return the ID reserved for ``holder``, allocating a new one if needed.
+
+        Every call extends the reservation by ``reservation_ttl`` seconds.
+        """
+        with self._lock:
+            now = self.clock()
+            for other, (_, _, expires_at) in list(self._reservations.items()):
+                if expires_at <= now:
+                    del self._reservations[other]
+            if holder in self._reservations:
+                patient_id, number, _ = self._reservations[holder]
+            else:
+                self._ensure_fresh()
+                reserved = {number for _, number, _ in self._reservations.values()}
+                number = FIRST_PATIENT_NUMBER if self._max_number is None else self._max_number + 1
+                while number in reserved:
+                    number += 1
+                patient_id = f"{ID_PREFIX}{number}"
+            self._reservations[holder] = (patient_id, number, now + self.reservation_ttl)
+            return patient_id
+
+    def release_patient_id(self, holder):
+        with self._lock:
+            self._reservations.pop(holder, None)
+
+    # -------------------- writes --------------------
+
+    def append(self, row):
+        """Append (or queue) ``row`` and make it visible on the next read."""
+        if self.queue is not None:
+            self.queue.enqueue_append(row)
+        else:
+            with span("patients_write", kind="single"):
+                self.repository.append(row)
+        with self._lock:
+            patient_id = row[0] if row else None
+            headers = self._headers()
+            record = dict(zip(headers, row)) if headers else {"Patient_ID": patient_id}
+            if self.queue is not None:
+                self._pending[patient_id] = record
+                self._frame = None
+            self._note_number(patient_number(patient_id))
+            for holder, (reserved, _, _) in list(self._reservations.items()):
+                if reserved == patient_id:
+                    del self._reservations[holder]
+            self.invalidate()
+            for listener in self._listeners:
+                listener.patient_changed(record)
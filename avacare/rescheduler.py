@@ -0,0 +1,107 @@
+"""Ranked slot recommendations across every doctor of a specialty.
+
+:class:`Rescheduler` ranks the open slots of a specialty from the
+:class:`~avacare.schedule.Calendar` by a cost, lower being better::
+
+    cost = time_weight * hours to wait
+         + risk_weight * no-show risk score of the patient in that slot
+         + load_weight * share of the doctor's slots already filled that day
+
+The risk score is :func:`~avacare.risk.no_show_risk_score`, so an early-hour
+slot or rough weather counts against a slot exactly as on the weather check.
+
+Candidates come from the calendar in chronological order and the best ``k``
+are kept in a bounded heap, ``O(n log k)`` instead of sorting every slot.
+Since the wait only grows along the scan and the other terms are bounded, the
+scan stops as soon as no later slot can beat the ``k``-th best.
+
+:meth:`Rescheduler.rebook_high_risk` is the batch mode: it walks a list of
+appointments once, riskiest first, and moves each high-risk one to its best
+lower-risk alternative.
+"""
+
+import heapq
+from collections import namedtuple
+from datetime import timedelta
+
+from .risk import HIGH_RISK, no_show_risk_score, risk_label
+from .slots import OPEN, slot_start
+
+Recommendation = namedtuple("Recommendation", ["cost", "slot", "risk_score", "risk", "wait_hours", "doctor_load"])
+Appointment = namedtuple("Appointment", ["key", "patient", "specialty", "doctor", "slot", "weather_message"])
+Rebooking = namedtuple("Rebooking", ["key", "old_slot", "old_risk_score", "new", "doctor"])
+
+
+class Rescheduler:
+    def __init__(self, calendar, time_weight=1 / 24, risk_weight=1.0, load_weight=2.0, horizon=timedelta(days=14)):
+        self.calendar = calendar
+        self.time_weight = time_weight
+        self.risk_weight = risk_weight
+        self.load_weight = load_weight
+        self.horizon = horizon
+
+    def _doctor_load(self, doctor_id, day, loads):
+        if (doctor_id, day) not in loads:
+            slots = self.calendar.doctor_slots(doctor_id, day, day)
+            filled = sum(slot["Slot_Status"] != OPEN for slot in slots)
+            loads[(doctor_id, day)] = filled / len(slots) if slots else 0.0
+        return loads[(doctor_id, day)]
+
+    def recommend(self, patient, specialty, weather_message="", after=None, k=3, exclude=(), max_risk_score=None):
+        """Return the ``k`` best open slots of ``specialty`` for ``patient``, best first.
+
+        ``after`` (a datetime) is the earliest start considered and the origin of
+        the wait; by default the specialty's earliest open slot. ``exclude`` holds
+        slot labels to skip, such as the patient's current slot, and slots scoring
+        above ``max_risk_score`` are left out.
+        """
+        first = self.calendar.earliest_open(specialty, after)
+        if first is None or k <= 0:
+            return []
+        origin = after or slot_start(first)
+        candidates = self.calendar.open_slots(specialty, origin, origin + self.horizon)
+        # The patient's own points are the floor of every slot's score
+        floor = self.risk_weight * no_show_risk_score(patient, "", "")
+        worst = []                                    # max-heap of the best k so far: (-cost, -i, rec)
+        loads = {}
+        for i, slot in enumerate(candidates):
+            if slot["label"] in exclude:
+                continue
+            wait_hours = (slot_start(slot) - origin).total_seconds() / 3600
+            if len(worst) == k and self.time_weight * wait_hours + floor >= -worst[0][0]:
+                break
+            risk_score = no_show_risk_score(patient, weather_message, slot["label"])
+            if max_risk_score is not None and risk_score > max_risk_score:
+                continue
+            load = self._doctor_load(slot["Doctor_ID"], slot_start(slot).date(), loads)
+            cost = self.time_weight * wait_hours + self.risk_weight * risk_score + self.load_weight * load
+            item = (-cost, -i, Recommendation(cost, slot, risk_score, risk_label(risk_score), wait_hours, load))
+            if len(worst) < k:
+                heapq.heappush(worst, item)
+            elif item[:2] > worst[0][:2]:
+                heapq.heapreplace(worst, item)
+        return [rec for _, _, rec in sorted(worst, key=lambda item: (-item[0], -item[1]))]
+
+    def rebook_high_risk(self, appointments, book, release, k=5):
+        """Move every high-risk appointment to its best lower-risk slot, riskiest first.
+
+        ``book(doctor, label)`` returns whether the new slot was taken and
+        ``release(doctor, label)`` frees the old one. Returns one
+        :class:`Rebooking` per high-risk appointment, with ``new`` set to the
+        chosen :class:`Recommendation` or ``None`` when nothing better was open.
+        """
+        scored = [(no_show_risk_score(a.patient, a.weather_message, a.slot), a) for a in appointments]
+        high = [item for item in scored if risk_label(item[0]) == HIGH_RISK]
+        high.sort(key=lambda item: -item[0])
+        results = []
+        for old_score, appointment in high:
+            moved = None
+            for rec in self.recommend(appointment.patient, appointment.specialty, appointment.weather_message,
+                                      k=k, exclude={appointment.slot}, max_risk_score=old_score - 1):
+                # Booking updates the calendar, so the next appointment sees this slot as taken
+                if book(rec.slot["Doctor_Name"], rec.slot["label"]):
+                    release(appointment.doctor, appointment.slot)
+                    moved = rec
+                    break
+            results.append(Rebooking(appointment.key, appointment.slot, old_score, moved, appointment.doctor))
+        return results
@@ -0,0 +1,204 @@
+"""No-show risk scoring.
+
+:func:`predict_no_show_risk` is the point system used on the weather check
+step. :func:`score_no_show_risk_frame` applies exactly the same rules to a
+whole patient table with columnar operations, for the nightly risk report and
+the overbooking recommendation for one day (``python -m avacare.risk``).
+
+numpy and pandas are imported inside the batch functions, so the chat's
+scalar path does not load them.
+"""
+
+HIGH_RISK = "⚠️ High Risk of No-Show"
+MODERATE_RISK = "🟠 Moderate Risk of No-Show"
+LOW_RISK = "✅ Low Risk of No-Show"
+
+
+def risk_label(risk_score):
+    if risk_score >= 5:
+        return HIGH_RISK
+    elif risk_score >= 3:
+        return MODERATE_RISK
+    else:
+        return LOW_RISK
+
+
+def _missed_points(value):
+    missed = int(str(value).strip())
+    if missed >= 2:
+        return 2
+    elif missed == 1:
+        return 1
+    return 0
+
+
+def _category_points(category):
+    category = category.lower()
+    if "high" in category:
+        return 2
+    elif "moderate" in category:
+        return 1
+    return 0
+
+
+def _weather_points(weather_message):
+    if "rain" in weather_message.lower() or "storm" in weather_message.lower():
+        return 2
+    elif "snow" in weather_message.lower():
+        return 1
+    return 0
+
+
+def _hour_points(selected_slot):
+    try:
+        hour = int(selected_slot.split()[1].split(":")[0])
+        if hour < 10:
+            return 1
+    except:
+        pass
+    return 0
+
+
+def no_show_risk_score(patient_record, weather_message, selected_slot):
+    risk_score = _missed_points(patient_record.get("Missed_Appointments", "0"))
+    risk_score += _category_points(patient_record.get("Risk_Category", ""))
+    risk_score += _weather_points(weather_message)
+    risk_score += _hour_points(selected_slot)
+    return risk_score
+
+
+def predict_no_show_risk(patient_record, weather_message, selected_slot):
+    return risk_label(no_show_risk_score(patient_record, weather_message, selected_slot))
+
+
+# -------------------- BATCH SCORING --------------------
+
+INVALID = -100
+
+
+def _safe_missed_points(value):
+    try:
+        return _missed_points(value)
+    except ValueError:
+        return INVALID
+
+
+def _column_points(df, values, rule):
+    # Columns have few distinct values: apply the scalar rule once per value
+    # and broadcast the points back through the factorized codes.
+    import numpy as np
+    import pandas as pd
+
+    if not isinstance(values, pd.Series):
+        return np.full(len(df), rule(values), dtype=np.int64)
+    codes, uniques = pd.factorize(values.reindex(df.index), use_na_sentinel=False)
+    table = np.fromiter((rule(u) for u in uniques), dtype=np.int64, count=len(uniques))
+    return table[codes]
+
+
+# Label per score, indexed by min(score, 5)
+_LABELS = (LOW_RISK, LOW_RISK, LOW_RISK, MODERATE_RISK, MODERATE_RISK, HIGH_RISK)
+
+
+def score_no_show_risk_frame(df, weather=None, slots=None):
+    """Score every row of a patient DataFrame at once.
+
+    ``weather`` is one forecast message for all rows, a Series aligned with
+    ``df``, or ``None`` to use each row's ``Weather_Condition``. ``slots`` holds
+    ``"DATE HH:MM"`` strings the same way; without it no early-hour points are
+    added. Returns ``No_Show_Score`` and ``No_Show_Risk`` columns indexed like
+    ``df``, identical to :func:`no_show_risk_score` and
+    :func:`predict_no_show_risk` row by row. Rows with a
+    ``Missed_Appointments`` value the scalar function would reject get ``NaN``
+    in both columns.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if weather is None:
+        weather = df.get("Weather_Condition", "")
+    score = _column_points(df, df.get("Missed_Appointments", "0"), _safe_missed_points)
+    score += _column_points(df, df.get("Risk_Category", ""), _category_points)
+    score += _column_points(df, weather, _weather_points)
+    if slots is not None:
+        score += _column_points(df, slots, _hour_points)
+
+    valid = score >= 0
+    labels = np.array(_LABELS, dtype=object)[np.clip(score, 0, 5)]
+    labels[~valid] = None
+    return pd.DataFrame(
+        {"No_Show_Score": np.where(valid, score, np.nan), "No_Show_Risk": labels},
+        index=df.index,
+    )
+
+
+# The suggestion never adds more than this share of the day's appointments
+MAX_OVERBOOK_SHARE = 0.1
+
+
+def risk_report(df, day, weather=None, slots=None, no_show_rates=None, max_share=MAX_OVERBOOK_SHARE):
+    """Count the appointments of ``day`` per risk label, with an overbooking suggestion.
+
+    The patient table records missed appointments but not attended ones, and
+    the High and Moderate labels are built from the missed count, so it
+    cannot say how often a label's patients miss a visit: the share of them
+    with a missed appointment is 1.0 by construction. The rates have to come
+    from attendance records instead, as ``no_show_rates`` (label -> share of
+    booked appointments that were missed).
+
+    Returns the report and the suggestion: the day's expected no-shows,
+    rounded down and capped at ``max_share`` of its appointments, or
+    ``None`` without ``no_show_rates``.
+    """
+    import pandas as pd
+
+    scored = score_no_show_risk_frame(df, weather, slots)
+    on_day = pd.to_datetime(df["Appointment_Date"], format="%d-%m-%Y", errors="coerce").dt.date == day
+    report = (
+        pd.DataFrame({"No_Show_Risk": scored["No_Show_Risk"], "on_day": on_day})
+        .dropna(subset=["No_Show_Risk"])
+        .groupby("No_Show_Risk")
+        .agg(patients=("on_day", "size"), appointments=("on_day", "sum"))
+        .reindex([HIGH_RISK, MODERATE_RISK, LOW_RISK], fill_value=0)
+    )
+    report["no_show_rate"] = report.index.map(no_show_rates or {}).astype(float)
+    report["expected_no_shows"] = report["appointments"] * report["no_show_rate"]
+    if no_show_rates is None:
+        return report, None
+    cap = int(report["appointments"].sum() * max_share)
+    return report, min(int(report["expected_no_shows"].sum()), cap)
+
+
+if __name__ == "__main__":
+    import argparse
+    from datetime import date
+
+    import pandas as pd
+
+    from .slots import parse_date
+    from .storage import PATIENT_CSV
+
+    parser = argparse.ArgumentParser(description="Nightly no-show risk report")
+    parser.add_argument("--patients", default=str(PATIENT_CSV), help="patient CSV to score")
+    parser.add_argument("--date", type=parse_date, default=date.today(),
+                        help="day to suggest overbooking for, YYYY-MM-DD or DD-MM-YYYY (default: today)")
+    parser.add_argument("--rates", nargs=3, type=float, metavar=("HIGH", "MODERATE", "LOW"),
+                        help="share of booked appointments missed per label, from attendance records")
+    parser.add_argument("--max-share", type=float, default=MAX_OVERBOOK_SHARE,
+                        help="cap on the suggestion as a share of the day's appointments")
+    parser.add_argument("--out", help="write per-patient scores to this CSV")
+    args = parser.parse_args()
+
+    patients = pd.read_csv(args.patients, dtype=str)
+    rates = dict(zip([HIGH_RISK, MODERATE_RISK, LOW_RISK], args.rates)) if args.rates else None
+    report, overbook = risk_report(patients, args.date, no_show_rates=rates, max_share=args.max_share)
+    print(report.to_string())
+    print(f"\n{int(report['appointments'].sum())} appointments on {args.date:%d-%m-%Y}")
+    if overbook is None:
+        print("No overbooking suggested: the patient table does not record attended appointments, so it "
+              "cannot give a no-show rate per label. Pass --rates measured from attendance records.")
+    else:
+        print(f"Recommended overbooking: {overbook} extra appointments (at most {args.max_share:.0%} of the day)")
+    if args.out:
+        scored = score_no_show_risk_frame(patients)
+        pd.concat([patients[["Patient_ID"]], scored], axis=1).to_csv(args.out, index=False)
@@ -0,0 +1,189 @@
+"""Merged availability calendar and the per-doctor workbook layout.
+
+``145.xlsx`` keeps availability as one ``Doc_<Name>`` tab per doctor instead
+of the single ``Doctor_Availability`` table: the first tab has a header row,
+the others start straight with data. :func:`merge_doctor_tabs` turns the tabs
+back into rows of the ``Doctor_Availability`` layout, so every backend sees
+one table. In Google Sheets, :func:`fetch_doctor_tabs` reads all the tabs
+with a single ``values:batchGet`` request instead of one request per doctor.
+
+:class:`Calendar` indexes the merged slots by time. Each doctor's slots are
+kept in an array sorted by start time, and the open slots additionally in one
+sorted array per specialty, so:
+
+* "open slots of specialty X between dates A and B" is two bisections and a slice
+* "earliest open slot of specialty X after t" is one bisection, ``O(log n)``
+
+Like :class:`~avacare.open_slots.OpenSlots`, the calendar listens to a
+:class:`~avacare.slots.SlotIndex` and moves a slot in or out of the open
+arrays with a bisect when it is booked.
+"""
+
+import bisect
+import threading
+from datetime import date, datetime, time, timedelta
+
+from .slots import OPEN, SLOT_FIELDS, slot_label, slot_start
+from .storage import FIRST_DATA_ROW
+
+DOC_TAB_PREFIX = "Doc_"
+
+
+# -------------------- per-doctor layout --------------------
+
+def doctor_tabs(titles):
+    """The per-doctor tab titles among ``titles``, in workbook order."""
+    return [title for title in titles if title.startswith(DOC_TAB_PREFIX)]
+
+
+def merge_doctor_tabs(tabs):
+    """Concatenate ``{tab title: rows of cells}`` into ``Doctor_Availability`` rows.
+
+    Header rows and blank rows are skipped wherever they appear; a row with a
+    missing field raises ``ValueError`` naming the tab.
+    """
+    merged = []
+    for title, rows in tabs.items():
+        for i, row in enumerate(rows, start=1):
+            cells = [("" if cell is None else str(cell).strip()) for cell in row][: len(SLOT_FIELDS)]
+            if not any(cells) or cells[0] == SLOT_FIELDS[0]:
+                continue
+            if len(cells) < len(SLOT_FIELDS) or not all(cells):
+                raise ValueError(f"{title!r} row {i} is incomplete: {cells}")
+            merged.append(cells)
+    return merged
+
+
+def fetch_doctor_tabs(spreadsheet):
+    """Read every ``Doc_`` tab of a gspread spreadsheet in one batch request."""
+    titles = doctor_tabs(ws.title for ws in spreadsheet.worksheets())
+    ranges = ["'{}'".format(title.replace("'", "''")) for title in titles]
+    value_ranges = spreadsheet.values_batch_get(ranges).get("valueRanges", [])
+    return {title: value_range.get("values", []) for title, value_range in zip(titles, value_ranges)}
+
+
+# -------------------- calendar --------------------
+
+def _bound(value, end=False):
+    """A query bound as a datetime; a date ``end`` includes that whole day."""
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value + timedelta(days=1) if end else value, time.min)
+    raise TypeError(f"Expected a date or datetime, got {value!r}")
+
+
+def _between(entries, start, end):
+    lo = 0 if start is None else bisect.bisect_left(entries, (start,))
+    hi = len(entries) if end is None else bisect.bisect_left(entries, (end,))
+    return entries[lo:hi]
+
+
+class Calendar:
+    def __init__(self, slots=()):
+        self._lock = threading.RLock()
+        self.slots_reloaded(slots)
+
+    @classmethod
+    def from_slot_index(cls, slot_index):
+        calendar = cls(slot_index.slots())
+        slot_index.add_listener(calendar)
+        return calendar
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from ``Doctor_Availability`` rows, e.g. the output of :func:`merge_doctor_tabs`."""
+        return cls(dict(zip(SLOT_FIELDS, row), row=i) for i, row in enumerate(rows, start=FIRST_DATA_ROW))
+
+    # -------------------- SlotIndex hooks --------------------
+
+    def slots_reloaded(self, slots):
+        by_doctor, open_by_doctor, open_by_specialty = {}, {}, {}
+        doctor_ids, specialty_of = {}, {}
+        for slot in slots:
+            doctor_id = slot["Doctor_ID"]
+            doctor_ids[doctor_id] = doctor_id
+            doctor_ids[slot["Doctor_Name"]] = doctor_id
+            specialty_of[doctor_id] = slot["Specialty"]
+            entry = self._entry(slot)
+            by_doctor.setdefault(doctor_id, []).append(entry)
+            open_by_doctor.setdefault(doctor_id, [])
+            open_by_specialty.setdefault(slot["Specialty"], [])
+            if slot["Slot_Status"] == OPEN:
+                open_by_doctor[doctor_id].append(entry)
+                open_by_specialty[slot["Specialty"]].append(entry)
+        for entries in (*by_doctor.values(), *open_by_doctor.values(), *open_by_specialty.values()):
+            entries.sort(key=lambda entry: entry[:2])
+        with self._lock:
+            self._by_doctor = by_doctor
+            self._open_by_doctor = open_by_doctor
+            self._open_by_specialty = open_by_specialty
+            self._doctor_ids = doctor_ids
+            self._specialty_of = specialty_of
+
+    def slot_changed(self, slot):
+        with self._lock:
+            doctor_id = slot["Doctor_ID"]
+            entries = self._by_doctor.get(doctor_id)
+            if entries is None:
+                return
+            entry = self._entry(slot)
+            i = bisect.bisect_left(entries, entry[:2])
+            if i < len(entries) and entries[i][:2] == entry[:2]:
+                entries[i] = entry
+            for open_entries in (self._open_by_doctor[doctor_id], self._open_by_specialty[slot["Specialty"]]):
+                j = bisect.bisect_left(open_entries, entry[:2])
+                present = j < len(open_entries) and open_entries[j][:2] == entry[:2]
+                if slot["Slot_Status"] == OPEN and not present:
+                    open_entries.insert(j, entry)
+                elif slot["Slot_Status"] != OPEN and present:
+                    del open_entries[j]
+
+    @staticmethod
+    def _entry(slot):
+        # (start, row) orders slots chronologically and is unique per slot
+        return (slot_start(slot), slot["row"], dict(slot, label=slot_label(slot)))
+
+    # -------------------- queries --------------------
+
+    def doctors(self, specialty):
+        """``Doctor_ID`` of every doctor of ``specialty``."""
+        with self._lock:
+            return sorted(d for d, s in self._specialty_of.items() if s == specialty)
+
+    def doctor_slots(self, doctor, start=None, end=None):
+        """All slots of ``doctor`` (ID or name) starting in ``[start, end)``, whatever their status."""
+        with self._lock:
+            entries = self._by_doctor.get(self._doctor_ids.get(doctor), [])
+            return [entry[2] for entry in _between(entries, _bound(start), _bound(end, end=True))]
+
+    def open_slots(self, specialty, start=None, end=None, limit=None):
+        """Open slots of ``specialty`` starting in ``[start, end)``, earliest first.
+
+        ``start`` and ``end`` are datetimes or dates; a date ``end`` includes that day.
+        """
+        with self._lock:
+            entries = _between(self._open_by_specialty.get(specialty, []), _bound(start), _bound(end, end=True))
+            return [entry[2] for entry in entries[:limit]]
+
+    def earliest_open(self, specialty, after=None):
+        """The earliest open slot of any doctor of ``specialty`` at or after ``after``, or ``None``."""
+        with self._lock:
+            entries = self._open_by_specialty.get(specialty, [])
+            i = 0 if after is None else bisect.bisect_left(entries, (_bound(after),))
+            return entries[i][2] if i < len(entries) else None
+
+    def earliest_by_doctor(self, specialty, after=None):
+        """``{Doctor_ID: earliest open slot at or after after}`` for the doctors of ``specialty`` with one."""
+        with self._lock:
+            earliest = {}
+            for doctor_id in self.doctors(specialty):
+                entries = self._open_by_doctor[doctor_id]
+                i = 0 if after is None else bisect.bisect_left(entries, (_bound(after),))
+                if i < len(entries):
+                    earliest[doctor_id] = entries[i][2]
+            return earliest
+
+    def specialties(self):
+        with self._lock:
+            return sorted(self._open_by_specialty)
@@ -0,0 +1,242 @@
+"""State shared by several app replicas.
+
+One Streamlit process keeps booking progress in ``st.session_state`` and
+relies on in-process locks to keep writes unique. Behind a load balancer each
+replica has its own memory, so :class:`SharedState` moves what has to agree
+across replicas into a shared key-value store:
+
+* sessions: the booking progress of a chat under its session token, so
+  another replica can resume it
+* slot holds: a slot on the ``payment`` step is held for one session and
+  expires after ``hold_ttl`` seconds if the patient walks away
+* claims: one key per filled slot and per registered patient ID, set only if
+  absent, so two replicas can never both book a slot or append a patient; a
+  retry by the same session is recognised and not applied twice. Slot claims
+  are keyed by doctor, date and start time and expire after ``claim_ttl``
+  seconds; the engine also drops one early once the sheet shows the slot open
+  again
+* patient IDs: allocated from one shared counter, singly for the
+  registration form or in blocks for a bulk import (:mod:`avacare.bulk`)
+
+The store is anything with redis-py's ``get``/``set(nx=, ex=)``/``delete``/
+``incr``/``expire``/``ttl`` (with ``decode_responses=True``). :class:`SQLiteStore`
+implements that subset on a SQLite file, whose file lock serialises replicas
+on one host or a shared volume; ``AVACARE_STATE_URL=redis://...`` uses Redis.
+
+Holds are advisory: they keep a second patient from paying for a slot that is
+being paid for. The claims are what prevent double bookings.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+KEY_PREFIX = "avacare:"
+
+
+class SQLiteStore:
+    """The subset of the Redis commands used by :class:`SharedState`, on one SQLite file.
+
+    Every command is a transaction; expired keys read as absent and are
+    purged as they are written over.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30, isolation_level=None)
+        self.clock = clock
+        self._lock = threading.Lock()
+        with self._lock:
+            if str(path) != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.clock()
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _live(self, key, now):
+        return self.conn.execute(
+            "SELECT value, expires_at FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+        ).fetchone()
+
+    @staticmethod
+    def _expires_at(now, ex, px):
+        if ex is not None:
+            return now + ex
+        if px is not None:
+            return now + px / 1000
+        return None
+
+    def get(self, key):
+        with self._transaction() as now:
+            row = self._live(key, now)
+        return None if row is None else row[0]
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        """Like Redis ``SET``: returns ``True``, or ``None`` when ``nx``/``xx`` prevented the write."""
+        with self._transaction() as now:
+            exists = self._live(key, now) is not None
+            if (nx and exists) or (xx and not exists):
+                return None
+            self.conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, str(value), self._expires_at(now, ex, px)),
+            )
+        return True
+
+    def delete(self, *keys):
+        with self._transaction() as now:
+            removed = 0
+            for key in keys:
+                removed += self._live(key, now) is not None
+                self.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        return removed
+
+    def incr(self, key, amount=1):
+        with self._transaction() as now:
+            row = self._live(key, now)
+            value = int(row[0]) + amount if row else amount
+            expires_at = row[1] if row else None
+            self.conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, str(value), expires_at)
+            )
+        return value
+
+    incrby = incr
+
+    def expire(self, key, seconds):
+        with self._transaction() as now:
+            if self._live(key, now) is None:
+                return False
+            self.conn.execute("UPDATE kv SET expires_at = ? WHERE key = ?", (now + seconds, key))
+        return True
+
+    def ttl(self, key):
+        """Seconds left, ``-1`` for a key without expiry and ``-2`` for a missing key."""
+        with self._transaction() as now:
+            row = self._live(key, now)
+        if row is None:
+            return -2
+        return -1 if row[1] is None else int(row[1] - now)
+
+
+class SharedState:
+    def __init__(self, store, session_ttl=24 * 3600, hold_ttl=300, claim_ttl=24 * 3600):
+        self.store = store
+        self.session_ttl = session_ttl
+        self.hold_ttl = hold_ttl
+        self.claim_ttl = claim_ttl
+
+    # -------------------- sessions --------------------
+
+    def load_session(self, token):
+        value = self.store.get(f"{KEY_PREFIX}session:{token}")
+        return None if value is None else json.loads(value)
+
+    def save_session(self, token, values):
+        self.store.set(f"{KEY_PREFIX}session:{token}", json.dumps(values), ex=self.session_ttl)
+
+    def drop_session(self, token):
+        self.store.delete(f"{KEY_PREFIX}session:{token}")
+
+    # -------------------- slot holds --------------------
+
+    def hold(self, slot_key, holder):
+        """Hold ``slot_key`` for ``holder``, or extend its hold; ``False`` if someone else holds it."""
+        key = f"{KEY_PREFIX}hold:{slot_key}"
+        if self.store.set(key, holder, nx=True, ex=self.hold_ttl):
+            return True
+        if self.store.get(key) == holder:
+            self.store.expire(key, self.hold_ttl)
+            return True
+        return False
+
+    def held_by_other(self, slot_key, holder):
+        owner = self.store.get(f"{KEY_PREFIX}hold:{slot_key}")
+        return owner is not None and owner != holder
+
+    def release_hold(self, slot_key, holder):
+        key = f"{KEY_PREFIX}hold:{slot_key}"
+        if self.store.get(key) == holder:
+            self.store.delete(key)
+
+    # -------------------- idempotency claims --------------------
+
+    def claim(self, key, holder, expires=False):
+        """Claim ``key`` for ``holder`` if nobody has; ``True`` only for the first claim.
+
+        ``expires=True`` lets the claim lapse after ``claim_ttl`` seconds.
+        """
+        ex = self.claim_ttl if expires else None
+        return bool(self.store.set(f"{KEY_PREFIX}claim:{key}", holder, nx=True, ex=ex))
+
+    def owner(self, key):
+        return self.store.get(f"{KEY_PREFIX}claim:{key}")
+
+    def claim_age(self, key):
+        """Seconds since an expiring claim on ``key`` was taken; ``None`` if there is none."""
+        remaining = self.store.ttl(f"{KEY_PREFIX}claim:{key}")
+        return None if remaining < 0 else self.claim_ttl - remaining
+
+    def unclaim(self, key, holder=None):
+        """Drop the claim on ``key``; with ``holder``, only if it is still theirs."""
+        key = f"{KEY_PREFIX}claim:{key}"
+        if holder is None or self.store.get(key) == holder:
+            self.store.delete(key)
+
+    # -------------------- patient IDs --------------------
+
+    def reserve_block(self, count, floor):
+        """Allocate ``count`` consecutive patient numbers above ``floor``; return the first."""
+        counter = f"{KEY_PREFIX}patient_number"
+        last = self.store.incr(counter, count)
+        if last - count < floor:
+            # The store is behind the sheet (first use, or rows added elsewhere): skip ahead. The
+            # second increment alone owns at least ``count`` numbers above ``floor``.
+            last = self.store.incr(counter, max(floor - (last - count), count))
+        return last - count + 1
+
+    def reserve_number(self, holder, floor):
+        """The patient number reserved for ``holder``, allocating one above ``floor`` if needed."""
+        key = f"{KEY_PREFIX}patient_number:{holder}"
+        reserved = self.store.get(key)
+        if reserved is not None:
+            return int(reserved)
+        number = self.reserve_block(1, floor)
+        if not self.store.set(key, number, nx=True, ex=self.session_ttl):
+            return int(self.store.get(key))
+        return number
+
+    def release_number(self, holder):
+        """Drop ``holder``'s reservation; the shared counter never hands the number out again."""
+        self.store.delete(f"{KEY_PREFIX}patient_number:{holder}")
+
+
+def shared_state_from_env():
+    """Build the store selected by ``AVACARE_STATE_URL``, or ``None`` for a single replica.
+
+    ``redis://`` and ``rediss://`` URLs use Redis (the ``redis`` package);
+    ``sqlite:///path/to/state.db`` uses :class:`SQLiteStore`.
+    """
+    url = os.environ.get("AVACARE_STATE_URL")
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        import redis
+
+        return SharedState(redis.Redis.from_url(url, decode_responses=True))
+    if url.startswith("sqlite:///"):
+        return SharedState(SQLiteStore(url[len("sqlite:///"):]))
+    raise ValueError(f"Unknown AVACARE_STATE_URL scheme: {url}")
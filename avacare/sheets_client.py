@@ -0,0 +1,148 @@
+"""One authorised Google Sheets client per process.
+
+:class:`SheetsClient` authorises once and keeps a single pooled HTTP session
+for every spreadsheet the app reads. Spreadsheet and worksheet handles are
+cached, so ``worksheet("Sheet1")`` costs one metadata fetch per process
+instead of one per call. The session refreshes the OAuth token itself when it
+expires (and retries a request rejected with 401). A read or an overwrite of
+cell values that hits a dropped connection is retried once on a fresh
+session; an append is not, since it may have reached the sheet before the
+connection dropped, so its error goes back to the caller (the write queue
+retries it with backoff).
+
+Every API request is recorded in the metrics registry as ``sheets_request``,
+labelled by operation (``GET values``, ``POST values:append``, ``POST
+batchUpdate``, ...); :meth:`SheetsClient.latency` summarises them.
+"""
+
+import re
+import threading
+import time
+
+from .metrics import REGISTRY
+
+SPREADSHEET_PATH = re.compile(r"/v4/spreadsheets/[^/:?]+(?P<rest>[^?]*)")
+
+# POST requests that set, read or clear values, so sending one twice has the same effect as once
+IDEMPOTENT_POSTS = ("/values:batchGet", "/values:batchGetByDataFilter", "/values:batchUpdate",
+                    "/values:batchClear", ":clear")
+
+
+def is_idempotent(method, url):
+    method = method.upper()
+    if method in ("GET", "PUT"):
+        return True
+    return method == "POST" and url.split("?", 1)[0].endswith(IDEMPOTENT_POSTS)
+
+
+def operation_name(method, url):
+    """Collapse a Sheets API URL to a stable operation label, without IDs or ranges."""
+    method = method.upper()
+    match = SPREADSHEET_PATH.search(url)
+    if match is None:
+        return f"{method} other"
+    rest = match.group("rest")
+    if rest.startswith("/values"):
+        action = rest.rsplit(":", 1)[1] if ":" in rest else ""
+        return f"{method} values" + (f":{action}" if action else "")
+    if rest.startswith(":"):
+        return f"{method} {rest[1:]}"
+    return f"{method} spreadsheet"
+
+
+def _http_client_class():
+    import requests
+    from google.auth.transport.requests import AuthorizedSession
+    from gspread.http_client import HTTPClient
+    from requests.adapters import HTTPAdapter
+
+    class TimedHTTPClient(HTTPClient):
+        """gspread's HTTP client with per-request timing and one reconnect on a dropped connection.
+
+        Only idempotent requests are sent again after the reconnect.
+        """
+
+        observer = None
+        pool_size = 10
+
+        def reconnect(self):
+            """Replace the session; the credentials and their token carry over."""
+            self.session.close()
+            self.session = AuthorizedSession(self.auth)
+            # Streamlit serves sessions on many threads; let them share warm connections
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            self.session.mount("https://", adapter)
+
+        def request(self, method, endpoint, *args, **kwargs):
+            started = time.perf_counter()
+            ok = False
+            try:
+                try:
+                    response = super().request(method, endpoint, *args, **kwargs)
+                except requests.ConnectionError:
+                    self.reconnect()
+                    if not is_idempotent(method, endpoint):
+                        raise
+                    response = super().request(method, endpoint, *args, **kwargs)
+                ok = True
+                return response
+            finally:
+                if self.observer is not None:
+                    self.observer.record(operation_name(method, endpoint), time.perf_counter() - started, ok)
+
+    return TimedHTTPClient
+
+
+class SheetsClient:
+    def __init__(self, credentials, scope, timeout=30, pool_size=10):
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials, scope)
+        self.client = gspread.authorize(creds, http_client=_http_client_class())
+        http = self.client.http_client
+        http.observer = self
+        http.pool_size = pool_size
+        http.reconnect()
+        self.client.set_timeout(timeout)
+        self._lock = threading.Lock()
+        self._spreadsheets = {}
+        self._worksheets = {}
+
+    # -------------------- handles --------------------
+
+    def spreadsheet(self, key):
+        with self._lock:
+            if key not in self._spreadsheets:
+                self._spreadsheets[key] = self.client.open_by_key(key)
+            return self._spreadsheets[key]
+
+    def worksheet(self, key, title):
+        """Return the cached handle of worksheet ``title``; the first call lists every tab at once."""
+        handle = self._worksheets.get((key, title))
+        if handle is None:
+            spreadsheet = self.spreadsheet(key)
+            with self._lock:
+                for ws in spreadsheet.worksheets():
+                    self._worksheets[(key, ws.title)] = ws
+                handle = self._worksheets.get((key, title))
+            if handle is None:
+                import gspread
+
+                raise gspread.WorksheetNotFound(title)
+        return handle
+
+    def forget_handles(self):
+        """Drop cached handles, e.g. after tabs were renamed or re-created."""
+        with self._lock:
+            self._spreadsheets.clear()
+            self._worksheets.clear()
+
+    # -------------------- metrics --------------------
+
+    def record(self, operation, seconds, ok):
+        REGISTRY.observe("sheets_request", seconds, ok, operation=operation)
+
+    def latency(self):
+        """Return ``{operation: summary}`` with counts, errors and p50/p95/p99 seconds."""
+        return {row["labels"]["operation"]: row for row in REGISTRY.snapshot("sheets_request")}
@@ -0,0 +1,225 @@
+"""Indexed view of the Doctor_Availability table.
+
+:class:`SlotIndex` maps ``(doctor, date, start_time)`` to the sheet row of a
+slot, with the doctor given either as ``Doctor_ID`` or ``Doctor_Name``. The
+index is built from one full read and then kept current in memory and in a
+small SQLite file, so a restarted process does not need to download the sheet
+again and a booking is a single targeted write. Rows can still change under
+the index (slots added or removed in the sheet, bookings made by another
+process), so the index, persisted or not, is rebuilt once it is ``ttl``
+seconds old and whenever a write finds its row changed.
+
+Bookings are compare-and-set: the index lock serialises bookings in this
+process and the repository only writes ``Filled`` over a cell that still says
+``Open``, in a row that still holds the same ``(Doctor_ID, Date, Start_Time)``.
+A write that does not match rebuilds the index and is tried once more at the
+slot's current row. With a :class:`~avacare.write_queue.WriteQueue` a booking
+flips the slot in memory and queues the conditional sheet write for the
+flusher; the queue refuses it if another process sharing the queue file
+already changed the slot, so only one of them confirms it.
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from .metrics import span
+from .storage import FIRST_DATA_ROW, SLOT_KEY
+
+OPEN = "Open"
+FILLED = "Filled"
+
+SLOT_FIELDS = ("Doctor_ID", "Doctor_Name", "Specialty", "Date", "Start_Time", "End_Time", "Slot_Status")
+
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y")
+
+
+def parse_date(value):
+    """Parse the sheet's ``YYYY-MM-DD`` or the patient table's ``DD-MM-YYYY`` dates."""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date: {value!r}")
+
+
+def slot_start(slot):
+    """Return the start of ``slot`` as a datetime, so slots sort chronologically."""
+    start = datetime.strptime(str(slot["Start_Time"]).strip(), "%H:%M").time()
+    return datetime.combine(parse_date(slot["Date"]), start)
+
+
+def slot_label(slot):
+    return f"{slot['Date']} {slot['Start_Time']}"
+
+
+def slot_key(slot):
+    return tuple(slot[f] for f in SLOT_KEY)
+
+
+class _SlotFile:
+    """SQLite persistence for the slot index."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        cols = ", ".join(f"{field} TEXT" for field in SLOT_FIELDS)
+        with self.conn:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS slots (row_number INTEGER PRIMARY KEY, {cols})")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+
+    def load(self):
+        """Return the slots and the time they were read from the sheet (``None`` if unknown)."""
+        rows = self.conn.execute(f"SELECT row_number, {', '.join(SLOT_FIELDS)} FROM slots").fetchall()
+        built_at = self.conn.execute("SELECT value FROM meta WHERE key = 'built_at'").fetchone()
+        return {row[0]: dict(zip(SLOT_FIELDS, row[1:])) for row in rows}, built_at and built_at[0]
+
+    def replace(self, slots, built_at):
+        placeholders = ", ".join("?" for _ in range(len(SLOT_FIELDS) + 1))
+        with self.conn:
+            self.conn.execute("DELETE FROM slots")
+            self.conn.executemany(
+                f"INSERT INTO slots VALUES ({placeholders})",
+                [(row, *(slot[f] for f in SLOT_FIELDS)) for row, slot in slots.items()],
+            )
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('built_at', ?)", (built_at,))
+
+    def set_status(self, row_number, status):
+        with self.conn:
+            self.conn.execute("UPDATE slots SET Slot_Status = ? WHERE row_number = ?", (status, row_number))
+
+
+class SlotIndex:
+    def __init__(self, repository, path=None, queue=None, ttl=300, clock=time.time):
+        self.repository = repository
+        self.queue = queue
+        self.ttl = ttl
+        # Wall-clock time, since the build time is persisted across processes
+        self.clock = clock
+        self._file = _SlotFile(path) if path else None
+        self._lock = threading.RLock()
+        self._slots = {}
+        self._by_key = {}
+        self._listeners = []
+        self._built_at = None
+
+    def add_listener(self, listener):
+        """Register an object with ``slot_changed(slot)`` and ``slots_reloaded(slots)`` hooks."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    # -------------------- loading --------------------
+
+    def _is_fresh(self, built_at):
+        return built_at is not None and self.clock() - built_at < self.ttl
+
+    def _ensure_loaded(self):
+        if self._is_fresh(self._built_at):
+            return
+        if self._built_at is None and self._file:
+            slots, built_at = self._file.load()
+            if slots and self._is_fresh(built_at):
+                self._set_slots(slots)
+                self._built_at = built_at
+                return
+        self.rebuild()
+
+    def ensure_fresh(self):
+        """Rebuild if the TTL has passed, so listeners see changes made by other processes."""
+        with self._lock:
+            self._ensure_loaded()
+
+    def rebuild(self):
+        """Re-read the whole availability table and persist the fresh index."""
+        with self._lock:
+            slots = {}
+            built_at = self.clock()
+            with span("slots_read"):
+                records = self.repository.all()
+            for i, record in enumerate(records):
+                slots[i + FIRST_DATA_ROW] = {f: str(record.get(f, "")) for f in SLOT_FIELDS}
+            if self.queue is not None:
+                # Bookings still in the queue are not in the sheet yet
+                for row_number, (key, status) in self.queue.pending_slot_statuses().items():
+                    slot = slots.get(row_number)
+                    if slot is not None and key in (None, slot_key(slot)):
+                        slot["Slot_Status"] = status
+            self._set_slots(slots)
+            self._built_at = built_at
+            if self._file:
+                self._file.replace(slots, built_at)
+            for listener in self._listeners:
+                listener.slots_reloaded(self.slots())
+
+    def _set_slots(self, slots):
+        self._slots = slots
+        self._by_key = {}
+        for row_number, slot in slots.items():
+            for doctor in (slot["Doctor_ID"], slot["Doctor_Name"]):
+                self._by_key[(doctor, slot["Date"], slot["Start_Time"])] = row_number
+
+    # -------------------- reads --------------------
+
+    def row_for(self, doctor, date, start_time):
+        with self._lock:
+            self._ensure_loaded()
+            return self._by_key.get((doctor, date, start_time))
+
+    def slot(self, doctor, date, start_time):
+        with self._lock:
+            row_number = self.row_for(doctor, date, start_time)
+            return None if row_number is None else dict(self._slots[row_number], row=row_number)
+
+    def slots(self):
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(slot, row=row_number) for row_number, slot in self._slots.items()]
+
+    # -------------------- booking --------------------
+
+    def _set_status(self, row_number, status):
+        self._slots[row_number]["Slot_Status"] = status
+        if self._file:
+            self._file.set_status(row_number, status)
+        for listener in self._listeners:
+            listener.slot_changed(dict(self._slots[row_number], row=row_number))
+
+    def _compare_and_set(self, doctor, date, start_time, expected, status):
+        row_number = self.row_for(doctor, date, start_time)
+        if row_number is None or self._slots[row_number]["Slot_Status"] != expected:
+            return False
+        key = slot_key(self._slots[row_number])
+        if self.queue is not None:
+            if self.queue.enqueue_slot_status(row_number, expected, status, key) is None:
+                # Another process sharing the queue changed the slot first; the rebuild shows its write
+                self.rebuild()
+                return False
+            self._set_status(row_number, status)
+            return True
+        with span("slots_write", kind="single"):
+            written = self.repository.compare_and_set_status(row_number, expected, status, key)
+        if written:
+            self._set_status(row_number, status)
+            return True
+        # Another process changed the slot or the rows moved: the index is out
+        # of date either way, so re-read it and retry where the slot is now
+        self.rebuild()
+        row_number = self._by_key.get((doctor, date, start_time))
+        if row_number is None or self._slots[row_number]["Slot_Status"] != expected:
+            return False
+        with span("slots_write", kind="single"):
+            written = self.repository.compare_and_set_status(row_number, expected, status, key)
+        if written:
+            self._set_status(row_number, status)
+        return written
+
+    def book(self, doctor, date, start_time):
+        """Mark an open slot as filled; return ``False`` if it is unknown or already taken."""
+        with self._lock:
+            return self._compare_and_set(doctor, date, start_time, OPEN, FILLED)
+
+    def release(self, doctor, date, start_time):
+        """Reopen a filled slot, e.g. the old slot of a rescheduled booking; ``False`` if it was not filled."""
+        with self._lock:
+            return self._compare_and_set(doctor, date, start_time, FILLED, OPEN)
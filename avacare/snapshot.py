@@ -0,0 +1,285 @@
+"""Typed, columnar snapshot of the bundled patient and doctor data.
+
+Parsing the CSV and the XLSX workbook costs about a second on every process
+start. ``python -m avacare.snapshot ingest`` converts them once into Arrow
+IPC files under ``.avacare/snapshot/`` (or ``AVACARE_SNAPSHOT_DIR``), one per
+table, with proper types instead of sheet strings:
+
+* dates (``Appointment_Date``, ``Date``, ...) as ``date32``, times as ``time32``
+* counts and ages as integers
+* low-cardinality columns (``Specialty``, ``Slot_Status``, ``Risk_Category``,
+  ``Gender``, ...) dictionary-encoded, which pandas loads as categoricals
+
+The files are uncompressed, so :func:`load` memory-maps them and the columns
+are read straight from the page cache without parsing or copying.
+
+A column is only typed if it converts back to exactly the source strings;
+otherwise it stays a string column and ``ingest`` reports it. Seeding a
+backend from the snapshot (:func:`sheet_frames`) therefore gives the same
+values as parsing the sources. A ``manifest.json`` records the size and
+modification time of each source, so a snapshot whose sources changed is
+treated as stale and ignored.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from .storage import CACHE_DIR, DOCTOR_XLSX, PATIENT_CSV
+
+SNAPSHOT_DIR = Path(os.environ.get("AVACARE_SNAPSHOT_DIR", CACHE_DIR / "snapshot"))
+MANIFEST = "manifest.json"
+VERSION = 1
+
+TEXT, CATEGORY, INT, DATE, TIME = "text", "category", "int", "date", "time"
+
+# Column types per table; columns not listed stay text. Formats are those of the source sheets.
+SCHEMA = {
+    "patients": {
+        "Gender": CATEGORY,
+        "Age": INT,
+        "Suggested_Specialty": CATEGORY,
+        "Appointment_Date": (DATE, "%d-%m-%Y"),
+        "Weather_Condition": CATEGORY,
+        "Insurance_Type": CATEGORY,
+        "Preferred_Communication_Type": CATEGORY,
+        "Preferred_Communication_Language": CATEGORY,
+        "Missed_Appointments": INT,
+        "Risk_Category": CATEGORY,
+        "Token_Payment_Status": CATEGORY,
+        "Missed_Appointment_Reason": CATEGORY,
+        "Caregiver_Assistance_Needed": CATEGORY,
+        "Uber_Voucher_Needed": CATEGORY,
+        "Next_Appointment_Date": (DATE, "%d-%m-%Y"),
+        "Returning_or_Fresh": CATEGORY,
+    },
+    "doctors": {
+        "Age": INT,
+        "Gender": CATEGORY,
+        "Years_of_Experience": INT,
+        "Specialty": CATEGORY,
+    },
+    "availability": {
+        "Doctor_ID": CATEGORY,
+        "Doctor_Name": CATEGORY,
+        "Specialty": CATEGORY,
+        "Date": (DATE, "%Y-%m-%d"),
+        "Start_Time": (TIME, "%H:%M"),
+        "End_Time": (TIME, "%H:%M"),
+        "Slot_Status": CATEGORY,
+    },
+}
+TABLES = tuple(SCHEMA)
+
+
+def _kind(spec):
+    return spec if isinstance(spec, str) else spec[0]
+
+
+# -------------------- conversion --------------------
+
+def _typed(strings, spec):
+    """Convert a string array to ``spec``; ``""`` becomes null."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    values = pc.if_else(pc.equal(strings, ""), pa.scalar(None, pa.string()), strings)
+    kind = _kind(spec)
+    if kind == CATEGORY:
+        encoded = values.dictionary_encode()
+        # The narrowest index type that fits: one byte per value for every categorical here
+        width = next(t for t in (pa.int8(), pa.int16(), pa.int32())
+                     if len(encoded.dictionary) < 2 ** (t.bit_width - 1))
+        return encoded.cast(pa.dictionary(width, pa.string()))
+    if kind == INT:
+        return values.cast(pa.int32())
+    timestamps = pc.strptime(values, format=spec[1], unit="s")
+    return timestamps.cast(pa.date32() if kind == DATE else pa.time32("s"))
+
+
+def _text(array, spec):
+    """The sheet strings of a typed array; null becomes ``""``."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if _kind(spec) in (DATE, TIME):
+        strings = pc.strftime(array, format=spec[1])
+    else:
+        strings = array.cast(pa.string())
+    return pc.fill_null(strings, "")
+
+
+def to_columns(frame, table):
+    """Convert a frame of sheet strings into a typed Arrow table.
+
+    Returns ``(table, kept_as_text)``, the latter naming typed columns whose
+    values did not survive the round trip and were stored as text instead.
+    """
+    import pyarrow as pa
+
+    schema = SCHEMA[table]
+    arrays, names, kept_as_text = [], [], []
+    for column in frame.columns:
+        if str(column).startswith("Unnamed"):
+            continue
+        strings = pa.array(frame[column].fillna("").astype(str).tolist(), pa.string())
+        array = strings
+        spec = schema.get(column, TEXT)
+        if spec != TEXT:
+            try:
+                typed = _typed(strings, spec)
+                if _text(typed, spec).equals(strings):
+                    array = typed
+                else:
+                    kept_as_text.append(column)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                kept_as_text.append(column)
+        arrays.append(array)
+        names.append(str(column))
+    return pa.table(arrays, names=names), kept_as_text
+
+
+def to_sheet_strings(table):
+    """Convert a snapshot table back to a pandas frame of sheet strings."""
+    import pandas as pd
+    import pyarrow as pa
+
+    name = table.schema.metadata[b"avacare.table"].decode()
+    schema = SCHEMA[name]
+    columns = {}
+    for column, array in zip(table.column_names, table.columns):
+        spec = schema.get(column, TEXT) if not pa.types.is_string(array.type) else TEXT
+        columns[column] = _text(array, spec).to_pylist()
+    return pd.DataFrame(columns, dtype=str)
+
+
+# -------------------- ingest --------------------
+
+def _source_stat(path):
+    stat = Path(path).stat()
+    return {"path": str(Path(path).resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_sources(patient_csv=PATIENT_CSV, doctor_xlsx=DOCTOR_XLSX):
+    """Parse the bundled files into ``{table: frame of strings}``.
+
+    ``doctor_xlsx`` may hold a ``Doctor_Availability`` sheet or one ``Doc_<Name>``
+    tab per doctor (``145.xlsx``); the latter are merged into the same table.
+    """
+    import pandas as pd
+
+    from .schedule import doctor_tabs, merge_doctor_tabs
+    from .slots import SLOT_FIELDS
+
+    with pd.ExcelFile(doctor_xlsx) as book:
+        doctors = book.parse("Doctor_Info", dtype=str)
+        if "Doctor_Availability" in book.sheet_names:
+            availability = book.parse("Doctor_Availability", dtype=str)
+        else:
+            tabs = book.parse(doctor_tabs(book.sheet_names), header=None, dtype=str)
+            rows = merge_doctor_tabs({title: tab.fillna("").values.tolist() for title, tab in tabs.items()})
+            availability = pd.DataFrame(rows, columns=list(SLOT_FIELDS), dtype=str)
+    return {"patients": pd.read_csv(patient_csv, dtype=str), "doctors": doctors, "availability": availability}
+
+
+def ingest(directory=SNAPSHOT_DIR, patient_csv=PATIENT_CSV, doctor_xlsx=DOCTOR_XLSX):
+    """Write the snapshot of the sources to ``directory`` and return its manifest."""
+    import pyarrow as pa
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    # Readers ignore the directory until the new manifest is written
+    (directory / MANIFEST).unlink(missing_ok=True)
+    result = {
+        "version": VERSION,
+        "sources": {"patients": _source_stat(patient_csv), "doctors": _source_stat(doctor_xlsx)},
+        "tables": {},
+    }
+    for name, frame in read_sources(patient_csv, doctor_xlsx).items():
+        table, kept_as_text = to_columns(frame, name)
+        table = table.replace_schema_metadata({"avacare.table": name})
+        path = directory / f"{name}.arrow"
+        tmp = path.with_suffix(".tmp")
+        # Uncompressed IPC so the file can be memory-mapped and used in place
+        with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp, path)
+        result["tables"][name] = {
+            "rows": table.num_rows,
+            "bytes": path.stat().st_size,
+            "columns": {field.name: str(field.type) for field in table.schema},
+            "kept_as_text": kept_as_text,
+        }
+    (directory / MANIFEST).write_text(json.dumps(result, indent=1))
+    return result
+
+
+# -------------------- loading --------------------
+
+def manifest(directory=SNAPSHOT_DIR):
+    try:
+        return json.loads((Path(directory) / MANIFEST).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(directory=SNAPSHOT_DIR, patient_csv=PATIENT_CSV, doctor_xlsx=DOCTOR_XLSX):
+    """Whether ``directory`` holds a snapshot of the current ``patient_csv`` and ``doctor_xlsx``."""
+    current = manifest(directory)
+    if current is None or current.get("version") != VERSION:
+        return False
+    try:
+        sources = {"patients": _source_stat(patient_csv), "doctors": _source_stat(doctor_xlsx)}
+    except OSError:
+        return False
+    return current["sources"] == sources and all((Path(directory) / f"{t}.arrow").exists() for t in TABLES)
+
+
+def load(table, directory=SNAPSHOT_DIR):
+    """Memory-map ``table`` and return it as a :class:`pyarrow.Table`; nothing is copied."""
+    import pyarrow as pa
+
+    with pa.memory_map(str(Path(directory) / f"{table}.arrow"), "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def load_frame(table, directory=SNAPSHOT_DIR):
+    """Load ``table`` as a low-memory pandas frame.
+
+    Dictionary columns become categoricals; the others stay Arrow-backed
+    (``string[pyarrow]``, ``date32[day][pyarrow]``, ...) on the mapped file.
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    def dtype(arrow_type):
+        return None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+
+    return load(table, directory).to_pandas(types_mapper=dtype)
+
+
+def sheet_frames(directory=SNAPSHOT_DIR, patient_csv=PATIENT_CSV, doctor_xlsx=DOCTOR_XLSX):
+    """``{table: frame of sheet strings}`` from a fresh snapshot, or ``None`` if there is none."""
+    if not is_fresh(directory, patient_csv, doctor_xlsx):
+        return None
+    return {name: to_sheet_strings(load(name, directory)) for name in TABLES}
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Convert the bundled CSV/XLSX files into a columnar snapshot")
+    parser.add_argument("command", choices=["ingest"])
+    parser.add_argument("--out", default=str(SNAPSHOT_DIR))
+    parser.add_argument("--patients", default=str(PATIENT_CSV))
+    parser.add_argument("--doctors", default=str(DOCTOR_XLSX))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    result = ingest(args.out, args.patients, args.doctors)
+    print(f"wrote {args.out} in {time.perf_counter() - started:.2f}s")
+    for name, info in result["tables"].items():
+        print(f"  {name:13} {info['rows']:6d} rows  {info['bytes'] / 1024:7.0f} KB")
+        for column in info["kept_as_text"]:
+            print(f"    {column}: values do not round-trip, kept as text")
@@ -0,0 +1,487 @@
+"""Storage backends for patients, doctors and slot availability.
+
+The app talks to a :class:`Storage` bundle of three repositories. Production
+uses the Google Sheets implementation; :class:`SQLiteStorage` is an indexed
+local stand-in seeded from the bundled CSV/XLSX files (or their columnar
+snapshot, see :mod:`avacare.snapshot`) for offline runs.
+
+Row numbers follow the sheet convention everywhere: the header is row 1 and
+the first record is row 2, so a row number means the same thing in either
+backend.
+"""
+
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+DATA_DIR = Path(__file__).resolve().parent.parent
+PATIENT_CSV = DATA_DIR / "AVACARE_Patient_Dataset_Aligned.csv"
+# Either workbook layout works: one Doctor_Availability sheet, or one Doc_<Name> tab per doctor (145.xlsx)
+DOCTOR_XLSX = Path(os.environ.get("AVACARE_DOCTOR_XLSX", DATA_DIR / "AVACARE_20_Doctors_Info_and_Availability.xlsx"))
+PER_DOCTOR_XLSX = DATA_DIR / "145.xlsx"
+CACHE_DIR = DATA_DIR / ".avacare"
+
+PATIENT_SHEET_KEY = "1aFhExzz3_BTNDzJ2h37YqxK6ij8diJCTbAwsPcdJQtM"
+DOCTOR_SHEET_KEY = "1VVMGuKFvLokIEvFC6DIfnDqAvWCJ-A_fUaiIc_yUf8w"
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+FIRST_DATA_ROW = 2
+# The columns that identify a slot, whatever row it is in
+SLOT_KEY = ("Doctor_ID", "Date", "Start_Time")
+
+
+# -------------------- INTERFACES --------------------
+
+class PatientRepository(ABC):
+    @abstractmethod
+    def all(self):
+        """Return every patient record as a list of dicts."""
+
+    @abstractmethod
+    def get(self, patient_id):
+        """Return the record for ``patient_id`` or ``None``."""
+
+    @abstractmethod
+    def append(self, row):
+        """Append one positional row in sheet column order."""
+
+    @abstractmethod
+    def records_since(self, count):
+        """Return the records after the first ``count`` ones, in sheet order."""
+
+    def append_rows(self, rows):
+        """Append several rows; backends override this with one batched call."""
+        for row in rows:
+            self.append(row)
+
+    def iter_records(self, chunk_size=1000):
+        """Yield the records in sheet order as lists of at most ``chunk_size``.
+
+        Backends override this to read one chunk at a time instead of the whole table.
+        """
+        records = self.all()
+        for start in range(0, len(records), chunk_size):
+            yield records[start:start + chunk_size]
+
+
+class DoctorRepository(ABC):
+    @abstractmethod
+    def all(self):
+        """Return every doctor record as a list of dicts."""
+
+    @abstractmethod
+    def get(self, doctor_id):
+        """Return the record for ``doctor_id`` or ``None``."""
+
+
+class AvailabilityRepository(ABC):
+    @abstractmethod
+    def all(self):
+        """Return every slot record as a list of dicts."""
+
+    @abstractmethod
+    def for_doctor(self, doctor_id):
+        """Return the slot records of one doctor."""
+
+    @abstractmethod
+    def find_slot(self, doctor, date, start_time):
+        """Return the row number of a slot, matching ``doctor`` by ID or name."""
+
+    @abstractmethod
+    def set_status(self, row_number, status):
+        """Write ``status`` into the ``Slot_Status`` cell of ``row_number``."""
+
+    @abstractmethod
+    def compare_and_set_status(self, row_number, expected, status, key=None):
+        """Write ``status`` only if the cell still holds ``expected``; return whether it did.
+
+        With ``key``, the ``SLOT_KEY`` values the caller believes are in the
+        row, the write also requires the row to still hold that slot, so a
+        row number taken from an outdated index cannot overwrite another slot.
+        """
+
+    def compare_and_set_statuses(self, updates):
+        """Apply ``{row_number: (expected, status, key)}``; return the rows that did not match."""
+        return [
+            row_number for row_number, (expected, status, key) in updates.items()
+            if not self.compare_and_set_status(row_number, expected, status, key)
+        ]
+
+
+class Storage:
+    def __init__(self, patients, doctors, availability):
+        self.patients = patients
+        self.doctors = doctors
+        self.availability = availability
+
+
+# -------------------- GOOGLE SHEETS --------------------
+
+class SheetsPatientRepository(PatientRepository):
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    @property
+    def worksheet(self):
+        return self.sheets.worksheet(PATIENT_SHEET_KEY, "Sheet1")
+
+    def all(self):
+        return self.worksheet.get_all_records()
+
+    def get(self, patient_id):
+        ws = self.worksheet
+        cell = ws.find(patient_id, in_column=1)
+        if cell is None:
+            return None
+        headers = ws.row_values(1)
+        values = ws.row_values(cell.row)
+        values += [""] * (len(headers) - len(values))
+        return dict(zip(headers, values))
+
+    def append(self, row):
+        self.worksheet.append_row(row)
+
+    def append_rows(self, rows):
+        self.worksheet.append_rows(rows)
+
+    @staticmethod
+    def _records_between(ws, headers, start, end=None):
+        """Records of sheet rows ``start`` to ``end`` (to the last row if ``None``), in one request."""
+        from gspread.utils import numericise_all, rowcol_to_a1
+
+        last_col = rowcol_to_a1(start, len(headers)).rstrip("0123456789")
+        rows = ws.get(f"A{start}:{last_col}{'' if end is None else end}")
+        records = []
+        for values in rows:
+            values = numericise_all(values) + [""] * (len(headers) - len(values))
+            records.append(dict(zip(headers, values)))
+        return records
+
+    def records_since(self, count):
+        ws = self.worksheet
+        return self._records_between(ws, ws.row_values(1), count + FIRST_DATA_ROW)
+
+    def iter_records(self, chunk_size=1000):
+        ws = self.worksheet
+        headers = ws.row_values(1)
+        start = FIRST_DATA_ROW
+        while True:
+            records = self._records_between(ws, headers, start, start + chunk_size - 1)
+            if records:
+                yield records
+            if len(records) < chunk_size:
+                return
+            start += chunk_size
+
+
+class SheetsDoctorRepository(DoctorRepository):
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def all(self):
+        return self.sheets.worksheet(DOCTOR_SHEET_KEY, "Doctor_Info").get_all_records()
+
+    def get(self, doctor_id):
+        return next((r for r in self.all() if r.get("Doctor_ID") == doctor_id), None)
+
+
+def _row_holds(headers, values, expected, key):
+    # Sheets omits trailing empty cells, so a missing value reads as ""
+    cells = dict(zip(headers, values))
+    if str(cells.get("Slot_Status", "")) != expected:
+        return False
+    return key is None or tuple(str(cells.get(f, "")) for f in SLOT_KEY) == tuple(key)
+
+
+class SheetsAvailabilityRepository(AvailabilityRepository):
+    def __init__(self, sheets):
+        self.sheets = sheets
+        self._headers = None
+
+    @property
+    def worksheet(self):
+        return self.sheets.worksheet(DOCTOR_SHEET_KEY, "Doctor_Availability")
+
+    def all(self):
+        return self.worksheet.get_all_records()
+
+    def for_doctor(self, doctor_id):
+        return [r for r in self.all() if r.get("Doctor_ID") == doctor_id]
+
+    def find_slot(self, doctor, date, start_time):
+        data = self.worksheet.get_all_values()
+        headers, rows = data[0], data[1:]
+        id_idx = headers.index("Doctor_ID")
+        doc_idx = headers.index("Doctor_Name")
+        date_idx = headers.index("Date")
+        time_idx = headers.index("Start_Time")
+        for i, row in enumerate(rows):
+            if doctor in (row[id_idx], row[doc_idx]) and row[date_idx] == date and row[time_idx] == start_time:
+                return i + FIRST_DATA_ROW
+        return None
+
+    def headers(self, ws):
+        if self._headers is None:
+            self._headers = ws.row_values(1)
+        return self._headers
+
+    def status_col(self, ws):
+        return self.headers(ws).index("Slot_Status") + 1
+
+    def set_status(self, row_number, status):
+        ws = self.worksheet
+        ws.update_cell(row_number, self.status_col(ws), status)
+
+    def compare_and_set_status(self, row_number, expected, status, key=None):
+        # Sheets has no conditional write: re-read the row right before
+        # writing it, which closes the window to one round trip.
+        ws = self.worksheet
+        if not _row_holds(self.headers(ws), ws.row_values(row_number), expected, key):
+            return False
+        ws.update_cell(row_number, self.status_col(ws), status)
+        return True
+
+    def compare_and_set_statuses(self, updates):
+        # One batch_get of the rows and one batch_update of the status cells
+        from gspread.utils import rowcol_to_a1
+
+        ws = self.worksheet
+        headers = self.headers(ws)
+        col = self.status_col(ws)
+        rows = sorted(updates)
+        ranges = [f"{rowcol_to_a1(r, 1)}:{rowcol_to_a1(r, len(headers))}" for r in rows]
+        current = ws.batch_get(ranges)
+        conflicts, writes = [], []
+        for row_number, values in zip(rows, current):
+            expected, status, key = updates[row_number]
+            if not _row_holds(headers, values[0] if values else [], expected, key):
+                conflicts.append(row_number)
+            else:
+                writes.append({"range": rowcol_to_a1(row_number, col), "values": [[status]]})
+        if writes:
+            ws.batch_update(writes)
+        return conflicts
+
+
+class GoogleSheetsStorage(Storage):
+    def __init__(self, credentials):
+        from .sheets_client import SheetsClient
+
+        # One authorisation and one set of worksheet handles shared by all three repositories
+        self.client = SheetsClient(credentials, SCOPE)
+        super().__init__(
+            SheetsPatientRepository(self.client),
+            SheetsDoctorRepository(self.client),
+            SheetsAvailabilityRepository(self.client),
+        )
+
+
+# -------------------- SQLITE --------------------
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class _SQLiteTable:
+    """A sheet-shaped table: one TEXT column per header plus the sheet row number."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+
+    @property
+    def columns(self):
+        return self.db.columns(self.table)
+
+    def _records(self, where="", params=()):
+        cols = self.columns
+        select = ", ".join(_quote(c) for c in cols)
+        sql = f"SELECT {select} FROM {self.table} {where} ORDER BY row_number"
+        return [dict(zip(cols, row)) for row in self.db.query(sql, params)]
+
+    def all(self):
+        return self._records()
+
+    def _one(self, column, value):
+        records = self._records(f"WHERE {_quote(column)} = ?", (value,))
+        return records[0] if records else None
+
+
+class SQLitePatientRepository(_SQLiteTable, PatientRepository):
+    def __init__(self, db):
+        super().__init__(db, "patients")
+
+    def get(self, patient_id):
+        return self._one("Patient_ID", patient_id)
+
+    def append(self, row):
+        self.db.append_row(self.table, row)
+
+    def append_rows(self, rows):
+        self.db.append_rows(self.table, rows)
+
+    def records_since(self, count):
+        return self._records("WHERE row_number >= ?", (count + FIRST_DATA_ROW,))
+
+    def iter_records(self, chunk_size=1000):
+        # Keyset pagination on the row number: each chunk is one indexed range scan
+        cols = self.columns
+        select = ", ".join(_quote(c) for c in cols)
+        last = FIRST_DATA_ROW - 1
+        while True:
+            rows = self.db.query(
+                f"SELECT row_number, {select} FROM {self.table} WHERE row_number > ? ORDER BY row_number LIMIT ?",
+                (last, chunk_size),
+            )
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [dict(zip(cols, row[1:])) for row in rows]
+
+
+class SQLiteDoctorRepository(_SQLiteTable, DoctorRepository):
+    def __init__(self, db):
+        super().__init__(db, "doctors")
+
+    def get(self, doctor_id):
+        return self._one("Doctor_ID", doctor_id)
+
+
+class SQLiteAvailabilityRepository(_SQLiteTable, AvailabilityRepository):
+    def __init__(self, db):
+        super().__init__(db, "availability")
+
+    def for_doctor(self, doctor_id):
+        return self._records('WHERE "Doctor_ID" = ?', (doctor_id,))
+
+    def find_slot(self, doctor, date, start_time):
+        rows = self.db.query(
+            'SELECT row_number FROM availability WHERE ("Doctor_ID" = ? OR "Doctor_Name" = ?) '
+            'AND "Date" = ? AND "Start_Time" = ? LIMIT 1',
+            (doctor, doctor, date, start_time),
+        )
+        return rows[0][0] if rows else None
+
+    def set_status(self, row_number, status):
+        self.db.execute('UPDATE availability SET "Slot_Status" = ? WHERE row_number = ?', (status, row_number))
+
+    def compare_and_set_status(self, row_number, expected, status, key=None):
+        sql = 'UPDATE availability SET "Slot_Status" = ? WHERE row_number = ? AND "Slot_Status" = ?'
+        params = (status, row_number, expected)
+        if key is not None:
+            sql += "".join(f" AND {_quote(f)} = ?" for f in SLOT_KEY)
+            params += tuple(key)
+        return self.db.execute(sql, params).rowcount == 1
+
+
+class _Database:
+    """A thread-safe sqlite3 connection shared by the Streamlit session threads."""
+
+    INDEXES = {
+        "patients": [("Patient_ID",)],
+        "doctors": [("Doctor_ID",), ("Specialty",)],
+        "availability": [("Doctor_ID",), ("Doctor_Name", "Date", "Start_Time")],
+    }
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.RLock()
+        self._columns = {}
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params)
+
+    def has_table(self, table):
+        return bool(self.query("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)))
+
+    def columns(self, table):
+        if table not in self._columns:
+            info = self.query(f"PRAGMA table_info({table})")
+            self._columns[table] = [row[1] for row in info if row[1] != "row_number"]
+        return self._columns[table]
+
+    def create_table(self, table, df):
+        cols = [c for c in df.columns if not str(c).startswith("Unnamed")]
+        df = df[cols].fillna("").astype(str)
+        col_defs = ", ".join(f"{_quote(c)} TEXT" for c in cols)
+        placeholders = ", ".join("?" for _ in range(len(cols) + 1))
+        rows = [
+            (i + FIRST_DATA_ROW, *values)
+            for i, values in enumerate(df.itertuples(index=False, name=None))
+        ]
+        with self.lock, self.conn:
+            self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self.conn.execute(f"CREATE TABLE {table} (row_number INTEGER PRIMARY KEY, {col_defs})")
+            self.conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+            for i, index_cols in enumerate(self.INDEXES.get(table, [])):
+                self.conn.execute(
+                    f"CREATE INDEX idx_{table}_{i} ON {table} ({', '.join(_quote(c) for c in index_cols)})"
+                )
+        self._columns.pop(table, None)
+
+    def append_row(self, table, row):
+        self.append_rows(table, [row])
+
+    def append_rows(self, table, rows):
+        cols = self.columns(table)
+        placeholders = ", ".join("?" for _ in cols)
+        sql = f"INSERT INTO {table} (row_number, {', '.join(_quote(c) for c in cols)}) VALUES (?, {placeholders})"
+        with self.lock, self.conn:
+            (last,) = self.conn.execute(f"SELECT COALESCE(MAX(row_number), ?) FROM {table}", (FIRST_DATA_ROW - 1,)).fetchone()
+            for i, row in enumerate(rows, start=1):
+                values = [("" if v is None else str(v)) for v in row][: len(cols)]
+                values += [""] * (len(cols) - len(values))
+                self.conn.execute(sql, (last + i, *values))
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path=":memory:"):
+        self.db = _Database(path)
+        super().__init__(
+            SQLitePatientRepository(self.db),
+            SQLiteDoctorRepository(self.db),
+            SQLiteAvailabilityRepository(self.db),
+        )
+
+    @property
+    def is_seeded(self):
+        return all(self.db.has_table(t) for t in ("patients", "doctors", "availability"))
+
+    def seed(self, patient_csv=PATIENT_CSV, doctor_xlsx=DOCTOR_XLSX):
+        from .snapshot import read_sources, sheet_frames
+
+        # A current snapshot (python -m avacare.snapshot ingest) is mapped instead of parsing the files
+        frames = sheet_frames(patient_csv=patient_csv, doctor_xlsx=doctor_xlsx)
+        if frames is None:
+            frames = read_sources(patient_csv, doctor_xlsx)
+        for table, frame in frames.items():
+            self.db.create_table(table, frame)
+
+    @classmethod
+    def open(cls, path=":memory:", patient_csv=PATIENT_CSV, doctor_xlsx=DOCTOR_XLSX):
+        """Open ``path``, seeding it from the bundled files on first use."""
+        storage = cls(path)
+        if not storage.is_seeded:
+            storage.seed(patient_csv, doctor_xlsx)
+        return storage
+
+
+def open_storage(credentials_loader, backend=None):
+    """Build the storage selected by ``AVACARE_STORAGE`` (``sheets`` or ``sqlite``).
+
+    ``credentials_loader`` is only called for the Sheets backend, so offline
+    runs never need service-account secrets.
+    """
+    backend = backend or os.environ.get("AVACARE_STORAGE", "sheets")
+    if backend == "sqlite":
+        return SQLiteStorage.open(os.environ.get("AVACARE_SQLITE_PATH", ":memory:"))
+    if backend == "sheets":
+        return GoogleSheetsStorage(credentials_loader())
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,185 @@
+"""Symptom to specialty matching.
+
+The matcher is compiled once per process from the curated phrases the app
+has always used plus every ``Symptoms`` -> ``Suggested_Specialty`` pair in the
+patient dataset. Phrases are normalised to token tuples (lowercase, simple
+plural stripping, stop words dropped) and kept in an inverted index from
+token to phrase. Unknown input tokens are corrected against the vocabulary
+through a character-trigram index, so "tootache" still finds "toothache".
+
+Input may list several symptoms separated by commas, semicolons or "and";
+each part votes for specialties and the totals are ranked. A phrase only
+votes when every one of its tokens is in the part: sharing "pain" with
+"back pain" says nothing about "chest pain", so input that covers no known
+phrase matches nothing and the patient is asked again, as with the original
+exact-match table.
+"""
+
+import csv
+import difflib
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from .storage import PATIENT_CSV
+
+# The app's original exact-match table. Curated entries outweigh the dataset
+# counts so existing answers (e.g. "cold" -> General Physician) are kept.
+BASE_SYMPTOM_MAP = {
+    "fever": "General Physician",
+    "cold": "General Physician",
+    "cough": "General Physician",
+    "headache": "General Physician",
+    "tooth": "Dentist",
+    "teeth": "Dentist",
+    "cavity": "Dentist",
+    "skin rash": "Dermatology",
+    "acne": "Dermatology",
+    "pimples": "Dermatology",
+    "hairfall": "Dermatology",
+    "ear pain": "ENT Specialist",
+    "nose": "ENT Specialist",
+    "throat": "ENT Specialist",
+    "child fever": "Pediatrics",
+    "child": "Pediatrics",
+    "anxiety": "Psychologist",
+    "pain during periods": "Gynecologist",
+    "pregnancy": "Gynecologist",
+    "back pain": "Orthopedic",
+    "muscle strain": "Physiotherapist",
+}
+CURATED_WEIGHT = 2.0
+
+STOP_WORDS = {"a", "an", "and", "the", "my", "i", "im", "am", "is", "have", "having", "of", "in",
+              "on", "with", "during", "some", "feel", "feeling", "very", "bad", "severe", "mild"}
+SEPARATORS = re.compile(r"[,;/]|\band\b|\bplus\b")
+TOKEN = re.compile(r"[a-z]+")
+MIN_SIMILARITY = 0.75
+
+
+def stem(token):
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith(("ches", "shes", "sses", "xes")):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return tuple(stem(t) for t in TOKEN.findall(text.lower().replace("-", " ")) if t not in STOP_WORDS)
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SymptomMatcher:
+    def __init__(self):
+        self._phrases = {}
+        self._by_token = defaultdict(set)
+        self._by_trigram = defaultdict(set)
+        # The correction cache is per instance so rebuilding the matcher resets it
+        self.correct = lru_cache(maxsize=4096)(self._correct)
+
+    def add(self, phrase, specialty, weight=1.0):
+        tokens = tokenize(phrase)
+        if not tokens:
+            return
+        votes = self._phrases.setdefault(tokens, defaultdict(float))
+        votes[specialty] += weight
+        for token in tokens:
+            self._by_token[token].add(tokens)
+            for gram in trigrams(token):
+                self._by_trigram[gram].add(token)
+
+    def _normalise_votes(self):
+        for tokens, votes in self._phrases.items():
+            total = sum(votes.values())
+            self._phrases[tokens] = {s: w / total for s, w in votes.items()}
+
+    @classmethod
+    def from_sources(cls, patient_csv=PATIENT_CSV, curated=BASE_SYMPTOM_MAP):
+        matcher = cls()
+        counts = defaultdict(lambda: defaultdict(int))
+        with open(patient_csv, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                for symptom in row["Symptoms"].split(","):
+                    if symptom.strip():
+                        counts[symptom.strip()][row["Suggested_Specialty"]] += 1
+        for symptom, specialties in counts.items():
+            total = sum(specialties.values())
+            for specialty, n in specialties.items():
+                matcher.add(symptom, specialty, n / total)
+        for phrase, specialty in curated.items():
+            matcher.add(phrase, specialty, CURATED_WEIGHT)
+        matcher._normalise_votes()
+        return matcher
+
+    # -------------------- matching --------------------
+
+    def _correct(self, token):
+        """Map an input token to the closest vocabulary token, or ``None``."""
+        if token in self._by_token:
+            return token
+        candidates = set()
+        for gram in trigrams(token):
+            candidates |= self._by_trigram.get(gram, set())
+        best = self._closest(token, candidates)
+        if best is None:
+            # Short or heavily misspelled tokens can share no trigram with the right one
+            best = self._closest(token, self._by_token)
+        return best
+
+    @staticmethod
+    def _closest(token, candidates):
+        best, best_ratio = None, MIN_SIMILARITY
+        for candidate in sorted(candidates):
+            ratio = difflib.SequenceMatcher(None, token, candidate).ratio()
+            if ratio > best_ratio:
+                best, best_ratio = candidate, ratio
+        return best
+
+    def _score_part(self, tokens, scores):
+        present = set(tokens)
+        phrases = set()
+        for token in present:
+            phrases |= self._by_token.get(token, set())
+        for phrase in phrases:
+            if not present.issuperset(phrase):
+                continue
+            # Longer phrases ("child fever") beat their parts ("fever")
+            weight = len(phrase)
+            for specialty, share in self._phrases[phrase].items():
+                scores[specialty] += weight * share
+
+    def rank(self, text, limit=3):
+        """Return ``[(specialty, score), ...]`` best first."""
+        scores = defaultdict(float)
+        for part in SEPARATORS.split(text.lower()):
+            tokens = [c for c in (self.correct(t) for t in tokenize(part)) if c]
+            if tokens:
+                self._score_part(tokens, scores)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def match(self, text):
+        ranked = self.rank(text, limit=1)
+        return ranked[0][0] if ranked else None
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_symptom_matcher():
+    """Build the matcher on first use and share it for the life of the process."""
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = SymptomMatcher.from_sources()
+    return _matcher
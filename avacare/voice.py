@@ -0,0 +1,117 @@
+"""Voice transcription off the Streamlit script thread.
+
+Recorded audio stays in memory: the WAV bytes go to the transcription backend
+as a named ``BytesIO``, with no temp files and no MP3 re-encode (Whisper
+accepts WAV directly). :class:`TranscriptionPool` runs the backend on worker
+threads and hands back a job ID that the session polls on each rerun, so the
+page keeps rendering while Whisper works.
+
+``AVACARE_TRANSCRIBER=stub`` swaps Whisper for :class:`StubTranscriber`.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from .metrics import span
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+JobStatus = namedtuple("JobStatus", ["state", "text", "error"])
+
+
+def audio_to_wav_bytes(audio):
+    """Accept raw WAV bytes or a pydub-style segment from the recorder widget."""
+    if isinstance(audio, (bytes, bytearray)):
+        return bytes(audio)
+    buffer = BytesIO()
+    audio.export(buffer, format="wav")
+    return buffer.getvalue()
+
+
+# -------------------- BACKENDS --------------------
+
+class WhisperTranscriber:
+    def __init__(self, api_key, model="whisper-1"):
+        import openai
+
+        self.model = model
+        if hasattr(openai, "OpenAI"):
+            self._client = openai.OpenAI(api_key=api_key)
+            self._legacy = None
+        else:
+            openai.api_key = api_key
+            self._client = None
+            self._legacy = openai
+
+    def transcribe(self, wav_bytes):
+        audio_file = BytesIO(wav_bytes)
+        audio_file.name = "speech.wav"
+        if self._client is not None:
+            return self._client.audio.transcriptions.create(model=self.model, file=audio_file).text
+        return self._legacy.Audio.transcribe(self.model, audio_file)["text"]
+
+
+class StubTranscriber:
+    """Returns fixed text after an optional delay, for tests and load runs."""
+
+    def __init__(self, text="Hello, I would like to book an appointment.", delay=0.0):
+        self.text = text
+        self.delay = delay
+
+    def transcribe(self, wav_bytes):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.text
+
+
+def transcriber_from_env(api_key_loader):
+    """Build the backend selected by ``AVACARE_TRANSCRIBER`` (``whisper`` or ``stub``)."""
+    name = os.environ.get("AVACARE_TRANSCRIBER", "whisper")
+    if name == "stub":
+        return StubTranscriber()
+    if name == "whisper":
+        return WhisperTranscriber(api_key_loader())
+    raise ValueError(f"Unknown transcriber: {name}")
+
+
+# -------------------- WORKER POOL --------------------
+
+class TranscriptionPool:
+    def __init__(self, transcriber, workers=2):
+        self.transcriber = transcriber
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transcribe")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, wav_bytes):
+        """Queue ``wav_bytes`` for transcription and return the job ID."""
+        job_id = uuid.uuid4().hex
+        future = self._executor.submit(self._transcribe, wav_bytes)
+        with self._lock:
+            self._jobs[job_id] = future
+        return job_id
+
+    def _transcribe(self, wav_bytes):
+        with span("transcribe"):
+            return self.transcriber.transcribe(wav_bytes)
+
+    def poll(self, job_id):
+        """Return the job's :class:`JobStatus`; finished jobs are forgotten once read."""
+        with self._lock:
+            future = self._jobs.get(job_id)
+            if future is None:
+                return JobStatus(FAILED, None, KeyError(f"Unknown transcription job {job_id}"))
+            if not future.done():
+                return JobStatus(PENDING, None, None)
+            del self._jobs[job_id]
+        error = future.exception()
+        if error is not None:
+            return JobStatus(FAILED, None, error)
+        return JobStatus(DONE, future.result(), None)
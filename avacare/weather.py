@@ -0,0 +1,157 @@
+"""Weather lookups for the travel check.
+
+Providers fetch the current weather for one city. :class:`WeatherService`
+sits in front of a provider and shares results across sessions:
+
+* a bounded LRU keyed by normalised city with a TTL per entry,
+* single-flight coalescing, so concurrent misses for a city cost one request,
+* a strict timeout that falls back to the last value seen for the city, even
+  when it is past its TTL.
+
+``AVACARE_WEATHER=fixture`` swaps the OpenWeatherMap provider for
+:class:`FixtureWeatherProvider` so the app runs offline.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from .metrics import span
+
+OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+
+def normalize_city(city_raw):
+    """Map ``"Neighbourhood, Dallas, TX"`` to ``"Dallas"``, as the app always has."""
+    city_parts = str(city_raw).split(",")
+    return city_parts[1].strip() if len(city_parts) > 1 else str(city_raw).strip()
+
+
+def format_weather(weather):
+    return (
+        f"The current weather in {weather['city']} is {weather['description']} "
+        f"with a temperature of {weather['temperature']}°C."
+    )
+
+
+# -------------------- PROVIDERS --------------------
+
+class OpenWeatherMapProvider:
+    def __init__(self, api_key, timeout=3.0, pool_size=10):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, city):
+        params = {"q": city, "appid": self.api_key, "units": "metric"}
+        response = self.session.get(OPENWEATHER_URL, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        return {
+            "city": city,
+            "description": data["weather"][0]["description"].title(),
+            "temperature": data["main"]["temp"],
+        }
+
+
+class FixtureWeatherProvider:
+    """Canned weather per city, for tests and offline load runs."""
+
+    DEFAULT = {"description": "Clear Sky", "temperature": 24.0}
+
+    def __init__(self, fixtures=None, default=None, delay=0.0):
+        self.fixtures = {k.lower(): v for k, v in (fixtures or {}).items()}
+        self.default = default or self.DEFAULT
+        self.delay = delay
+        self.calls = 0
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def fetch(self, city):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return dict(self.fixtures.get(city.lower(), self.default), city=city)
+
+
+def weather_provider_from_env(api_key_loader):
+    """Build the provider selected by ``AVACARE_WEATHER`` (``openweathermap`` or ``fixture``)."""
+    name = os.environ.get("AVACARE_WEATHER", "openweathermap")
+    if name == "fixture":
+        path = os.environ.get("AVACARE_WEATHER_FIXTURE")
+        return FixtureWeatherProvider.from_file(path) if path else FixtureWeatherProvider()
+    if name == "openweathermap":
+        return OpenWeatherMapProvider(api_key_loader())
+    raise ValueError(f"Unknown weather provider: {name}")
+
+
+# -------------------- CACHE --------------------
+
+class WeatherService:
+    def __init__(self, provider, ttl=600, maxsize=128, timeout=3.0, clock=time.monotonic):
+        self.provider = provider
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._inflight = {}
+
+    def _store(self, key, weather):
+        with self._lock:
+            self._cache[key] = (self.clock(), weather)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def _last_known(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            return entry[1] if entry else None
+
+    def forecast(self, city_raw):
+        """Return ``{"city", "description", "temperature"}`` for the patient's city."""
+        city = normalize_city(city_raw)
+        key = city.lower()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and self.clock() - entry[0] < self.ttl:
+                self._cache.move_to_end(key)
+                return entry[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = Future()
+
+        if leader:
+            try:
+                with span("weather_fetch"):
+                    weather = self.provider.fetch(city)
+            except Exception as e:
+                flight.set_exception(e)
+            else:
+                self._store(key, weather)
+                flight.set_result(weather)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+        try:
+            return flight.result(timeout=self.timeout)
+        except Exception:
+            stale = self._last_known(key)
+            if stale is not None:
+                return stale
+            raise
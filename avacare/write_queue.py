@@ -0,0 +1,374 @@
+"""Write-behind queue for sheet mutations.
+
+Registrations and slot bookings are committed to a local SQLite queue and
+confirmed to the patient straight away. A background :class:`Flusher` drains
+the queue in batches: queued patient rows become one ``append_rows`` call and
+queued slot updates one conditional ``batch_update``. Failed flushes, quota
+errors included, are retried with exponential backoff. A mutation that still
+fails after ``max_attempts`` is parked as ``failed`` so it cannot hold up the
+rest; parked mutations stay visible to reads and are retried one at a time
+every ``retry_interval`` seconds until they go through.
+
+The queue is the source of truth for writes that have not reached the sheet
+yet, so :class:`~avacare.patient_cache.PatientCache` reads pending
+registrations from it and a patient who just registered is found by ID.
+
+Several processes may share one queue file. Each flush claims its batch
+inside a transaction so a mutation is never applied twice; a claim that is
+never released (a crashed flusher) expires after ``claim_timeout`` seconds.
+The file also remembers the last status queued for each slot row, until
+``slot_ttl`` seconds after it was flushed, and refuses a slot write that
+expects another status, so processes sharing the file cannot both confirm
+the same slot while their indexes catch up. A write that the sheet itself
+refuses (the slot was changed there directly) is recorded as a conflict;
+:meth:`WriteQueue.failed` and :meth:`WriteQueue.conflicts` list what needs
+attention.
+"""
+
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import os
+import uuid
+from collections import defaultdict
+
+from .metrics import span
+from .storage import CACHE_DIR, GoogleSheetsStorage
+
+log = logging.getLogger(__name__)
+
+APPEND_PATIENT = "append_patient"
+SET_SLOT_STATUS = "set_slot_status"
+
+PENDING = "pending"
+CLAIMED = "claimed"
+FAILED = "failed"
+
+
+class WriteQueue:
+    def __init__(self, path, claim_timeout=300, slot_ttl=300):
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30, isolation_level=None)
+        self.claim_timeout = claim_timeout
+        self.slot_ttl = slot_ttl
+        self._lock = threading.RLock()
+        with self._lock:
+            if str(path) != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS mutations ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,"
+                " claimed_by TEXT, claimed_at REAL, last_error TEXT, created_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_mutations_status ON mutations (status, id)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS conflicts ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, mutation_id INTEGER, payload TEXT, seen_at REAL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS slot_status ("
+                " row_number INTEGER PRIMARY KEY, slot_key TEXT, status TEXT NOT NULL, mutation_id INTEGER,"
+                " flushed_at REAL)"
+            )
+
+    # -------------------- producers --------------------
+
+    def _insert(self, kind, payload):
+        cursor = self.conn.execute(
+            "INSERT INTO mutations (kind, payload, created_at) VALUES (?, ?, ?)",
+            (kind, json.dumps(payload), time.time()),
+        )
+        return cursor.lastrowid
+
+    def enqueue_append(self, row):
+        with self._lock:
+            return self._insert(APPEND_PATIENT, {"row": list(row)})
+
+    def enqueue_slot_status(self, row_number, expected, status, key=None):
+        """Queue a slot write; ``None`` if a write queued through this file left the slot other than ``expected``."""
+        key = key and list(key)
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = self.conn.execute(
+                    "SELECT slot_key, status FROM slot_status WHERE row_number = ?"
+                    " AND (flushed_at IS NULL OR flushed_at > ?)",
+                    (row_number, time.time() - self.slot_ttl),
+                ).fetchone()
+                if current is not None and json.loads(current[0]) == key and current[1] != expected:
+                    self.conn.execute("ROLLBACK")
+                    return None
+                mutation_id = self._insert(
+                    SET_SLOT_STATUS, {"row_number": row_number, "expected": expected, "status": status, "key": key}
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO slot_status VALUES (?, ?, ?, ?, NULL)",
+                    (row_number, json.dumps(key), status, mutation_id),
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return mutation_id
+
+    # -------------------- read-your-writes --------------------
+
+    def pending_rows(self):
+        """Patient rows that are queued, being flushed or parked as failed, but not yet in the sheet."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT payload FROM mutations WHERE kind = ? AND status IN (?, ?, ?) ORDER BY id",
+                (APPEND_PATIENT, PENDING, CLAIMED, FAILED),
+            ).fetchall()
+        return [json.loads(payload)["row"] for (payload,) in rows]
+
+    def pending_slot_statuses(self):
+        """``{row_number: (key, status)}`` of slot writes not yet in the sheet or flushed in the last ``slot_ttl`` seconds."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT row_number, slot_key, status FROM slot_status WHERE flushed_at IS NULL OR flushed_at > ?",
+                (time.time() - self.slot_ttl,),
+            ).fetchall()
+        pending = {}
+        for row_number, key, status in rows:
+            key = json.loads(key)
+            pending[row_number] = (key and tuple(key), status)
+        return pending
+
+    def depth(self):
+        with self._lock:
+            (n,) = self.conn.execute(
+                "SELECT COUNT(*) FROM mutations WHERE status IN (?, ?)", (PENDING, CLAIMED)
+            ).fetchone()
+        return n
+
+    # -------------------- consumers --------------------
+
+    def claim(self, owner, limit=500, status=PENDING):
+        """Atomically claim up to ``limit`` mutations in ``status``, oldest first.
+
+        Failed mutations are claimed least recently tried first instead.
+        """
+        now = time.time()
+        order = "claimed_at, id" if status == FAILED else "id"
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "UPDATE mutations SET status = ?, claimed_by = NULL WHERE status = ? AND claimed_at < ?",
+                    (PENDING, CLAIMED, now - self.claim_timeout),
+                )
+                rows = self.conn.execute(
+                    f"SELECT id, kind, payload FROM mutations WHERE status = ? ORDER BY {order} LIMIT ?",
+                    (status, limit),
+                ).fetchall()
+                self.conn.executemany(
+                    "UPDATE mutations SET status = ?, claimed_by = ?, claimed_at = ? WHERE id = ?",
+                    [(CLAIMED, owner, now, row[0]) for row in rows],
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return [(mutation_id, kind, json.loads(payload)) for mutation_id, kind, payload in rows]
+
+    def complete(self, ids):
+        with self._lock:
+            self.conn.executemany("DELETE FROM mutations WHERE id = ?", [(i,) for i in ids])
+
+    def release(self, ids, error, max_attempts):
+        """Return failed mutations to the queue, parking those out of attempts as ``failed``."""
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE mutations SET attempts = attempts + 1, last_error = ?, claimed_by = NULL,"
+                " status = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END WHERE id = ?",
+                [(str(error), max_attempts, FAILED, PENDING, i) for i in ids],
+            )
+
+    def mark_flushed(self, ids):
+        """Start the ``slot_ttl`` countdown of the slot statuses set by ``ids``, now in the sheet."""
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE slot_status SET flushed_at = ? WHERE mutation_id = ?", [(now, i) for i in ids]
+            )
+            self.conn.execute("DELETE FROM slot_status WHERE flushed_at < ?", (now - self.slot_ttl,))
+
+    def record_conflict(self, mutation_id, payload):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO conflicts (mutation_id, payload, seen_at) VALUES (?, ?, ?)",
+                (mutation_id, json.dumps(payload), time.time()),
+            )
+            # The sheet disagrees, so the sheet is what the index should show
+            self.conn.execute("DELETE FROM slot_status WHERE mutation_id = ?", (mutation_id,))
+
+    # -------------------- monitoring --------------------
+
+    def failed(self, limit=100):
+        """Parked mutations, least recently tried first, with their last error."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, kind, payload, attempts, last_error, created_at FROM mutations"
+                " WHERE status = ? ORDER BY claimed_at, id LIMIT ?",
+                (FAILED, limit),
+            ).fetchall()
+        return [
+            {"id": i, "kind": kind, "payload": json.loads(payload), "attempts": attempts,
+             "last_error": error, "created_at": created_at}
+            for i, kind, payload, attempts, error, created_at in rows
+        ]
+
+    def conflicts(self, limit=100):
+        """Slot writes the sheet refused, newest first."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT mutation_id, payload, seen_at FROM conflicts ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [{"mutation_id": i, "payload": json.loads(payload), "seen_at": seen_at} for i, payload, seen_at in rows]
+
+
+def is_quota_error(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) in (429, 500, 502, 503)
+
+
+class Flusher:
+    """Background thread that drains a :class:`WriteQueue` into the storage backend."""
+
+    def __init__(self, queue, storage, interval=1.0, batch_size=500, max_attempts=8,
+                 base_delay=1.0, max_delay=60.0, on_flush=None, retry_interval=300.0):
+        self.queue = queue
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_interval = retry_interval
+        self._retry_at = time.monotonic() + retry_interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self.owner = uuid.uuid4().hex
+        self._failures = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, drain=True):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        if drain:
+            while self.flush():
+                pass
+
+    def wake(self):
+        """Flush now instead of waiting for the next interval."""
+        self._wake.set()
+
+    def _backoff(self):
+        delay = min(self.max_delay, self.base_delay * 2 ** (self._failures - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                flushed = self.flush()
+                self._failures = 0
+                if time.monotonic() >= self._retry_at:
+                    self._retry_at = time.monotonic() + self.retry_interval
+                    self.retry_failed()
+            except Exception as e:
+                self._failures += 1
+                level = logging.WARNING if is_quota_error(e) else logging.ERROR
+                log.log(level, "write-behind flush failed (attempt %d): %s", self._failures, e)
+                self._stop.wait(self._backoff())
+                continue
+            if not flushed:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+    def flush(self):
+        """Apply one claimed batch; return how many mutations were applied."""
+        batch = self.queue.claim(self.owner, self.batch_size)
+        if not batch:
+            return 0
+        appends = [(i, p) for i, kind, p in batch if kind == APPEND_PATIENT]
+        updates = [(i, p) for i, kind, p in batch if kind == SET_SLOT_STATUS]
+        try:
+            if appends:
+                with span("patients_write", kind="batch"):
+                    self.storage.patients.append_rows([p["row"] for _, p in appends])
+                self.queue.complete([i for i, _ in appends])
+                appends = []
+            if updates:
+                with span("slots_write", kind="batch"):
+                    self._apply_updates(updates)
+        except Exception as e:
+            self.queue.release([i for i, _ in appends + updates], e, self.max_attempts)
+            raise
+        if self.on_flush:
+            self.on_flush(batch)
+        return len(batch)
+
+    def retry_failed(self):
+        """Retry parked mutations one by one, so one bad row cannot fail the others; return how many went through."""
+        applied = 0
+        for mutation_id, kind, payload in self.queue.claim(self.owner, self.batch_size, status=FAILED):
+            try:
+                if kind == APPEND_PATIENT:
+                    self.storage.patients.append_rows([payload["row"]])
+                    self.queue.complete([mutation_id])
+                else:
+                    self._apply_updates([(mutation_id, payload)])
+            except Exception as e:
+                log.warning("parked mutation %s failed again: %s", mutation_id, e)
+                self.queue.release([mutation_id], e, max_attempts=0)
+                continue
+            applied += 1
+        return applied
+
+    def _apply_updates(self, updates):
+        # Each slot is written once: from what its first update expected to what
+        # its last one set, and not at all when they cancel out (booked, then released)
+        merged, ids = {}, defaultdict(list)
+        for mutation_id, payload in updates:
+            row = payload["row_number"]
+            first = merged.get(row, (None, payload))[1]
+            merged[row] = (mutation_id, dict(payload, expected=first["expected"]))
+            ids[row].append(mutation_id)
+        writes = {row: (p["expected"], p["status"], p.get("key"))
+                  for row, (_, p) in merged.items() if p["expected"] != p["status"]}
+        conflicts = self.storage.availability.compare_and_set_statuses(writes) if writes else []
+        self.queue.mark_flushed([i for row, row_ids in ids.items() if row not in conflicts for i in row_ids])
+        for row in conflicts:
+            mutation_id, payload = merged[row]
+            log.warning("slot row %s was no longer %r when flushed", row, payload["expected"])
+            self.queue.record_conflict(mutation_id, payload)
+        self.queue.complete([i for i, _ in updates])
+
+
+def write_queue_from_env(storage):
+    """Start a queue and flusher for ``storage`` unless ``AVACARE_WRITE_BEHIND`` turns them off.
+
+    Sheet writes are queued by default; the SQLite backend writes directly.
+    """
+    default = "1" if isinstance(storage, GoogleSheetsStorage) else "0"
+    if os.environ.get("AVACARE_WRITE_BEHIND", default) != "1":
+        return None
+    path = os.environ.get("AVACARE_WRITE_QUEUE_PATH")
+    if path is None:
+        CACHE_DIR.mkdir(exist_ok=True)
+        path = CACHE_DIR / "write_queue.db"
+    queue = WriteQueue(path)
+    Flusher(queue, storage).start()
+    return queue
@@ -0,0 +1,142 @@
+"""Incremental clinic analytics vs recomputing from raw rows.
+
+Attaches :class:`ClinicAnalytics` to a slot index and a patient cache over a
+local SQLite copy of the sheets, then applies ``--events`` random bookings,
+releases and registrations. Registrations go through a write-behind queue,
+so each new patient is reported twice, once when queued and once when the
+flushed row is read back. Every ``--check-every`` events the reports are
+compared with a pandas group-by over the raw tables, the ad-hoc way of
+answering the same questions.
+
+    python -m benchmarks.bench_analytics [--events 5000] [--check-every 1000]
+
+Reports the cost of one counter update, of reading every report, and of the
+recomputation. Exits 1 if any report differs from the recomputation.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import pandas as pd
+
+from avacare.analytics import GROUP_VALUE, ClinicAnalytics
+from avacare.patient_cache import PatientCache
+from avacare.slots import OPEN, SlotIndex
+from avacare.storage import SQLiteStorage
+from avacare.write_queue import Flusher, WriteQueue
+
+
+class TimedAnalytics(ClinicAnalytics):
+    """Accumulates the time spent in the incremental hooks."""
+
+    updates = 0
+    update_s = 0.0
+
+    def slot_changed(self, slot):
+        started = time.perf_counter()
+        super().slot_changed(slot)
+        self.update_s += time.perf_counter() - started
+        self.updates += 1
+
+    def patient_changed(self, record):
+        started = time.perf_counter()
+        super().patient_changed(record)
+        self.update_s += time.perf_counter() - started
+        self.updates += 1
+
+
+def as_counts(frame):
+    return {key: (int(row["size"]), int(row["sum"])) for key, row in frame.iterrows()}
+
+
+def recompute(storage, groups):
+    """The reports from a full read of both tables."""
+    slots = pd.DataFrame(storage.availability.all())
+    slots["filled"] = slots["Slot_Status"] != OPEN
+    doctors = slots.groupby("Doctor_ID")["filled"].agg(["size", "sum"])
+    specialties = slots.groupby("Specialty")["filled"].agg(["size", "sum"])
+    patients = pd.DataFrame(storage.patients.all())
+    patients["missed"] = pd.to_numeric(patients["Missed_Appointments"], errors="coerce").fillna(0) > 0
+    no_show = {
+        column: patients.groupby(patients[column].astype(str).map(GROUP_VALUE.get(column, str.strip)))["missed"]
+        .agg(["size", "sum"])
+        for column in groups
+    }
+    return as_counts(doctors), as_counts(specialties), {c: as_counts(f) for c, f in no_show.items()}
+
+
+def reports(analytics):
+    doctors = {r["Doctor_ID"]: (r["slots"], r["filled"]) for r in analytics.doctor_utilisation()}
+    specialties = {r["Specialty"]: (r["slots"], r["filled"]) for r in analytics.specialty_fill_rate()}
+    no_show = {c: {r[c]: (r["patients"], r["no_shows"]) for r in analytics.no_show_rate(c)} for c in analytics.groups}
+    return doctors, specialties, no_show
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--check-every", type=int, default=1000)
+    args = parser.parse_args()
+    rng = random.Random(3)
+
+    storage = SQLiteStorage.open()
+    queue = WriteQueue(":memory:")
+    flusher = Flusher(queue, storage)
+    slots = SlotIndex(storage.availability)
+    patients = PatientCache(storage.patients, queue=queue)
+    started = time.perf_counter()
+    analytics = TimedAnalytics.attach(slots, patients)
+    print(f"built from {len(slots.slots())} slots and {len(patients.records())} patients in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms")
+
+    templates = [list(record.values()) for record in patients.records()]
+    mismatches = checks = 0
+    read_s = recompute_s = 0.0
+    for event in range(1, args.events + 1):
+        kind = rng.random()
+        if kind < 0.45:
+            slot = rng.choice(slots.slots())
+            if slot["Slot_Status"] == OPEN:
+                slots.book(slot["Doctor_ID"], slot["Date"], slot["Start_Time"])
+            else:
+                slots.release(slot["Doctor_ID"], slot["Date"], slot["Start_Time"])
+        else:
+            holder = f"bench-{event}"
+            patients.append([patients.reserve_patient_id(holder), *rng.choice(templates)[1:]])
+        if event % 97 == 0:
+            # Queued rows reach the sheet and come back through an incremental refresh
+            while flusher.flush():
+                pass
+            patients.refresh()
+
+        if event % args.check_every == 0 or event == args.events:
+            started = time.perf_counter()
+            incremental = reports(analytics)
+            read_s += time.perf_counter() - started
+            while flusher.flush():
+                pass
+            started = time.perf_counter()
+            expected = recompute(storage, analytics.groups)
+            recompute_s += time.perf_counter() - started
+            checks += 1
+            if incremental != expected:
+                mismatches += 1
+                names = ("doctor utilisation", "specialty fill rate", "no-show rate")
+                print(f"  after {event} events: {[n for n, a, b in zip(names, incremental, expected) if a != b]} differ")
+
+    totals = analytics.totals()
+    print(f"{args.events} events, {analytics.updates} counter updates at "
+          f"{analytics.update_s * 1e6 / max(analytics.updates, 1):.1f} us each; "
+          f"{totals['patients']} patients, {totals['filled']} of {totals['slots']} slots filled")
+    print(f"all reports: counters {read_s * 1000 / checks:.2f} ms, recomputed from rows "
+          f"{recompute_s * 1000 / checks:.1f} ms ({recompute_s / read_s:.0f}x)")
+    if mismatches:
+        print(f"FAIL: {mismatches} of {checks} checks differ from the recomputation")
+        sys.exit(1)
+    print(f"counters match the recomputation at all {checks} checks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Bulk patient import: throughput, validation and resume after interruption.
+
+Builds a partner-clinic CSV of ``--rows`` patients from the bundled dataset,
+written the way other systems export it (formatted phone numbers, ISO and
+slashed dates, lower-case enums) with one row in ``--broken-every`` made
+invalid. Then, each into a fresh SQLite copy of the patient sheet:
+
+* imports it in one go and reports rows/s, against appending the first
+  ``--single`` rows one at a time as the registration form does
+* imports it again, crashing right after one chunk has reached the sheet but
+  before its checkpoint was saved, and resumes; the resulting table must be
+  identical to the uninterrupted one, with no patient written twice
+* streams the table back out with ``export_patients``
+
+    python -m benchmarks.bench_bulk [--rows 20000] [--chunk-size 500]
+
+Exits 1 if a check fails.
+"""
+
+import argparse
+import csv
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from avacare.bulk import DATE_FORMAT, ENUMS, PATIENT_COLUMNS, export_patients, import_patients, normalize_record
+from avacare.patient_cache import patient_number
+from avacare.storage import PATIENT_CSV, SQLiteStorage
+
+# One invalid value per row that is made invalid
+BROKEN = [("Phone", "-9077"), ("Age", "n/a"), ("Email", "not-an-email"), ("Weather_Condition", "Foggy"),
+          ("First_Name", ""), ("Appointment_Date", "05/31/2025")]
+
+
+def partner_rows(count, broken_every, rng):
+    with open(PATIENT_CSV, newline="", encoding="utf-8") as f:
+        bundled = list(csv.DictReader(f))
+    rows, broken = [], 0
+    for i in range(count):
+        record = dict(rng.choice(bundled), Patient_ID=f"PC-{i:06d}")
+        area, exchange, line = rng.randrange(200, 999), rng.randrange(200, 999), rng.randrange(10000)
+        record["Phone"] = rng.choice([f"({area}) {exchange}-{line:04d}", f"{area}.{exchange}.{line:04d}",
+                                      f"+1 {area} {exchange} {line:04d}"])
+        record["Emergency_Contact_Number"] = f"{area}-{exchange}-{(line + 1) % 10000:04d}"
+        day = datetime.strptime(record["Appointment_Date"], DATE_FORMAT)
+        record["Appointment_Date"] = rng.choice([day.strftime("%Y-%m-%d"), day.strftime("%d/%m/%Y")])
+        record["Insurance_Type"] = record["Insurance_Type"].lower()
+        record["Gender"] = record["Gender"][0] if rng.random() < 0.5 else record["Gender"].upper()
+        if broken_every and i % broken_every == broken_every - 1:
+            column, value = rng.choice(BROKEN)
+            record[column] = value
+            broken += 1
+        rows.append(record)
+    return rows, broken
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=PATIENT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+class CrashAfterWrite:
+    """A patient repository that stops the process right after its ``n``-th batch reached the sheet."""
+
+    def __init__(self, repository, n):
+        self.repository = repository
+        self.n = n
+
+    def append_rows(self, rows):
+        self.repository.append_rows(rows)
+        self.n -= 1
+        if self.n == 0:
+            raise KeyboardInterrupt
+
+    def __getattr__(self, name):
+        return getattr(self.repository, name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--broken-every", type=int, default=40)
+    parser.add_argument("--single", type=int, default=500)
+    args = parser.parse_args()
+    rng = random.Random(5)
+    failures = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        rows, broken = partner_rows(args.rows, args.broken_every, rng)
+        source = tmp / "partner.csv"
+        write_csv(source, rows)
+
+        # One at a time, as the registration form appends
+        single = SQLiteStorage.open(tmp / "single.db")
+        sample = [normalize_record(r)[0] for r in rows[: args.single]]
+        sample = [row for row in sample if row is not None]
+        started = time.perf_counter()
+        for i, row in enumerate(sample):
+            single.patients.append([f"AVP-{90000 + i}", *row[1:]])
+        single_rate = len(sample) / (time.perf_counter() - started)
+
+        whole = SQLiteStorage.open(tmp / "whole.db")
+        before = len(whole.patients.all())
+        floor = max(patient_number(r["Patient_ID"]) or 0 for r in whole.patients.all())
+        state = import_patients(source, whole.patients, chunk_size=args.chunk_size, restart=True)
+        rate = state["rows_read"] / state["elapsed_s"]
+        print(f"{args.rows} rows in chunks of {args.chunk_size}: {state['imported']} imported, "
+              f"{state['rejected']} rejected in {state['elapsed_s']:.2f}s ({rate:.0f} rows/s); "
+              f"one at a time {single_rate:.0f} rows/s ({rate / single_rate:.0f}x)")
+
+        if state["rejected"] != broken or state["imported"] != args.rows - broken:
+            failures.append(f"expected {broken} rejects, got {state['rejected']}")
+        imported = whole.patients.records_since(before)
+        numbers = [patient_number(r["Patient_ID"]) for r in imported]
+        if numbers != list(range(floor + 1, floor + 1 + len(imported))):
+            failures.append("new IDs are not one consecutive block above the existing ones")
+        canonical = {column: set(values) for column, values in ENUMS.items()}
+        for record in imported:
+            if not record["Phone"].startswith("+") or not record["Emergency_Contact_Number"].startswith("+"):
+                failures.append(f"phone not normalised: {record['Phone']}")
+                break
+            datetime.strptime(record["Appointment_Date"], DATE_FORMAT)
+            bad = [c for c, values in canonical.items() if record[c] and record[c] not in values]
+            if bad:
+                failures.append(f"enum not normalised: {bad}")
+                break
+        expected = [(r["Patient_ID"], *r.values()) for r in imported]
+
+        # Crash after the third chunk is written but before its checkpoint, then resume
+        resumed = SQLiteStorage.open(tmp / "resumed.db")
+        try:
+            import_patients(source, CrashAfterWrite(resumed.patients, 3), chunk_size=args.chunk_size, restart=True)
+            failures.append("the simulated crash did not happen")
+        except KeyboardInterrupt:
+            pass
+        started = time.perf_counter()
+        state = import_patients(source, resumed.patients, chunk_size=args.chunk_size)
+        print(f"resumed after a crash mid-chunk: {state['imported']} imported in total "
+              f"({time.perf_counter() - started:.2f}s for the rest)")
+        after = [(r["Patient_ID"], *r.values()) for r in resumed.patients.records_since(before)]
+        if after != expected:
+            failures.append(f"resumed import differs: {len(after)} rows vs {len(expected)}")
+        with open(f"{source}.ids.csv", newline="") as f:
+            mapped = list(csv.DictReader(f))
+        if len(mapped) != len(expected) or len({m["Source_Row"] for m in mapped}) != len(mapped):
+            failures.append(f"ID map has {len(mapped)} rows for {len(expected)} patients")
+        with open(f"{source}.rejects.csv", newline="") as f:
+            rejected = list(csv.DictReader(f))
+        if len(rejected) != broken or not all(r["Error"] for r in rejected):
+            failures.append(f"rejects file has {len(rejected)} rows for {broken} invalid ones")
+
+        started = time.perf_counter()
+        exported = export_patients(resumed.patients, tmp / "export.csv")
+        print(f"exported {exported} patients in {time.perf_counter() - started:.2f}s")
+        if exported != before + len(expected):
+            failures.append(f"exported {exported} rows, expected {before + len(expected)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("rejects, ID blocks, normalisation, resume and export all check out")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Indexed calendar queries vs scanning the availability table.
+
+Loads ``145.xlsx`` (one tab per doctor), merges it into a :class:`Calendar`
+and answers random "earliest open slot of specialty X after t" and "open
+slots of specialty X between dates A and B" queries both from the calendar
+and by a linear scan, checking that they agree. Half-way through, a batch of
+random bookings is applied to both, so the incremental updates are checked
+too.
+
+    python -m benchmarks.bench_calendar [--queries 2000] [--copies 1]
+
+``--copies`` repeats each doctor's slots on later weeks to grow the table.
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import timedelta
+
+from avacare.schedule import Calendar
+from avacare.slots import FILLED, OPEN, SLOT_FIELDS, parse_date, slot_start
+from avacare.snapshot import read_sources
+from avacare.storage import PER_DOCTOR_XLSX
+
+
+def load_rows(copies):
+    availability = read_sources(doctor_xlsx=PER_DOCTOR_XLSX)["availability"]
+    rows = availability[list(SLOT_FIELDS)].values.tolist()
+    grown = []
+    for week in range(copies):
+        for row in rows:
+            day = parse_date(row[3]) + timedelta(weeks=week)
+            grown.append([*row[:3], day.isoformat(), *row[4:]])
+    return grown
+
+
+def scan_earliest(slots, specialty, after):
+    candidates = [(s["start"], s["row"]) for s in slots
+                  if s["Specialty"] == specialty and s["Slot_Status"] == OPEN and s["start"] >= after]
+    return min(candidates)[1] if candidates else None
+
+
+def scan_between(slots, specialty, start, end):
+    return sorted((s["start"], s["row"]) for s in slots
+                  if s["Specialty"] == specialty and s["Slot_Status"] == OPEN and start <= s["start"] < end)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--copies", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    rows = load_rows(args.copies)
+    started = time.perf_counter()
+    calendar = Calendar.from_rows(rows)
+    print(f"{len(rows)} slots, {len(calendar.specialties())} specialties; built in "
+          f"{(time.perf_counter() - started) * 1000:.1f} ms")
+
+    slots = [dict(zip(SLOT_FIELDS, row), row=i) for i, row in enumerate(rows, start=2)]
+    for slot in slots:
+        slot["start"] = slot_start(slot)
+    first, last = min(s["start"] for s in slots), max(s["start"] for s in slots)
+    span_minutes = int((last - first).total_seconds() // 60)
+    specialties = calendar.specialties()
+    queries = [(rng.choice(specialties), first + timedelta(minutes=rng.randrange(span_minutes)),
+                rng.randrange(1, 4)) for _ in range(args.queries)]
+
+    mismatches = 0
+    calendar_s = scan_s = 0.0
+    for n, (specialty, after, days) in enumerate(queries):
+        if n == len(queries) // 2:
+            for slot in rng.sample([s for s in slots if s["Slot_Status"] == OPEN], len(slots) // 10):
+                slot["Slot_Status"] = FILLED
+                calendar.slot_changed({k: v for k, v in slot.items() if k != "start"})
+        start, end = after.date(), after.date() + timedelta(days=days - 1)
+
+        t = time.perf_counter()
+        earliest = calendar.earliest_open(specialty, after)
+        between = calendar.open_slots(specialty, start, end)
+        calendar_s += time.perf_counter() - t
+
+        t = time.perf_counter()
+        expected_earliest = scan_earliest(slots, specialty, after)
+        expected_between = scan_between(slots, specialty, after.replace(hour=0, minute=0),
+                                        after.replace(hour=0, minute=0) + timedelta(days=days))
+        scan_s += time.perf_counter() - t
+
+        if (earliest["row"] if earliest else None) != expected_earliest:
+            mismatches += 1
+        if [(slot_start(s), s["row"]) for s in between] != expected_between:
+            mismatches += 1
+
+    print(f"{len(queries)} query pairs: calendar {calendar_s * 1e6 / len(queries):.1f} us, "
+          f"scan {scan_s * 1e6 / len(queries):.1f} us ({scan_s / calendar_s:.0f}x)")
+    if mismatches:
+        print(f"FAIL: {mismatches} answers differ from the scan")
+        sys.exit(1)
+    print("calendar answers match the scan, before and after bookings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Cold-start import time of the app's own modules.
+
+A new replica imports ``app.py`` before it can serve its first session. This
+runs ``python -X importtime`` in fresh interpreters, as a cold process would,
+and reports the median cumulative time of importing ``avacare.engine`` and the
+metrics module (everything ``app.py`` imports besides Streamlit), plus the
+slowest modules by self time.
+
+Heavy dependencies (pandas, gspread, reportlab, ...) are imported inside the
+functions that use them, so they load in the state that needs them and stay
+loaded for later reruns. The benchmark fails if any of them is pulled in at
+import time, or if the import takes longer than ``--budget-ms``::
+
+    python -m benchmarks.bench_import [--runs 7] [--budget-ms 100]
+
+Streamlit's own import is reported for reference but not budgeted.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+from avacare.storage import DATA_DIR
+
+TARGET = "import avacare.engine, avacare.metrics, avacare.voice, avacare.confirmation"
+HEAVY = ("pandas", "numpy", "gspread", "oauth2client", "google.auth", "reportlab", "requests",
+         "openai", "pydub", "pyarrow", "streamlit")
+BUDGET_MS = 100
+
+
+def importtime(statement):
+    """Return ``{module: (self_us, cumulative_us, depth)}`` for ``statement`` in a fresh interpreter."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=DATA_DIR,
+                         capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Two spaces of indentation per nesting level; top-level imports are those of the statement itself
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return times
+
+
+def loaded_heavy_modules(statement):
+    check = f"{statement}\nimport sys\nprint(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", check], cwd=DATA_DIR, capture_output=True, text=True,
+                         check=True).stdout
+    return out.split()
+
+
+def total_ms(times, startup=()):
+    # Nested imports are already counted in their parents' cumulative time; ``startup`` are the
+    # modules every interpreter imports before running the statement (site, encodings, ...)
+    return sum(cumulative for name, (_, cumulative, depth) in times.items()
+               if depth == 0 and name not in startup) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=7, help="fresh interpreters to take the median of")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    args = parser.parse_args()
+
+    startup = set(importtime("pass"))
+    runs = [importtime(TARGET) for _ in range(args.runs)]
+    totals = [total_ms(times, startup) for times in runs]
+    median = statistics.median(totals)
+    print(f"app modules: median {median:.1f} ms  (min {min(totals):.1f}, max {max(totals):.1f}, {args.runs} runs)")
+
+    last = {name: t for name, t in runs[-1].items() if name not in startup}
+    print(f"\n{'self ms':>8} {'cumul ms':>9}  module")
+    for name, (self_us, cumulative_us, _) in sorted(last.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"{self_us / 1000:8.1f} {cumulative_us / 1000:9.1f}  {name}")
+
+    streamlit = statistics.median(total_ms(importtime("import streamlit"), startup) for _ in range(3))
+    print(f"\nstreamlit (not budgeted): {streamlit:.1f} ms")
+
+    heavy = loaded_heavy_modules(TARGET)
+    failed = False
+    if heavy:
+        print(f"\nFAIL: imported at startup: {', '.join(heavy)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"\nFAIL: {median:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if not failed:
+        print(f"\nwithin the {args.budget_ms:.0f} ms budget; no heavy module loaded at startup")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
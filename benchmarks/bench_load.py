@@ -0,0 +1,310 @@
+"""Headless load test of the booking flow.
+
+Simulates N returning patients, each driving ``app.py`` through Streamlit's
+``AppTest``: choose_mode -> ... -> ask_identity -> get_returning_info ->
+main_menu -> ask_symptoms -> select_doctor -> weather_check -> payment ->
+confirmed. Patients are drawn from the bundled CSV and type their own
+recorded symptoms; each picks a random doctor of the suggested specialty and
+that doctor's earliest open slot, so concurrent patients race for the same
+slots.
+
+``AppTest`` swaps process-wide singletons on every run, so one process can
+only run one script at a time. Concurrency therefore comes from
+``--workers`` processes, which behave like app replicas sharing one store,
+each interleaving ``--interleave`` sessions a step at a time, as the
+Streamlit server interleaves its sessions.
+
+Everything runs on local stand-ins seeded from the bundled files: a shared
+SQLite file as the storage backend, fixture weather and the stub
+transcriber. Booking logs go to a temporary directory.
+
+``--write-behind`` queues bookings as the Sheets deployment does, so each
+worker's in-memory slot index decides alone and replicas can double-book;
+``--shared-state`` adds the shared store (:mod:`avacare.shared_state`) that
+coordinates them.
+
+The report covers throughput, per-state script latency, external calls per
+booking (from the metrics registry) and double-booking violations, meaning
+two confirmed bookings of one doctor and slot. Results are saved as JSON so
+runs can be compared between versions::
+
+    python -m benchmarks.bench_load --patients 200 --workers 4 --interleave 4
+    python -m benchmarks.bench_load --compare .avacare/loadtest/<earlier>.json
+
+Exits 1 if any slot was double-booked.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from avacare.metrics import REGISTRY
+from avacare.storage import CACHE_DIR, DATA_DIR, PATIENT_CSV, SQLiteStorage
+
+APP = str(DATA_DIR / "app.py")
+RESULTS_DIR = CACHE_DIR / "loadtest"
+EXTERNAL_SPANS = ("sheets_request", "patients_read", "patients_write", "slots_read", "slots_write",
+                  "weather_fetch", "transcribe", "pdf_render")
+
+
+def use_local_stand_ins(workdir, write_behind=False, shared_state=False):
+    os.environ["AVACARE_STORAGE"] = "sqlite"
+    os.environ["AVACARE_SQLITE_PATH"] = str(workdir / "avacare.db")
+    os.environ["AVACARE_WEATHER"] = "fixture"
+    os.environ["AVACARE_TRANSCRIBER"] = "stub"
+    os.environ["AVACARE_BOOKINGS_LOG"] = str(workdir / "bookings.jsonl")
+    os.environ["AVACARE_WRITE_BEHIND"] = "1" if write_behind else "0"
+    os.environ["AVACARE_WRITE_QUEUE_PATH"] = str(workdir / "write_queue.db")
+    if shared_state:
+        os.environ["AVACARE_STATE_URL"] = f"sqlite:///{workdir / 'state.db'}"
+    else:
+        os.environ.pop("AVACARE_STATE_URL", None)
+
+
+def sample_patients(n, seed):
+    df = pd.read_csv(PATIENT_CSV, dtype=str)
+    return df.sample(n=n, replace=n > len(df), random_state=seed).to_dict("records")
+
+
+def simulate_patient(patient, seed, timeout):
+    """Drive one session through the flow, yielding after each script run.
+
+    The generator's return value is the session's outcome and booking.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    result = {"patient_id": patient["Patient_ID"], "outcome": None, "doctor": None, "slot": None}
+    at = AppTest.from_file(APP, default_timeout=timeout)
+
+    def state():
+        return at.session_state.chat_state
+
+    def step(expected):
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        if state() != expected:
+            raise RuntimeError(f"expected {expected}, at {state()}")
+
+    try:
+        at.run()
+        yield
+        step("choose_mode")
+        at.button[0].click().run()                        # Chat
+        yield
+        step("choose_language")
+        at.button[0].click().run()
+        yield
+        step("greeting")
+        at.text_input[0].input("hi").run()
+        yield
+        step("ask_identity")
+        at.button[0].click().run()                        # Returning patient
+        yield
+        step("get_returning_info")
+        at.text_input[0].input(patient["First_Name"])
+        at.text_input[1].input(patient["Patient_ID"]).run()
+        yield
+        step("main_menu")
+        at.selectbox[0].select("📅 Book an Appointment")
+        at.button[0].click().run()
+        yield
+        step("ask_symptoms")
+        at.text_input[0].input(patient["Symptoms"]).run()
+        yield
+        if state() == "ask_symptoms":
+            result["outcome"] = "no_specialty"
+            return result
+        step("select_doctor")
+        if len(at.selectbox) < 2:
+            result["outcome"] = "no_slot"
+            return result
+        at.selectbox[0].select(rng.choice(at.selectbox[0].options)).run()
+        yield
+        if len(at.selectbox) < 2:
+            result["outcome"] = "no_slot"
+            return result
+        at.button[0].click().run()                        # Confirm Appointment
+        yield
+        step("weather_check")
+        at.button(key="weather_to_payment").click().run()
+        yield
+        step("payment")
+        if at.checkbox[0].disabled:                       # another session is paying for the slot
+            result["outcome"] = "slot_held"
+            return result
+        at.checkbox[0].check().run()
+        yield
+        if state() == "payment":
+            result["outcome"] = "slot_taken"
+            return result
+        step("confirmed")
+        booking = at.session_state.booking
+        result.update(outcome="booked", doctor=booking.doctor, slot=booking.slot)
+        return result
+    except Exception as e:
+        result["outcome"] = "error"
+        result["error"] = str(e)
+        return result
+    finally:
+        result["seconds"] = time.perf_counter() - started
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=DATA_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_worker(sessions, seeds, interleave, timeout):
+    """Run ``sessions`` in one process, ``interleave`` of them in flight at a time."""
+    REGISTRY.reset()
+    pending = list(zip(sessions, seeds))
+    active, results = [], []
+    while pending or active:
+        while pending and len(active) < interleave:
+            patient, seed = pending.pop(0)
+            active.append(simulate_patient(patient, seed, timeout))
+        for flow in list(active):
+            try:
+                next(flow)
+            except StopIteration as done:
+                results.append(done.value)
+                active.remove(flow)
+    return results, REGISTRY.dump()
+
+
+def run(patients, workers, interleave, seed, timeout):
+    REGISTRY.reset()
+    SQLiteStorage.open(os.environ["AVACARE_SQLITE_PATH"])       # seed the shared store once
+    sessions = sample_patients(patients, seed)
+    seeds = list(range(seed, seed + patients))
+    chunks = [(sessions[i::workers], seeds[i::workers]) for i in range(workers)]
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(run_worker, chunk, chunk_seeds, interleave, timeout)
+                   for chunk, chunk_seeds in chunks]
+        for future in futures:
+            worker_results, dump = future.result()
+            results.extend(worker_results)
+            REGISTRY.merge(dump)
+    elapsed = time.perf_counter() - started
+
+    outcomes = Counter(r["outcome"] for r in results)
+    booked = [r for r in results if r["outcome"] == "booked"]
+    per_slot = Counter((r["doctor"], r["slot"]) for r in booked)
+    double_booked = {f"{doctor} {slot}": n for (doctor, slot), n in per_slot.items() if n > 1}
+    spans = REGISTRY.snapshot()
+    states = {
+        row["labels"]["state"]: {k: row[k] for k in ("count", "errors", "p50_s", "p95_s", "p99_s")}
+        for row in spans if row["name"] == "state"
+    }
+    external = Counter()
+    for row in spans:
+        if row["name"] in EXTERNAL_SPANS:
+            external[row["name"]] += row["count"]
+    session_seconds = pd.Series([r["seconds"] for r in results])
+    return {
+        "revision": git_revision(),
+        "run_at": datetime.now().isoformat(timespec="seconds"),
+        "patients": patients,
+        "workers": workers,
+        "interleave": interleave,
+        "seed": seed,
+        "write_behind": os.environ["AVACARE_WRITE_BEHIND"] == "1",
+        "shared_state": "AVACARE_STATE_URL" in os.environ,
+        "elapsed_s": elapsed,
+        "sessions_per_s": patients / elapsed,
+        "bookings_per_s": len(booked) / elapsed,
+        "outcomes": dict(outcomes),
+        "errors": [r["error"] for r in results if r["outcome"] == "error"][:10],
+        "session_p50_s": float(session_seconds.quantile(0.5)),
+        "session_p95_s": float(session_seconds.quantile(0.95)),
+        "states": states,
+        "external_calls": dict(external),
+        "external_calls_per_booking": {k: n / len(booked) for k, n in external.items()} if booked else {},
+        "double_booked": double_booked,
+    }
+
+
+def print_report(report, baseline=None):
+    def delta(value, old):
+        if old in (None, 0):
+            return ""
+        return f" ({(value - old) / old:+.0%})"
+
+    base = baseline or {}
+    print(f"revision {report['revision']}  patients {report['patients']}  "
+          f"workers {report['workers']} x {report['interleave']} sessions"
+          f"{'  write-behind' if report.get('write_behind') else ''}"
+          f"{'  shared state' if report.get('shared_state') else ''}")
+    print(f"elapsed {report['elapsed_s']:.1f}s  sessions/s {report['sessions_per_s']:.2f}"
+          f"{delta(report['sessions_per_s'], base.get('sessions_per_s'))}"
+          f"  bookings/s {report['bookings_per_s']:.2f}"
+          f"{delta(report['bookings_per_s'], base.get('bookings_per_s'))}")
+    print("outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(report["outcomes"].items())))
+    for error in report["errors"]:
+        print(f"  error: {error}")
+    print(f"\n{'state':22} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    base_states = base.get("states", {})
+    for state, row in sorted(report["states"].items(), key=lambda item: -item[1]["p95_s"]):
+        old = base_states.get(state, {}).get("p95_s")
+        print(f"{state:22} {row['count']:6d} {row['p50_s'] * 1000:8.1f} {row['p95_s'] * 1000:8.1f} "
+              f"{row['p99_s'] * 1000:8.1f}{delta(row['p95_s'], old)}")
+    print("\nexternal calls per booking:")
+    base_calls = base.get("external_calls_per_booking", {})
+    for name, n in sorted(report["external_calls_per_booking"].items()):
+        print(f"  {name:16} {n:7.2f}{delta(n, base_calls.get(name))}")
+    if report["double_booked"]:
+        print("\nDOUBLE BOOKINGS:")
+        for slot, n in sorted(report["double_booked"].items()):
+            print(f"  {slot}: {n} confirmations")
+    else:
+        print("\nno double bookings")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent patients booking through app.py")
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4, help="processes, like app replicas on one store")
+    parser.add_argument("--interleave", type=int, default=4, help="sessions in flight per worker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds allowed per script run")
+    parser.add_argument("--out", help=f"where to save the JSON results (default: {RESULTS_DIR}/<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to print deltas against")
+    parser.add_argument("--write-behind", action="store_true", help="queue writes like the Sheets deployment")
+    parser.add_argument("--shared-state", action="store_true", help="coordinate the workers through a shared store")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_local_stand_ins(Path(tmp), args.write_behind, args.shared_state)
+        report = run(args.patients, args.workers, args.interleave, args.seed, args.timeout)
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(report, baseline)
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"\nsaved {out}")
+    sys.exit(1 if report["double_booked"] else 0)
+
+
+if __name__ == "__main__":
+    main()
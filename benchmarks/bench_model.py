@@ -0,0 +1,51 @@
+"""Latency and accuracy of the trained no-show model against the point heuristic.
+
+Both are scored on the model's held-out split. The heuristic counts as
+predicting a no-show when it says Moderate or High.
+
+    python -m benchmarks.bench_model
+"""
+
+import time
+
+import pandas as pd
+
+from avacare.model import MIN_TEST_AUC, MODEL_PATH, NoShowModel, labels, split
+from avacare.risk import LOW_RISK, predict_no_show_risk
+from avacare.storage import PATIENT_CSV
+
+
+def per_call_us(fn, records, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for record in records:
+            fn(record)
+    return (time.perf_counter() - start) / (repeat * len(records)) * 1e6
+
+
+def main():
+    model = NoShowModel.load(MODEL_PATH)
+    _, test_df = split(pd.read_csv(PATIENT_CSV, dtype=str))
+    records = test_df.to_dict("records")
+    y = labels(test_df)
+
+    def heuristic(r):
+        return predict_no_show_risk(r, r["Weather_Condition"], None)
+
+    def trained(r):
+        return model.predict_proba(r)
+
+    heuristic_hits = [(heuristic(r) != LOW_RISK) == bool(label) for r, label in zip(records, y)]
+    model_hits = [(trained(r) >= 0.5) == bool(label) for r, label in zip(records, y)]
+
+    print(f"held-out rows: {len(records)}  model features: {', '.join(model.features)}")
+    print(f"{'':10} {'us/call':>8} {'accuracy':>9}")
+    print(f"{'heuristic':10} {per_call_us(heuristic, records):8.2f} {sum(heuristic_hits) / len(records):9.3f}")
+    print(f"{'model':10} {per_call_us(trained, records):8.2f} {sum(model_hits) / len(records):9.3f}")
+    print("note: the heuristic reads Missed_Appointments, which the label is derived from")
+    shown = "shown" if model.is_reliable() else "hidden"
+    print(f"test AUC {model.metrics.get('test_auc')} (minimum {MIN_TEST_AUC}): the estimate is {shown} in the app")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Batch vs scalar no-show risk scoring over the bundled patient table.
+
+Checks that score_no_show_risk_frame agrees with predict_no_show_risk on every
+row (including edge-case rows appended below) and reports the speed-up.
+
+    python -m benchmarks.bench_risk [--copies N]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import pandas as pd
+
+from avacare.risk import no_show_risk_score, predict_no_show_risk, score_no_show_risk_frame
+from avacare.storage import PATIENT_CSV
+
+EDGE_CASES = [
+    {"Missed_Appointments": " 1 ", "Risk_Category": "Moderate", "Weather_Condition": "Light Snow", "slot": "2025-05-05 09:35"},
+    {"Missed_Appointments": "0", "Risk_Category": "HIGH", "Weather_Condition": "Thunderstorm", "slot": "2025-05-05 9:00"},
+    {"Missed_Appointments": "3", "Risk_Category": "", "Weather_Condition": "", "slot": "2025-05-05"},
+    {"Missed_Appointments": "2", "Risk_Category": "Mid", "Weather_Condition": "Sunny", "slot": None},
+    {"Missed_Appointments": "-1", "Risk_Category": "Low", "Weather_Condition": "Rainy", "slot": "2025-05-05 xx:00"},
+]
+
+
+def load_cases(copies=1):
+    patients = pd.concat([pd.read_csv(PATIENT_CSV, dtype=str)] * copies, ignore_index=True)
+    rng = random.Random(7)
+    times = ["09:00", "09:35", "10:10", "12:30", "16:35"]
+    patients["slot"] = [f"{date} {rng.choice(times)}" for date in patients["Appointment_Date"]]
+    return pd.concat([patients, pd.DataFrame(EDGE_CASES)], ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--copies", type=int, default=1, help="score N copies of the table")
+    args = parser.parse_args()
+
+    cases = load_cases(args.copies)
+    records = cases.to_dict("records")
+
+    start = time.perf_counter()
+    labels = [predict_no_show_risk(r, r["Weather_Condition"], r["slot"]) for r in records]
+    scalar_time = time.perf_counter() - start
+    scores = [no_show_risk_score(r, r["Weather_Condition"], r["slot"]) for r in records]
+    scalar = list(zip(scores, labels))
+
+    start = time.perf_counter()
+    batch = score_no_show_risk_frame(cases, slots=cases["slot"])
+    batch_time = time.perf_counter() - start
+
+    mismatches = [
+        i for i, (score, label) in enumerate(scalar)
+        if batch["No_Show_Score"].iat[i] != score or batch["No_Show_Risk"].iat[i] != label
+    ]
+    print(f"rows: {len(cases)}")
+    print(f"scalar: {scalar_time * 1000:.1f} ms  batch: {batch_time * 1000:.1f} ms  "
+          f"speed-up: {scalar_time / batch_time:.1f}x")
+    if mismatches:
+        print(f"MISMATCH on rows {mismatches[:10]}")
+        return 1
+    print("batch scores match the scalar function on every row")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Parsing the bundled CSV/XLSX files vs loading the columnar snapshot.
+
+Ingests a snapshot into a temporary directory, then reports, per table, the
+time to get a frame and its in-memory size, for the string frames parsed from
+the sources and the typed frames mapped from the snapshot. It also times
+seeding an in-memory SQLite backend both ways and checks that the snapshot
+gives back exactly the source strings.
+
+    python -m benchmarks.bench_snapshot [--repeat 5]
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+
+from avacare import snapshot
+from avacare.storage import SQLiteStorage
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        _, ingest_s = best_of(1, lambda: snapshot.ingest(directory))
+        print(f"ingest: {ingest_s * 1000:.0f} ms\n")
+
+        sources, parse_s = best_of(args.repeat, snapshot.read_sources)
+        frames, load_s = best_of(args.repeat, lambda: {t: snapshot.load_frame(t, directory) for t in snapshot.TABLES})
+        print(f"{'table':13} {'parsed MB':>10} {'mapped MB':>10}")
+        for table in snapshot.TABLES:
+            parsed = sources[table].memory_usage(deep=True).sum() / 1e6
+            mapped = frames[table].memory_usage(deep=True).sum() / 1e6
+            print(f"{table:13} {parsed:10.2f} {mapped:10.2f}")
+        print(f"\nall tables: parse {parse_s * 1000:.0f} ms, map {load_s * 1000:.1f} ms "
+              f"({parse_s / load_s:.0f}x)")
+
+        def seed(use_snapshot):
+            storage = SQLiteStorage()
+            if use_snapshot:
+                frames = snapshot.sheet_frames(directory)
+            else:
+                frames = snapshot.read_sources()
+            for table, frame in frames.items():
+                storage.db.create_table(table, frame)
+            return storage
+
+        _, seed_sources_s = best_of(args.repeat, lambda: seed(False))
+        _, seed_snapshot_s = best_of(args.repeat, lambda: seed(True))
+        print(f"seed SQLite: from sources {seed_sources_s * 1000:.0f} ms, from snapshot {seed_snapshot_s * 1000:.0f} ms")
+
+        strings = snapshot.sheet_frames(directory)
+        mismatched = []
+        for table in snapshot.TABLES:
+            expected = sources[table]
+            expected = expected[[c for c in expected.columns if not str(c).startswith("Unnamed")]]
+            if not expected.fillna("").astype(str).reset_index(drop=True).equals(strings[table]):
+                mismatched.append(table)
+    if mismatched:
+        print(f"\nFAIL: snapshot differs from the sources in {', '.join(mismatched)}")
+        sys.exit(1)
+    print("\nsnapshot round-trips to the source strings in every table")
+
+
+if __name__ == "__main__":
+    main()
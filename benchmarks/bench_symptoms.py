@@ -0,0 +1,48 @@
+"""Throughput and agreement of the symptom matcher on the patient dataset.
+
+Every ``Symptoms`` string in the CSV is matched as typed and with one
+character dropped from each symptom; the top specialty is compared with the
+row's ``Suggested_Specialty``.
+
+    python -m benchmarks.bench_symptoms
+"""
+
+import csv
+import random
+import time
+
+from avacare.storage import PATIENT_CSV
+from avacare.symptoms import SymptomMatcher
+
+
+def misspell(text, rng):
+    parts = []
+    for symptom in text.split(", "):
+        i = rng.randrange(1, len(symptom))
+        parts.append(symptom[:i] + symptom[i + 1:])
+    return ", ".join(parts)
+
+
+def run(matcher, queries, label):
+    start = time.perf_counter()
+    hits = sum(matcher.match(text) == expected for text, expected in queries)
+    elapsed = time.perf_counter() - start
+    print(f"{label:12} {len(queries) / elapsed:10,.0f} queries/s  agreement {hits / len(queries):.3f}")
+
+
+def main():
+    start = time.perf_counter()
+    matcher = SymptomMatcher.from_sources()
+    print(f"build: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    with open(PATIENT_CSV, newline="", encoding="utf-8") as f:
+        rows = [(r["Symptoms"], r["Suggested_Specialty"]) for r in csv.DictReader(f)]
+    rng = random.Random(3)
+    run(matcher, rows, "exact")
+    run(matcher, [(misspell(text, rng), expected) for text, expected in rows], "typos")
+    # Second pass hits the per-token correction cache
+    run(matcher, [(misspell(text, rng), expected) for text, expected in rows], "typos (warm)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+from avacare.analytics import ClinicAnalytics
+from avacare.storage import SQLiteStorage
+
+
+def patient(patient_id, traveling_from, missed):
+    return {"Patient_ID": patient_id, "Traveling_From": traveling_from, "Missed_Appointments": missed,
+            "Weather_Condition": "Sunny", "Insurance_Type": "Private"}
+
+
+def test_no_show_rate_groups_traveling_from_by_city():
+    analytics = ClinicAnalytics(patients=[
+        patient("P1", "New Mathewmouth, Dallas, TX", 2),
+        patient("P2", "East Emilyberg, Dallas, TX", 0),
+        patient("P3", "Lisaborough,  Austin , TX", 1),
+    ])
+    analytics.patient_changed(patient("P4", "West Frederickfort, Dallas, TX", 0))
+
+    assert analytics.no_show_rate("Traveling_From") == [
+        {"Traveling_From": "Dallas", "patients": 3, "no_shows": 1, "no_show_rate": 1 / 3},
+        {"Traveling_From": "Austin", "patients": 1, "no_shows": 1, "no_show_rate": 1.0},
+    ]
+
+
+def test_bundled_patients_fall_into_few_city_groups():
+    analytics = ClinicAnalytics(patients=SQLiteStorage.open().patients.all())
+    assert len(analytics.no_show_rate("Traveling_From")) < 10
@@ -0,0 +1,13 @@
+import statistics
+
+from benchmarks.bench_import import BUDGET_MS, TARGET, importtime, loaded_heavy_modules, total_ms
+
+
+def test_no_heavy_module_is_imported_at_startup():
+    assert loaded_heavy_modules(TARGET) == []
+
+
+def test_app_modules_import_within_budget():
+    startup = set(importtime("pass"))
+    median = statistics.median(total_ms(importtime(TARGET), startup) for _ in range(5))
+    assert median <= BUDGET_MS
@@ -0,0 +1,132 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from avacare.risk import (
+    HIGH_RISK,
+    LOW_RISK,
+    MODERATE_RISK,
+    no_show_risk_score,
+    predict_no_show_risk,
+    risk_report,
+    score_no_show_risk_frame,
+)
+from avacare.storage import PATIENT_CSV
+
+MISSED = ["0", "1", "2", "5", " 3 ", "", "abc", "1.5", None, "-1"]
+CATEGORIES = ["High", "moderate risk", "Low", "", "HIGH", "Moderate", "low", "high", "", "Moderate"]
+WEATHER = ["Rain", "Clear", "Snow", "thunderstorm", "", "Sunny", "snow", "Clouds", "Rain", "Clear"]
+SLOTS = ["2025-06-01 09:00", "2025-06-01 10:30", "2025-06-01 7:15", "bad", "", "2025-06-01",
+         "2025-06-01 xx:00", "2025-06-01 11:00", "2025-06-01 08:00", "2025-06-01 10:00"]
+
+
+@pytest.fixture
+def patients():
+    # A shuffled index, so scores must be aligned by label rather than position
+    return pd.DataFrame(
+        {"Missed_Appointments": MISSED, "Risk_Category": CATEGORIES, "Weather_Condition": WEATHER},
+        index=[7, 3, 9, 0, 5, 1, 8, 2, 6, 4],
+    )
+
+
+def expected(record, weather, slot):
+    """The scalar functions' result, or ``(None, None)`` where they reject the row."""
+    try:
+        score = no_show_risk_score(record, weather, slot)
+    except ValueError:
+        return None, None
+    return score, predict_no_show_risk(record, weather, slot)
+
+
+def assert_matches(df, scored, weather=None, slots=None):
+    assert list(scored.index) == list(df.index)
+    for label, row in df.iterrows():
+        record = {k: v for k, v in row.items()}
+        row_weather = row.get("Weather_Condition", "") if weather is None else weather
+        if isinstance(row_weather, pd.Series):
+            row_weather = row_weather[label]
+        slot = "" if slots is None else slots if isinstance(slots, str) else slots[label]
+        score, risk = expected(record, row_weather, slot)
+        got_score, got_risk = scored.loc[label, "No_Show_Score"], scored.loc[label, "No_Show_Risk"]
+        if score is None:
+            assert pd.isna(got_score) and pd.isna(got_risk), (label, record)
+        else:
+            assert (got_score, got_risk) == (score, risk), (label, record)
+
+
+def test_matches_scalar_with_row_weather(patients):
+    assert_matches(patients, score_no_show_risk_frame(patients))
+
+
+def test_invalid_missed_appointments_are_rejected(patients):
+    scored = score_no_show_risk_frame(patients)
+    invalid = patients["Missed_Appointments"].isin(["", "abc", "1.5"]) | patients["Missed_Appointments"].isna()
+    assert scored.loc[invalid, "No_Show_Score"].isna().all()
+    assert scored.loc[invalid, "No_Show_Risk"].isna().all()
+    assert scored.loc[~invalid, "No_Show_Risk"].notna().all()
+
+
+@pytest.mark.parametrize("weather", ["Heavy rain expected", "Light snow", "Clear skies"])
+def test_matches_scalar_with_one_forecast(patients, weather):
+    assert_matches(patients, score_no_show_risk_frame(patients, weather=weather), weather=weather)
+
+
+def test_matches_scalar_with_forecast_and_slot_series(patients):
+    weather = pd.Series(list(reversed(WEATHER)), index=patients.index[::-1])
+    slots = pd.Series(SLOTS, index=patients.index[::-1])
+    scored = score_no_show_risk_frame(patients, weather=weather, slots=slots)
+    assert_matches(patients, scored, weather=weather, slots=slots)
+
+
+def test_matches_scalar_with_one_slot(patients):
+    scored = score_no_show_risk_frame(patients, slots="2025-06-01 08:30")
+    assert_matches(patients, scored, slots="2025-06-01 08:30")
+
+
+@pytest.mark.parametrize("column", ["Missed_Appointments", "Risk_Category", "Weather_Condition"])
+def test_matches_scalar_without_column(patients, column):
+    df = patients.drop(columns=column)
+    assert_matches(df, score_no_show_risk_frame(df, slots=pd.Series(SLOTS, index=df.index)),
+                   slots=pd.Series(SLOTS, index=df.index))
+
+
+DAY_FRAME = {
+    "Missed_Appointments": ["2", "0", "3", "0", "1", "0", "4", "abc"],
+    "Risk_Category": ["High", "Low", "High", "Low", "Moderate", "Moderate", "High", "High"],
+    "Weather_Condition": ["Rain", "Clear", "Clear", "Clear", "Clear", "Clear", "Rain", "Rain"],
+    "Appointment_Date": ["01-06-2025", "01-06-2025", "01-06-2025", "01-06-2025",
+                         "02-06-2025", "02-06-2025", "02-06-2025", "01-06-2025"],
+}
+
+
+def test_risk_report_has_no_rate_from_the_scoring_inputs():
+    # Every High and Moderate patient has missed an appointment, so a rate read
+    # off Missed_Appointments would be 1.0 for both labels
+    df = pd.read_csv(PATIENT_CSV, dtype=str)
+    report, overbook = risk_report(df, date(2025, 6, 2))
+    assert report["appointments"].sum() > 0
+    assert report["no_show_rate"].isna().all()
+    assert overbook is None
+
+
+def test_risk_report_uses_given_rates_for_the_day_only():
+    df = pd.DataFrame(DAY_FRAME)
+    rates = {HIGH_RISK: 0.5, MODERATE_RISK: 0.25, LOW_RISK: 0.25}
+    report, overbook = risk_report(df, date(2025, 6, 1), no_show_rates=rates, max_share=1.0)
+    assert list(report.index) == [HIGH_RISK, MODERATE_RISK, LOW_RISK]
+    # The invalid row is neither scored nor counted
+    assert report["patients"].sum() == 7
+    assert report["appointments"].tolist() == [1, 1, 2]
+    assert report["expected_no_shows"].tolist() == [0.5, 0.25, 0.5]
+    assert overbook == 1
+
+    _, later = risk_report(df, date(2025, 7, 1), no_show_rates=rates)
+    assert later == 0
+
+
+def test_risk_report_caps_the_suggestion():
+    df = pd.DataFrame(dict(DAY_FRAME, Appointment_Date=["01-06-2025"] * 8))
+    rates = {HIGH_RISK: 1.0, MODERATE_RISK: 1.0, LOW_RISK: 1.0}
+    _, overbook = risk_report(df, date(2025, 6, 1), no_show_rates=rates, max_share=0.3)
+    assert overbook == 2
@@ -0,0 +1,37 @@
+from avacare.engine import STALE_CLAIM_AFTER, BookingEngine, Services
+from avacare.shared_state import SharedState, SQLiteStore
+from avacare.slots import OPEN, slot_key, slot_label
+from avacare.storage import SQLiteStorage
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def replica(storage, shared):
+    return BookingEngine(Services(storage, weather_provider=None, shared_state=shared))
+
+
+def test_slot_reopened_in_the_sheet_can_be_booked_again():
+    storage = SQLiteStorage.open()
+    clock = Clock()
+    shared = SharedState(SQLiteStore(":memory:", clock=clock))
+    first = replica(storage, shared)
+    slot = next(s for s in first.services.slots.slots() if s["Slot_Status"] == OPEN)
+    doctor, label = slot["Doctor_ID"], slot_label(slot)
+
+    assert first.book(doctor, label, holder="a")
+    # Staff cancel the booking directly in the sheet
+    storage.availability.set_status(slot["row"], OPEN)
+
+    second = replica(storage, shared)
+    # A claim this young may belong to a booking still being written
+    assert not second.book(doctor, label, holder="b")
+    clock.now += STALE_CLAIM_AFTER
+    assert second.book(doctor, label, holder="b")
+    assert shared.owner("slot:" + "|".join(slot_key(slot))) == "b"
+    assert not replica(storage, shared).book(doctor, label, holder="c")
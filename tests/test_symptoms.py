@@ -0,0 +1,26 @@
+import pytest
+
+from avacare.symptoms import SymptomMatcher
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return SymptomMatcher.from_sources()
+
+
+@pytest.mark.parametrize("text", ["chest pain", "pain", "skin", "ear ache", "stomach ache", "brain fog"])
+def test_partly_covered_phrase_matches_nothing(matcher, text):
+    assert matcher.match(text) is None
+
+
+@pytest.mark.parametrize("text, specialty", [
+    ("back pain", "Orthopedic"),
+    ("Back Pains", "Orthopedic"),
+    ("child fever", "Pediatrics"),
+    ("fever and cough", "General Physician"),
+    ("my tooth hurts", "Dentist"),
+    ("tootache", "Dentist"),
+    ("pain during periods", "Gynecologist"),
+])
+def test_covered_phrase_matches(matcher, text, specialty):
+    assert matcher.match(text) == specialty
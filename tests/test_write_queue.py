@@ -0,0 +1,32 @@
+from avacare.slots import FILLED, OPEN, SlotIndex
+from avacare.storage import SQLiteStorage
+from avacare.write_queue import Flusher, WriteQueue
+
+
+def open_slots(index, n):
+    return [(s["row"], (s["Doctor_ID"], s["Date"], s["Start_Time"]))
+            for s in index.slots() if s["Slot_Status"] == OPEN][:n]
+
+
+def test_coalesced_slot_updates_flush_without_false_conflicts():
+    storage = SQLiteStorage.open()
+    queue = WriteQueue(":memory:")
+    index = SlotIndex(storage.availability, queue=queue)
+    (cancelled_row, cancelled), (rebooked_row, rebooked), (taken_row, taken) = open_slots(index, 3)
+
+    index.book(*cancelled)
+    index.release(*cancelled)
+    index.book(*rebooked)
+    index.release(*rebooked)
+    index.book(*rebooked)
+    index.book(*taken)
+    # Filled directly in the sheet before the flush
+    storage.availability.set_status(taken_row, FILLED)
+
+    Flusher(queue, storage).flush()
+
+    statuses = {i + 2: r["Slot_Status"] for i, r in enumerate(storage.availability.all())}
+    assert statuses[cancelled_row] == OPEN
+    assert statuses[rebooked_row] == FILLED
+    assert [c["payload"]["row_number"] for c in queue.conflicts()] == [taken_row]
+    assert queue.depth() == 0